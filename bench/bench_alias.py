@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# bench_alias.py
+#
+# Compare aliases done as a chain of FunctionHooks, each with its own regex,
+# with a single AliasList holding the same aliases.
+
+import os
+import re
+import sys
+import time
+import random
+import string
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.mdflib import hooks
+from mudblood.stats import Stats
+
+class FakeSession:
+    def __init__(self):
+        self.stats = Stats()
+        self.sent = []
+
+def make_words(n):
+    return ["".join(random.choice(string.ascii_lowercase) for i in range(random.randint(2, 8)))
+            for j in range(n)]
+
+def regex_alias(name, body):
+    regex = re.compile(r"^%s(?: (.*))?$" % re.escape(name))
+    def cond(session, line):
+        return regex.match(line.rstrip("\n"))
+    def fun(session, line):
+        session.sent.append(body)
+    return hooks.FunctionHook(cond, fun)
+
+def run_chain(chain, lines):
+    session = FakeSession()
+    t0 = time.time()
+    for l in lines:
+        for h in chain:
+            l = h.process(session, l)
+            if not l:
+                break
+    return time.time() - t0
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-a", "--aliases", dest="aliases", type="int", default=300)
+    parser.add_option("-n", "--lines", dest="lines", type="int", default=20000)
+    parser.add_option("-m", "--match-rate", dest="rate", type="float", default=0.5,
+                      help="Fraction of lines that start with an alias")
+    (options, args) = parser.parse_args()
+
+    random.seed(0)
+    names = list(set(make_words(options.aliases * 2)))[:options.aliases]
+    filler = make_words(200)
+
+    lines = []
+    for i in range(options.lines):
+        words = [random.choice(filler) for j in range(random.randint(1, 4))]
+        if random.random() < options.rate:
+            words[0] = random.choice(names)
+        lines.append(" ".join(words) + "\n")
+
+    chain = []
+    al = hooks.AliasList()
+    for n in names:
+        chain.append(regex_alias(n, "sag %s" % n))
+        al.add(n, "sag %s" % n)
+
+    old = run_chain(chain, lines)
+    new = run_chain([al], lines)
+
+    print "aliases=%d lines=%d" % (len(names), options.lines)
+    print "chained hooks: %.3fs (%.1fus/line)" % (old, old / options.lines * 1e6)
+    print "alias list:    %.3fs (%.1fus/line)" % (new, new / options.lines * 1e6)
+
+if __name__ == "__main__":
+    main()
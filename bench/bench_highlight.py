@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# bench_highlight.py
+#
+# Compare a chain of HighlightHooks with a single HighlightList holding the
+# same rules.
+
+import os
+import sys
+import time
+import random
+import string
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.mdflib import hooks
+
+def make_words(n):
+    return ["".join(random.choice(string.ascii_lowercase) for i in range(random.randint(3, 9)))
+            for j in range(n)]
+
+def run_chain(chain, lines):
+    t0 = time.time()
+    for l in lines:
+        for h in chain:
+            l = h.process(None, l)
+    return time.time() - t0
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-r", "--rules", dest="rules", type="int", default=50)
+    parser.add_option("-n", "--lines", dest="lines", type="int", default=20000)
+    parser.add_option("-m", "--match-rate", dest="rate", type="float", default=0.2,
+                      help="Fraction of lines that contain a highlighted word")
+    (options, args) = parser.parse_args()
+
+    random.seed(0)
+    targets = make_words(options.rules)
+    filler = make_words(500)
+
+    lines = []
+    for i in range(options.lines):
+        words = [random.choice(filler) for j in range(12)]
+        if random.random() < options.rate:
+            words[random.randint(0, 11)] = random.choice(targets)
+        lines.append(" ".join(words) + "\n")
+
+    chain = []
+    hl = hooks.HighlightList()
+    for i in range(options.rules):
+        if i % 5 == 0:
+            chain.append(hooks.HighlightLineHook(targets[i], i % 8))
+            hl.add(targets[i], i % 8, whole_line=True)
+        else:
+            chain.append(hooks.HighlightHook(targets[i], i % 8))
+            hl.add(targets[i], i % 8)
+
+    old = run_chain(chain, lines)
+    new = run_chain([hl], lines)
+
+    print "rules=%d lines=%d" % (options.rules, options.lines)
+    print "chained hooks:  %.3fs (%.1fus/line)" % (old, old / options.lines * 1e6)
+    print "highlight list: %.3fs (%.1fus/line)" % (new, new / options.lines * 1e6)
+
+if __name__ == "__main__":
+    main()
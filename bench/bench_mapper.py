@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# bench_mapper.py
+#
+# Measure how many moves per second the mapper handles in auto mode on maps
+# of different sizes. Each map is a square grid of rooms. The moves run just
+# below its lower edge, starting from the bottom left room: one move south
+# and one east that each create a new room, then one north back into the
+# grid that closes a cycle. So every third move closes a cycle. Finally the
+# map is rendered once.
+#
+# With --check, random sequences of moves, "map nocycle", undo and "map
+# split" are run instead, and after each step every room must be found
+# through the coordinate index just like by scanning all rooms.
+
+import os
+import sys
+import time
+import random
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.map import Mapper, Room, Edge
+import mudblood.mud_base as mud
+
+def build_grid(mapper, size):
+    m = mapper.map
+    rooms = {}
+    for y in range(size):
+        for x in range(size):
+            rooms[(x, y)] = m.current_room if (x, y) == (0, 0) else m.add(Room(mud))
+    for y in range(size):
+        for x in range(size):
+            if x + 1 < size:
+                Edge(rooms[(x, y)], "o", rooms[(x+1, y)], "w")
+            if y + 1 < size:
+                Edge(rooms[(x, y)], "s", rooms[(x, y+1)], "n")
+    m.update_coords()
+    return rooms
+
+def run(rooms, options):
+    mapper = Mapper(mud)
+    size = int(rooms ** 0.5)
+    grid = build_grid(mapper, size)
+    mapper.map.current_room = grid[(0, size - 1)]
+    mapper.mode = "auto"
+
+    moves = ["s", "o", "n"] * (min(options.moves, size - 1) / 3)
+    cycles = 0
+    t0 = time.time()
+    for d in moves:
+        if mapper.handle_input(d) == 10:
+            cycles += 1
+    elapsed = time.time() - t0
+
+    t0 = time.time()
+    mapper.map.render(True)
+    rendering = time.time() - t0
+
+    print "rooms=%-7d moves=%d cycles=%d %.3fs %.1f moves/s, render %.1fms" % (
+            size * size, len(moves), cycles, elapsed, len(moves) / elapsed, rendering * 1000)
+
+def check_index(m):
+    """
+        Compare Map.room_at() with a scan of all rooms, which finds the
+        oldest room at the given coordinates.
+    """
+    for r in m.rooms.itervalues():
+        oldest = min([o for o in m.rooms.itervalues()
+                      if o.compid() == r.compid() and (o.x, o.y) == (r.x, r.y)],
+                     key=lambda o: o.roomid)
+        if m.room_at(r.compid(), r.x, r.y) is not oldest:
+            return False
+    return True
+
+def check(options):
+    rnd = random.Random(options.seed)
+    directions = ["n", "s", "o", "w", "no", "nw", "so", "sw"]
+    ops = ["go", "go", "go", "nocycle", "undo", "split"]
+    failures = 0
+    for run in range(options.runs):
+        mapper = Mapper(mud)
+        mapper.mode = "auto"
+        history = []
+        for i in range(options.moves):
+            op = rnd.choice(ops)
+            if op == "go":
+                mapper.handle_input(rnd.choice(directions))
+            elif op == "nocycle":
+                mapper.cmd_nocycle()
+            elif op == "undo":
+                mapper.undo()
+            elif op == "split" and len(mapper.move_stack) >= 2:
+                mapper.cmd_split()
+            history.append(op)
+            mapper.map.place_pending()
+            if not check_index(mapper.map):
+                failures += 1
+                print "index miss after %s" % ", ".join(history[-3:])
+                break
+    print "%d runs of %d steps, %d with index misses" % (options.runs, options.moves, failures)
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-r", "--rooms", dest="rooms", type="int", action="append",
+                      help="Rooms in the map (default: 1000, 10000, 40000)")
+    parser.add_option("-m", "--moves", dest="moves", type="int", default=150)
+    parser.add_option("-c", "--check", dest="check", action="store_true", default=False,
+                      help="Check the coordinate index instead of measuring")
+    parser.add_option("--runs", dest="runs", type="int", default=200)
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args()
+
+    if options.check:
+        check(options)
+        return
+
+    for n in options.rooms or [1000, 10000, 40000]:
+        run(n, options)
+
+if __name__ == "__main__":
+    main()
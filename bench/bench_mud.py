@@ -0,0 +1,35 @@
+# A MUD definition for benchmarks. It is meant to look like a definition
+# somebody actually plays with: a few hundred triggers, a set of highlights,
+# substitutions, gags and a block capture.
+
+from mud_base import *
+
+import random as _random
+
+_rnd = _random.Random(42)
+_letters = "abcdefghijklmnopqrstuvwxyz"
+
+def _word():
+    return "".join(_rnd.choice(_letters) for i in range(_rnd.randint(4, 9)))
+
+# Triggers. Most of them never fire, a few do.
+for _i in range(300):
+    triggers.add(hooks.Trigger(r"^(\w+) %s dich %s" % (_word(), _word()), "sag %s"))
+triggers.add(hooks.Trigger(r"Ein Wolf kommt von (\w+)", "schau %s"))
+triggers.add(hooks.Trigger(r"Gold liegt hier", "nimm gold"))
+triggers.add(hooks.Trigger(u"Sonne scheint sch\xf6n", "freue"))
+
+# Highlights
+for _w, _c in [("Ork", 1), ("Zwerg", 2), ("Wolf", 3), ("Gold", 3), ("Norden", 4), ("osten", 4), ("westen", 4), (u"sch\xf6n", 5)]:
+    highlights.add(_w, _c)
+highlights.add("trifft dich", 1, priority=1, whole_line=True)
+for _i in range(30):
+    highlights.add(_word(), _i % 8)
+
+input_hooks.append(hooks.SubstituteHook("sehr hart", "SEHR HART"))
+input_hooks.append(hooks.SuppressHook("^Es gibt drei sichtbare"))
+
+def _inventory(session, lines):
+    pass
+
+input_hooks.append(hooks.CaptureTrigger("^Du traegst:", _inventory, end=r"^\.$", gag=True))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# bench_path.py
+#
+# Measure shortest path queries on a synthetic map: a square grid of rooms
+# with some of its edges missing and a few one-way portals. Queries go
+# between rooms a few steps apart and between random rooms, without the
+# route cache. The previous implementation of Mapper.find_shortest_path,
+# which explored the whole map with a Dijkstra that kept its state in the
+# rooms, is included for comparison.
+#
+# Then the same few hub rooms are queried over and over (which the route
+# cache answers), and exits are added and removed between queries to
+# measure how long repairing the graph, the landmark tables and the cache
+# takes.
+#
+# Finally the nearest of several target rooms is searched, once with one
+# query per target and once with a single search. With --weights, some of
+# the grid's exits weigh more than 1, and searches are A* on the landmark
+# distances.
+
+import os
+import sys
+import time
+import random
+
+from heapq import heappush, heappop
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.map import Map, Room, Edge
+from mudblood.pathfind import Landmarks
+import mudblood.mud_base as mud
+
+def build_map(rooms, holes, portals, weights):
+    m = Map(mud)
+    size = int(rooms ** 0.5)
+    grid = {}
+    for y in range(size):
+        for x in range(size):
+            grid[(x, y)] = m.current_room if (x, y) == (0, 0) else m.add(Room(mud))
+    for y in range(size):
+        for x in range(size):
+            if x + 1 < size and random.random() >= holes:
+                e = Edge(grid[(x, y)], "o", grid[(x+1, y)], "w")
+                if random.random() < weights:
+                    e.weight = random.randint(2, 5)
+            if y + 1 < size and random.random() >= holes:
+                e = Edge(grid[(x, y)], "s", grid[(x, y+1)], "n")
+                if random.random() < weights:
+                    e.weight = random.randint(2, 5)
+    all_rooms = grid.values()
+    for i in range(portals):
+        a, b = random.choice(all_rooms), random.choice(all_rooms)
+        if "portal" not in a.exits and a is not b:
+            e = Edge(a, "portal", b, "portal back")
+            e.set_name(b, "")
+    return m, all_rooms
+
+def old_find_shortest_path(source, target):
+    source.shortest_path = []
+    source.distance = 0
+    pq = [(0, source)]
+    mark = time.time()
+
+    while len(pq) > 0:
+        curdist, curroom = heappop(pq)
+        curroom.old_mark = mark
+        for name,e in curroom.iter_exits():
+            if e.nowalk:
+                continue
+            to = e.to(curroom)
+            if getattr(to, "old_mark", None) != mark or to.distance > curdist + 1:
+                to.old_mark = mark
+                to.shortest_path = curroom.shortest_path + [name]
+                to.distance = curdist + 1
+                heappush(pq, (curdist + 1, to))
+
+    if getattr(target, "old_mark", None) == mark:
+        return target.shortest_path
+    return None
+
+def nearby(room, steps):
+    for i in range(steps):
+        exits = room.exits.values()
+        if not exits:
+            break
+        room = random.choice(exits).to(room)
+    return room
+
+def uncached(paths):
+    def find(s, t):
+        paths.routes.clear()
+        paths.route_index.clear()
+        return paths.find(s, t)
+    return find
+
+def run(name, find, queries):
+    t0 = time.time()
+    lengths = 0
+    for s, t in queries:
+        p = find(s, t)
+        lengths += p and len(p) or 0
+    elapsed = time.time() - t0
+    print "  %-14s %8.3fms/query (total path length %d)" % (
+            name, elapsed / len(queries) * 1000, lengths)
+
+def repairs(m, rooms, hubs, changes):
+    """
+        Add an exit between rooms a few steps apart or remove it again,
+        then query between hubs again.
+    """
+    added = []
+    t_repair = t_query = 0.0
+    for i in range(changes):
+        if added and i % 2:
+            added.pop().remove()
+        else:
+            a = random.choice(rooms)
+            b = nearby(a, random.randint(2, 10))
+            if "shortcut" in a.exits or "shortcut" in b.exits or a is b:
+                continue
+            added.append(Edge(a, "shortcut", b, "shortcut"))
+        t0 = time.time()
+        m.paths.graph()
+        t1 = time.time()
+        for s in hubs:
+            for t in hubs:
+                m.paths.find(s, t)
+        t2 = time.time()
+        t_repair += t1 - t0
+        t_query += t2 - t1
+    print "  %d changes: repair %.2fms/change, then %.1fus/query" % (
+            changes, t_repair / changes * 1000, t_query / changes / len(hubs) ** 2 * 1000000)
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-r", "--rooms", dest="rooms", type="int", default=100000)
+    parser.add_option("-n", "--queries", dest="queries", type="int", default=200)
+    parser.add_option("--holes", dest="holes", type="float", default=0.1,
+                      help="Fraction of grid edges that are missing")
+    parser.add_option("--portals", dest="portals", type="int", default=50)
+    parser.add_option("--weights", dest="weights", type="float", default=0.0,
+                      help="Fraction of grid edges that weigh 2-5")
+    parser.add_option("--old", dest="old", type="int", default=5,
+                      help="Queries to run with the old implementation")
+    parser.add_option("--hubs", dest="hubs", type="int", default=10)
+    parser.add_option("--changes", dest="changes", type="int", default=50)
+    parser.add_option("--targets", dest="targets", type="int", default=30,
+                      help="Rooms to find the nearest of")
+    (options, args) = parser.parse_args()
+
+    random.seed(1)
+    t0 = time.time()
+    m, rooms = build_map(options.rooms, options.holes, options.portals, options.weights)
+    if options.weights:
+        # The old implementation counted every exit as one step
+        options.old = 0
+    print "rooms=%d built in %.1fs" % (len(m.rooms), time.time() - t0)
+
+    t0 = time.time()
+    g = m.paths.graph()
+    print "graph snapshot: %.0fms" % ((time.time() - t0) * 1000)
+
+    t0 = time.time()
+    m.paths.landmarks = Landmarks(g, m.paths.landmark_count)
+    print "%d landmarks: %.0fms" % (len(m.paths.landmarks.tables), (time.time() - t0) * 1000)
+
+    near = []
+    far = []
+    for i in range(options.queries):
+        s = random.choice(rooms)
+        near.append((s, nearby(s, random.randint(2, 10))))
+        far.append((s, random.choice(rooms)))
+
+    for title, queries in (("near (2-10 moves)", near), ("random pairs", far)):
+        print title
+        if options.old:
+            run("old", old_find_shortest_path, queries[:options.old])
+        run(options.weights and "a*" or "bidirectional", uncached(m.paths), queries)
+
+    hubs = random.sample(rooms, options.hubs)
+    pairs = [(s, t) for s in hubs for t in hubs] * 10
+    print "%d hubs, every pair 10 times" % len(hubs)
+    run("cached", m.paths.find, pairs)
+    pairs = [(s, t) for s in hubs for t in hubs]
+    t0 = time.time()
+    for i in range(100):
+        for s, t in pairs:
+            m.paths.find(s, t)
+    print "  %-14s %8.1fus/query" % ("cache hits", (time.time() - t0) / len(pairs) / 100 * 1000000)
+    repairs(m, rooms, hubs, options.changes)
+
+    targets = random.sample(rooms, options.targets)
+    sources = [s for s, t in far[:20]]
+    print "nearest of %d rooms" % len(targets)
+    find = uncached(m.paths)
+    t0 = time.time()
+    for s in sources:
+        min([p for p in [find(s, t) for t in targets] if p is not None] or [None], key=len)
+    print "  %-14s %8.3fms/query" % ("one by one", (time.time() - t0) / len(sources) * 1000)
+    t0 = time.time()
+    for s in sources:
+        m.paths.nearest(s, targets)
+    print "  %-14s %8.3fms/query" % ("single search", (time.time() - t0) / len(sources) * 1000)
+    print "\n".join(["  " + l for l in m.paths.report()])
+
+if __name__ == "__main__":
+    main()
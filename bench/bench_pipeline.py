@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# bench_pipeline.py
+#
+# Drive a headless Session with a realistic MUD definition against the local
+# flood server and measure throughput, latency (from the server's send() to
+# the session's output stream) and CPU time per pipeline stage.
+#
+# Results can be written to a JSON file and compared with an earlier run:
+#
+#   bench/bench_pipeline.py -p combat -o before.json
+#   ... change something ...
+#   bench/bench_pipeline.py -p combat -o after.json --compare before.json
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import subprocess
+
+from optparse import OptionParser
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHDIR, ".."))
+
+from mudblood.session import Session, Event, load_mud_definition
+from mudblood.eventloop import default_loop
+
+import floodserver
+
+class StageTimer:
+    """
+        Accumulates CPU time of the functions it wraps.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    def wrap(self, stage, fun):
+        entry = self.stages.setdefault(stage, [0, 0.0])
+        clock = time.clock
+
+        def wrapper(*args):
+            t = clock()
+            try:
+                return fun(*args)
+            finally:
+                entry[0] += 1
+                entry[1] += clock() - t
+        return wrapper
+
+class Run:
+    _stamp = re.compile(r"T(\d+\.\d+) ")
+
+    def __init__(self, session):
+        self.session = session
+        self.done = threading.Event()
+        self.timer = StageTimer()
+        self.latencies = []
+        self.lines = 0
+        self.bytes = 0
+
+        out = session.out[0]
+        out_write = out.write
+        def write(data):
+            now = time.time()
+            m = self._stamp.search(data, 0, 40)
+            if m:
+                self.latencies.append(now - float(m.group(1)))
+            out_write(data)
+        out.write = write
+
+        framer = session.framer
+        feed = self.timer.wrap("framing", framer.feed)
+        def counting_feed(data):
+            self.bytes += len(data)
+            return feed(data)
+        framer.feed = counting_feed
+
+        session.completer.parse = self.timer.wrap("completer", session.completer.parse)
+        for h in session.mud.input_hooks:
+            h.process = self.timer.wrap("hooks", h.process)
+
+        session.callback = self.timer.wrap("callback", self.callback)
+
+    def callback(self, session, typ, arg):
+        if typ == Event.STDIO or typ == Event.PROMPT:
+            self.lines += session.out[0].read().count("\n")
+        elif typ == Event.INFO:
+            session.info.read()
+        elif typ == Event.ERROR:
+            sys.stderr.write(session.stderr.read())
+        elif typ == Event.CLOSED:
+            self.done.set()
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def git_commit():
+    try:
+        return subprocess.Popen(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHDIR,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        return ""
+
+def compare(result, path):
+    with open(path) as f:
+        old = json.load(f)
+
+    def line(name, a, b, unit):
+        change = a and (b - a) / a * 100 or 0.0
+        print "  %-22s %12.1f %12.1f %+7.1f%% %s" % (name, a, b, change, unit)
+
+    print "compared with %s (%s):" % (path, old.get("commit", "?"))
+    line("lines/s", old["lines_per_sec"], result["lines_per_sec"], "")
+    line("bytes/s", old["bytes_per_sec"], result["bytes_per_sec"], "")
+    line("latency p50", old["latency_ms"]["p50"], result["latency_ms"]["p50"], "ms")
+    line("latency p99", old["latency_ms"]["p99"], result["latency_ms"]["p99"], "ms")
+    for stage in sorted(result["stages"]):
+        if stage in old["stages"]:
+            line("cpu " + stage, old["stages"][stage]["us_per_line"],
+                 result["stages"][stage]["us_per_line"], "us/line")
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-p", "--profile", dest="profile", default="combat",
+                      help="Traffic profile of the flood server")
+    parser.add_option("-n", "--lines", dest="lines", type="int", default=50000)
+    parser.add_option("-t", "--transport", dest="transport", default="loop")
+    parser.add_option("-d", "--definition", dest="definition",
+                      default=os.path.join(BENCHDIR, "bench_mud.py"))
+    parser.add_option("-P", "--port", dest="port", type="int", default=9877)
+    parser.add_option("-o", "--output", dest="output", help="Write results as JSON")
+    parser.add_option("--compare", dest="compare", help="Compare with an earlier JSON result")
+    parser.add_option("-s", "--server-option", dest="server_options", action="append", default=[],
+                      help="Pass an option to the flood server (e.g. -s--ansi=0.5)")
+    (options, args) = parser.parse_args()
+
+    server_args = ["-P", str(options.port), "-p", options.profile,
+                   "-n", str(options.lines)] + options.server_options
+    server = subprocess.Popen([sys.executable, os.path.join(BENCHDIR, "floodserver.py")] + server_args,
+                              stdout=subprocess.PIPE)
+    server.stdout.readline()
+
+    try:
+        mud = load_mud_definition(options.definition)
+        mud.host = "127.0.0.1"
+        mud.port = options.port
+
+        session = Session(mud, None, options.transport)
+        run = Run(session)
+
+        t0, c0 = time.time(), time.clock()
+        session.connect()
+        run.done.wait()
+        wall, cpu = time.time() - t0, time.clock() - c0
+    finally:
+        default_loop().stop(True)
+        server.terminate()
+
+    stages = {}
+    for name, (calls, t) in run.timer.stages.iteritems():
+        stages[name] = {
+                "calls": calls,
+                "cpu": t,
+                "us_per_line": run.lines and t / run.lines * 1e6 or 0.0,
+                }
+
+    result = {
+            "commit": git_commit(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "profile": options.profile,
+            "server": vars(floodserver.parse_options(server_args)),
+            "transport": options.transport,
+            "lines": run.lines,
+            "bytes": run.bytes,
+            "wire_bytes": session.telnet.bytes_received,
+            "wall": wall,
+            "cpu": cpu,
+            "lines_per_sec": run.lines / wall,
+            "bytes_per_sec": run.bytes / wall,
+            "latency_ms": {
+                "p50": percentile(run.latencies, 50) * 1000,
+                "p99": percentile(run.latencies, 99) * 1000,
+                "max": percentile(run.latencies, 100) * 1000,
+                },
+            "stages": stages,
+            }
+
+    print "profile=%s transport=%s lines=%d bytes=%d wall=%.2fs cpu=%.2fs" % (
+            options.profile, options.transport, run.lines, run.bytes, wall, cpu)
+    print "%.0f lines/s, %.0f bytes/s" % (result["lines_per_sec"], result["bytes_per_sec"])
+    print session.telnet.stats()
+    print "latency p50=%.2fms p99=%.2fms max=%.2fms" % (
+            result["latency_ms"]["p50"], result["latency_ms"]["p99"], result["latency_ms"]["max"])
+    for name in sorted(stages):
+        print "  %-10s %8d calls %8.3fs cpu %8.1fus/line" % (
+                name, stages[name]["calls"], stages[name]["cpu"], stages[name]["us_per_line"])
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        compare(result, options.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# bench_prompt.py
+#
+# Measure keystroke-to-prompt latency: the time from writing a command to the
+# session's stdin until the interface is handed the prompt of the answer.
+# A local server answers every command with a few lines and a prompt, which
+# is marked in one of several ways:
+#
+#   timeout     no mark at all, the session waits for prompt_timeout
+#   pattern     no mark, but the session knows the prompt pattern
+#   ga          IAC GA after the prompt
+#   eor         IAC EOR after the prompt (negotiated with WILL EOR)
+
+import os
+import sys
+import time
+import socket
+import threading
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.session import Session, Event
+from mudblood.coalescer import EventCoalescer
+from mudblood.eventloop import default_loop
+import mudblood.mud_base as mud
+
+IAC, WILL, GA, EOR, TELOPT_EOR = 255, 251, 249, 239, 25
+
+modes = ["timeout", "pattern", "ga", "eor"]
+
+def serve(listener, mode, lines):
+    conn, _ = listener.accept()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if mode == "eor":
+        conn.sendall("%c%c%c" % (IAC, WILL, TELOPT_EOR))
+
+    mark = {"ga": "%c%c" % (IAC, GA), "eor": "%c%c" % (IAC, EOR)}.get(mode, "")
+    answer = "".join(["Du siehst hier nichts Besonderes (%d).\r\n" % i for i in range(lines)])
+    buf = ""
+    try:
+        while True:
+            d = conn.recv(4096)
+            if d == "":
+                break
+            buf += d
+            while "\n" in buf:
+                cmd, _, buf = buf.partition("\n")
+                # Skip negotiation replies
+                while cmd.startswith("\xff"):
+                    cmd = cmd[3:]
+                conn.sendall(answer + "> " + mark)
+    except socket.error:
+        pass
+    conn.close()
+
+def run(mode, options):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    server = threading.Thread(None, serve, args=(listener, mode, options.lines))
+    server.daemon = True
+    server.start()
+
+    mud.host, mud.port = listener.getsockname()
+    mud.prompt_pattern = mode == "pattern" and "> " or ""
+    mud.prompt_timeout = options.timeout
+    mud.send_rate = 0
+
+    prompt = threading.Event()
+    def callback(session, typ, arg):
+        if typ in (Event.STDIO, Event.PROMPT):
+            session.out[0].read()
+        if typ == Event.PROMPT:
+            prompt.set()
+
+    session = Session(mud, EventCoalescer(callback, options.frame), options.transport)
+    session.stats.enabled = True
+    session.connect()
+    time.sleep(0.2)
+
+    latencies = []
+    for i in range(options.commands):
+        prompt.clear()
+        t = time.time()
+        session.stdin.writeln("schau")
+        if not prompt.wait(2.0):
+            break
+        latencies.append(time.time() - t)
+        time.sleep(0.01)
+
+    session.close()
+    listener.close()
+
+    latencies.sort()
+    if not latencies:
+        print "%-8s no prompts received" % mode
+        return
+    calls, total, longest = session.stats.entries.get("keystroke to prompt", [0, 0.0, 0.0])
+    print "%-8s n=%d p50=%.2fms p90=%.2fms max=%.2fms (session: %.2fms avg)" % (
+            mode, len(latencies),
+            latencies[len(latencies) / 2] * 1000,
+            latencies[int(len(latencies) * 0.9)] * 1000,
+            latencies[-1] * 1000,
+            calls and total / calls * 1000 or 0.0)
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-m", "--mode", dest="modes", action="append",
+                      help="Prompt marking to test: %s (default: all)" % ", ".join(modes))
+    parser.add_option("-n", "--commands", dest="commands", type="int", default=200)
+    parser.add_option("-l", "--lines", dest="lines", type="int", default=5,
+                      help="Lines in every answer")
+    parser.add_option("-t", "--transport", dest="transport", default="thread")
+    parser.add_option("--timeout", dest="timeout", type="float", default=mud.prompt_timeout,
+                      help="Prompt timeout of the session")
+    parser.add_option("--frame", dest="frame", type="float", default=mud.frame_interval,
+                      help="Frame interval of the event coalescer")
+    (options, args) = parser.parse_args()
+
+    try:
+        for m in options.modes or modes:
+            run(m, options)
+    finally:
+        default_loop().stop(True)
+
+if __name__ == "__main__":
+    main()
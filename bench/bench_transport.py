@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# bench_transport.py
+#
+# Compare the "thread" and "loop" transports. A number of sessions connect
+# to a local flood server at once; we measure how long it takes until every
+# session has received all lines.
+
+import os
+import sys
+import time
+import threading
+import subprocess
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.session import Session, Event
+from mudblood.eventloop import default_loop
+import mudblood.mud_base as mud
+
+class Counter:
+    def __init__(self, sessions):
+        self.lock = threading.Lock()
+        self.lines = 0
+        self.open = sessions
+        self.done = threading.Event()
+        self.max_threads = threading.active_count()
+
+    def callback(self, session, typ, arg):
+        if typ == Event.STDIO or typ == Event.PROMPT:
+            n = session.out[0].read().count("\n")
+            with self.lock:
+                self.lines += n
+                self.max_threads = max(self.max_threads, threading.active_count())
+        elif typ == Event.CLOSED:
+            with self.lock:
+                self.open -= 1
+                if self.open == 0:
+                    self.done.set()
+
+def run(transport, options):
+    counter = Counter(options.sessions)
+    sessions = [Session(mud, counter.callback, transport) for i in range(options.sessions)]
+
+    t0, c0 = time.time(), os.times()
+    for s in sessions:
+        s.connect()
+    counter.done.wait()
+    t1, c1 = time.time(), os.times()
+
+    wall = t1 - t0
+    cpu = (c1[0] - c0[0]) + (c1[1] - c0[1])
+    print "%-8s sessions=%d lines=%d wall=%.3fs cpu=%.3fs lines/s=%.0f threads=%d" % (
+            transport, options.sessions, counter.lines, wall, cpu,
+            counter.lines / wall, counter.max_threads)
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-s", "--sessions", dest="sessions", type="int", default=16)
+    parser.add_option("-n", "--lines", dest="lines", type="int", default=50000,
+                      help="Lines per session")
+    parser.add_option("-P", "--port", dest="port", type="int", default=9876)
+    parser.add_option("-t", "--transport", dest="transports", action="append",
+                      help="Transport to test (default: all)")
+    (options, args) = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable,
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "floodserver.py"),
+                               "-P", str(options.port), "-n", str(options.lines)],
+                              stdout=subprocess.PIPE)
+    server.stdout.readline()
+
+    mud.host = "127.0.0.1"
+    mud.port = options.port
+
+    try:
+        for t in options.transports or ["thread", "loop"]:
+            run(t, options)
+    finally:
+        default_loop().stop(True)
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# bench_walk.py
+#
+# Measure speedwalk throughput (steps per second) against a local stand-in
+# MUD: a grid of rooms with exits n, s, o and w. The server answers every
+# move after a simulated network delay with a short room description and a
+# prompt marked with IAC GA. Moves can be made to fail at random, and the
+# server can send GMCP Room.Info with room IDs.
+#
+# Every run walks from one corner of the grid to the other, once for each
+# window size. With --learn-ids the mapper doesn't know the room IDs in
+# advance; afterwards we count the rooms that got a wrong one.
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import threading
+
+from collections import deque
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.session import Session, Event
+from mudblood.map import Room, Edge
+from mudblood.eventloop import default_loop
+import mudblood.mud_base as mud
+
+IAC, WILL, SB, SE, GA, GMCP = 255, 251, 250, 240, 249, 201
+
+telnet_commands = re.compile("\xff\xfa.*?\xff\xf0|\xff[\xfb-\xfe].", re.S)
+
+moves = {"n": (0, -1), "s": (0, 1), "o": (1, 0), "w": (-1, 0)}
+
+class GridServer:
+    def __init__(self, listener, options):
+        self.listener = listener
+        self.options = options
+        self.rnd = random.Random(options.seed)
+
+    def serve(self):
+        conn, _ = self.listener.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.options.gmcp:
+            conn.sendall("%c%c%c" % (IAC, WILL, GMCP))
+
+        # Answers are sent in order, each one delay seconds after its
+        # command arrived, so that moves in flight overlap like on a real
+        # network.
+        self.due = deque()
+        self.cond = threading.Condition()
+        writer = threading.Thread(None, self.write, args=(conn,))
+        writer.daemon = True
+        writer.start()
+
+        self.x, self.y = 0, 0
+        self.send_room(conn)
+
+        buf = ""
+        try:
+            while True:
+                d = conn.recv(4096)
+                if d == "":
+                    break
+                buf += d
+                while "\n" in buf:
+                    cmd, _, buf = buf.partition("\n")
+                    cmd = telnet_commands.sub("", cmd)
+                    with self.cond:
+                        self.due.append((time.time() + self.options.delay, cmd.strip()))
+                        self.cond.notify()
+        except socket.error:
+            pass
+        conn.close()
+
+    def write(self, conn):
+        while True:
+            with self.cond:
+                while not self.due:
+                    self.cond.wait()
+                when, cmd = self.due.popleft()
+            delay = when - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.handle(conn, cmd)
+            except socket.error:
+                return
+
+    def handle(self, conn, cmd):
+        if cmd not in moves:
+            conn.sendall("Wie bitte?\r\n> %c%c" % (IAC, GA))
+            return
+        dx, dy = moves[cmd]
+        x, y = self.x + dx, self.y + dy
+        size = self.options.size
+        if not (0 <= x < size and 0 <= y < size) or self.rnd.random() < self.options.fail:
+            conn.sendall("Dort geht es nicht weiter.\r\n> %c%c" % (IAC, GA))
+            return
+        self.x, self.y = x, y
+        self.send_room(conn)
+
+    def send_room(self, conn):
+        data = ""
+        if self.options.gmcp:
+            info = json.dumps({"num": self.y * self.options.size + self.x})
+            data += "%c%c%cRoom.Info %s%c%c" % (IAC, SB, GMCP, info, IAC, SE)
+        data += "Eine Wiese (%d, %d).\r\nEs gibt vier sichtbare Ausgaenge.\r\n> %c%c" % (
+                self.x, self.y, IAC, GA)
+        conn.sendall(data)
+
+def build_grid(session, size, ids):
+    """
+        Give the session's mapper the same grid as the server's.
+    """
+    m = session.mapper.map
+    rooms = {}
+    for y in range(size):
+        for x in range(size):
+            r = m.current_room if (x, y) == (0, 0) else m.add(Room(mud))
+            if ids:
+                m.set_server_id(r, str(y * size + x))
+            rooms[(x, y)] = r
+    for y in range(size):
+        for x in range(size):
+            if x + 1 < size:
+                Edge(rooms[(x, y)], "o", rooms[(x+1, y)], "w")
+            if y + 1 < size:
+                Edge(rooms[(x, y)], "s", rooms[(x, y+1)], "n")
+    return rooms
+
+def run(window, options):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    server = threading.Thread(None, GridServer(listener, options).serve)
+    server.daemon = True
+    server.start()
+
+    mud.host, mud.port = listener.getsockname()
+    mud.prompt_pattern = ""
+    mud.send_rate = options.rate
+    mud.walk_window = window
+    mud.walk_fail_pattern = r"^Dort geht es nicht weiter"
+    mud.walk_retries = 100
+
+    messages = []
+    def callback(session, typ, arg):
+        if typ in (Event.STDIO, Event.PROMPT):
+            session.out[0].read()
+        elif typ == Event.INFO:
+            messages.append(session.info.read())
+
+    session = Session(mud, callback, options.transport)
+    rooms = build_grid(session, options.size, options.gmcp and not options.learn)
+    session.connect()
+    time.sleep(0.3)
+
+    session.walker.start(rooms[(options.size - 1, options.size - 1)])
+    while session.walker.active:
+        time.sleep(0.01)
+
+    w = session.walker
+    elapsed = time.time() - w.start_time
+    wrong = [(x, y) for (x, y), r in rooms.iteritems()
+             if r.server_id is not None and r.server_id != str(y * options.size + x)]
+    print "window=%d steps=%d failed=%d re-plans=%d %.2fs %.1f steps/s %s%s" % (
+            window, w.steps, w.failures, w.replans, elapsed, w.steps / elapsed,
+            session.mapper.map.current_room is rooms[(options.size - 1, options.size - 1)]
+                and "arrived" or "NOT ARRIVED",
+            options.learn and ", %d wrong room IDs" % len(wrong) or "")
+
+    session.close()
+    listener.close()
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-w", "--window", dest="windows", type="int", action="append",
+                      help="Moves in flight (default: 1, 2, 4, 8)")
+    parser.add_option("-s", "--size", dest="size", type="int", default=20,
+                      help="Width and height of the grid")
+    parser.add_option("-d", "--delay", dest="delay", type="float", default=0.02,
+                      help="Simulated one-way delay of the server (seconds)")
+    parser.add_option("-f", "--fail", dest="fail", type="float", default=0.0,
+                      help="Probability that a move fails")
+    parser.add_option("-r", "--rate", dest="rate", type="float", default=0,
+                      help="send_rate of the session, 0 for no limit")
+    parser.add_option("-g", "--gmcp", dest="gmcp", action="store_true", default=False,
+                      help="Confirm moves with GMCP Room.Info instead of prompts")
+    parser.add_option("-l", "--learn-ids", dest="learn", action="store_true", default=False,
+                      help="With --gmcp, don't tell the mapper the room IDs in advance")
+    parser.add_option("-t", "--transport", dest="transport", default="thread")
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args()
+
+    try:
+        for w in options.windows or [1, 2, 4, 8]:
+            run(w, options)
+    finally:
+        default_loop().stop(True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#
+# check_mccp.py
+#
+# Check MCCP v2 decompression in TelnetProtocol against streams built like
+# floodserver.py --mccp builds them. Every stream is fed in every possible
+# two-way split and in random small chunks, and the decoded text, prompt
+# marks and subnegotiations must come out the same each time.
+#
+# Covered: compressed data split anywhere (also inside IAC sequences and the
+# start marker), text after the end of a compressed stream, compression
+# restarting after a second IAC SB MCCP2 IAC SE, and corrupt data raising
+# CompressionError.
+
+import os
+import sys
+import zlib
+import random
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudblood.telnet import TelnetProtocol, MCCP2, GMCP
+
+IAC, DO, WILL, SB, SE, GA = 255, 253, 251, 250, 240, 249
+
+START = "%c%c%c%c%c" % (IAC, SB, MCCP2, IAC, SE)
+
+def compressed(data, finish=True):
+    c = zlib.compressobj(6)
+    ret = c.compress(data)
+    if finish:
+        return ret + c.flush()
+    return ret + c.flush(zlib.Z_SYNC_FLUSH)
+
+def feed(chunks):
+    """
+        @return     (text, prompt marks, GMCP payloads, still compressing)
+    """
+    received = []
+    tp = TelnetProtocol(lambda data: None)
+    tp.register(GMCP, lambda: None, received.append)
+    tp.feed("%c%c%c%c%c%c" % (IAC, WILL, MCCP2, IAC, WILL, GMCP))
+
+    text = []
+    marks = 0
+    for c in chunks:
+        for d in tp.feed(c):
+            if d is None:
+                marks += 1
+            elif isinstance(d, tuple):
+                d[0](d[1])
+            else:
+                text.append(d)
+    return "".join(text), marks, received, tp.compressing()
+
+def splits(data, rnd, count):
+    """
+        Every split into two pieces, and count random splits into pieces of
+        1 to 16 bytes.
+    """
+    for i in range(len(data) + 1):
+        yield [data[:i], data[i:]]
+    for n in range(count):
+        chunks = []
+        i = 0
+        while i < len(data):
+            j = i + rnd.randint(1, 16)
+            chunks.append(data[i:j])
+            i = j
+        yield chunks
+
+def check(name, data, expected, rnd, count):
+    n = 0
+    for chunks in splits(data, rnd, count):
+        got = feed(chunks)
+        if got != expected:
+            print "%s: FAILED for chunks %r" % (name, [len(c) for c in chunks])
+            print "  expected %r" % (expected,)
+            print "  got      %r" % (got,)
+            return False
+        n += 1
+    print "%-12s ok (%d splits, %d bytes)" % (name, n, len(data))
+    return True
+
+def check_corrupt():
+    tp = TelnetProtocol(lambda data: None)
+    tp.feed("%c%c%c" % (IAC, WILL, MCCP2))
+    tp.feed(START + compressed("fine\r\n", False)[:-1])
+    try:
+        tp.feed("\x00garbage" * 4)
+    except TelnetProtocol.CompressionError:
+        if tp.compressing():
+            print "corrupt      FAILED: still compressing after the error"
+            return False
+        print "corrupt      ok"
+        return True
+    print "corrupt      FAILED: no CompressionError"
+    return False
+
+def main():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-n", "--random", dest="count", type="int", default=200,
+                      help="Random splits per stream")
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args()
+    rnd = random.Random(options.seed)
+
+    prompt = "> %c%c" % (IAC, GA)
+    gmcp = "%c%c%cRoom.Info {\"num\": 7}%c%c" % (IAC, SB, GMCP, IAC, SE)
+    lines = "".join(["Zeile %d mit etwas Text.\r\n" % i for i in range(40)])
+
+    ok = True
+
+    # Plain text, then compression for the rest of the connection.
+    data = "Hallo.\r\n" + START + compressed(lines + prompt + gmcp + "\xff\xffnach\r\n", False)
+    ok &= check("start", data,
+                ("Hallo.\r\n" + lines + "> \xffnach\r\n", 1, ["Room.Info {\"num\": 7}"], True),
+                rnd, options.count)
+
+    # The compressed stream ends, plain text follows, compression restarts.
+    data = START + compressed(lines + prompt) + "plain\r\n" + prompt + \
+           START + compressed("wieder\r\n" + gmcp, False)
+    ok &= check("restart", data,
+                (lines + "> plain\r\n> wieder\r\n", 2, ["Room.Info {\"num\": 7}"], True),
+                rnd, options.count)
+
+    # Ends right after the stream, nothing follows.
+    data = START + compressed(lines)
+    ok &= check("end", data, (lines, 0, [], False), rnd, options.count)
+
+    ok &= check_corrupt()
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
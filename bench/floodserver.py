@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# floodserver.py
+#
+# A stand-in MUD server for benchmarks. Every client that connects is
+# flooded with lines of text, then the connection is closed.
+#
+# Every line starts with "T<time> ", the time it was handed to the socket,
+# so that clients can measure latency.
+#
+# With --mccp, the server offers MCCP v2 and compresses everything it sends
+# if the client agrees. check_mccp.py checks the client side of this without
+# a server.
+
+import sys
+import time
+import zlib
+import select
+import random
+import socket
+import SocketServer
+
+from optparse import OptionParser
+
+# Traffic profiles. Command line options override single values.
+profiles = {
+    "plain":  dict(rate=0,    length=80,  long_lines=0.0,  ansi=0.0, partial=0.0, prompt_every=0),
+    "combat": dict(rate=0,    length=60,  long_lines=0.0,  ansi=0.3, partial=0.1, prompt_every=5),
+    "rooms":  dict(rate=0,    length=100, long_lines=0.3,  ansi=0.1, partial=0.0, prompt_every=20),
+    "spammy": dict(rate=0,    length=70,  long_lines=0.05, ansi=0.2, partial=0.5, prompt_every=10),
+    "paced":  dict(rate=2000, length=80,  long_lines=0.1,  ansi=0.1, partial=0.1, prompt_every=10),
+    }
+
+words = ["Der", "Ork", "trifft", "dich", "sehr", "hart", "Du", "schlaegst", "den", "Zwerg",
+         "mit", "voller", "Wucht", "Ein", "Wolf", "kommt", "von", "Norden", "herein", "und",
+         "Gold", "liegt", "hier", "Es", "gibt", "drei", "sichtbare", "Ausgaenge", "osten", "westen",
+         # Latin-1, like mud_base.encoding
+         "Sonne", "scheint", "sch\xf6n"]
+
+IAC, DO, WILL, SB, SE, MCCP2 = 255, 253, 251, 250, 240, 86
+
+colors = ["\033[31m", "\033[32m", "\033[33m", "\033[1m\033[34m", "\033[36m"]
+
+def make_line(opts, rnd):
+    length = opts.length
+    if rnd.random() < opts.long_lines:
+        length *= rnd.randint(3, 10)
+
+    out = []
+    n = 0
+    while n < length:
+        w = rnd.choice(words)
+        n += len(w) + 1
+        if rnd.random() < opts.ansi:
+            w = rnd.choice(colors) + w + "\033[0m"
+        out.append(w)
+    return " ".join(out)
+
+class FloodHandler(SocketServer.BaseRequestHandler):
+    def send(self, data):
+        opts = self.server.options
+        if self.compressor:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if opts.partial and self.rnd.random() < opts.partial and len(data) > 1:
+            # Split the packet somewhere in the middle of a line.
+            cut = self.rnd.randint(1, len(data) - 1)
+            self.request.sendall(data[:cut])
+            time.sleep(0.0005)
+            self.request.sendall(data[cut:])
+        else:
+            self.request.sendall(data)
+
+    def negotiate_mccp(self):
+        """
+            Offer MCCP v2 and start compressing if the client accepts within
+            a second.
+        """
+        self.request.sendall("%c%c%c" % (IAC, WILL, MCCP2))
+        reply = ""
+        deadline = time.time() + 1.0
+        while len(reply) < 3 and time.time() < deadline:
+            r, _, _ = select.select([self.request], [], [], deadline - time.time())
+            if not r:
+                break
+            d = self.request.recv(3 - len(reply))
+            if d == "":
+                break
+            reply += d
+
+        if reply == "%c%c%c" % (IAC, DO, MCCP2):
+            self.request.sendall("%c%c%c%c%c" % (IAC, SB, MCCP2, IAC, SE))
+            self.compressor = zlib.compressobj(6)
+
+    def handle(self):
+        opts = self.server.options
+        self.rnd = random.Random(opts.seed)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.compressor = None
+        if opts.mccp:
+            self.negotiate_mccp()
+
+        pool = [make_line(opts, self.rnd) for i in range(1000)]
+        sent = 0
+        start = time.time()
+
+        try:
+            while sent < opts.lines:
+                n = min(opts.chunk, opts.lines - sent)
+                batch = []
+                for i in range(n):
+                    sent += 1
+                    if opts.prompt_every and sent % opts.prompt_every == 0:
+                        batch.append("T%.6f > " % time.time())
+                        self.send("".join(batch))
+                        batch = []
+                    else:
+                        batch.append("T%.6f %s\r\n" % (time.time(), pool[sent % len(pool)]))
+                if batch:
+                    self.send("".join(batch))
+
+                if opts.rate:
+                    delay = start + float(sent) / opts.rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+            if self.compressor:
+                self.request.sendall(self.compressor.flush())
+        except socket.error:
+            pass
+
+        self.request.close()
+
+class FloodServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        self.options = options
+        SocketServer.ThreadingTCPServer.__init__(self, address, FloodHandler)
+
+def option_parser():
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("-H", "--host", dest="host", default="127.0.0.1")
+    parser.add_option("-P", "--port", dest="port", type="int", default=9999)
+    parser.add_option("-p", "--profile", dest="profile", type="choice",
+                      choices=profiles.keys(), default="plain",
+                      help="Traffic profile: %s" % ", ".join(sorted(profiles.keys())))
+    parser.add_option("-n", "--lines", dest="lines", type="int", default=100000,
+                      help="Lines sent to every client")
+    parser.add_option("-c", "--chunk", dest="chunk", type="int", default=16,
+                      help="Lines per send() call")
+    parser.add_option("--seed", dest="seed", type="int", default=1)
+    parser.add_option("-r", "--rate", dest="rate", type="int",
+                      help="Lines per second, 0 for unlimited")
+    parser.add_option("-l", "--length", dest="length", type="int",
+                      help="Typical length of a line")
+    parser.add_option("--long-lines", dest="long_lines", type="float",
+                      help="Fraction of lines that are 3-10 times longer")
+    parser.add_option("--ansi", dest="ansi", type="float",
+                      help="Fraction of words wrapped in color codes")
+    parser.add_option("--partial", dest="partial", type="float",
+                      help="Fraction of packets that are split in two")
+    parser.add_option("--prompt-every", dest="prompt_every", type="int",
+                      help="Send a prompt without newline every N lines")
+    parser.add_option("--mccp", dest="mccp", action="store_true", default=False,
+                      help="Offer MCCP v2 compression")
+    return parser
+
+def parse_options(argv=None):
+    (options, args) = option_parser().parse_args(argv)
+    for k, v in profiles[options.profile].iteritems():
+        if getattr(options, k) is None:
+            setattr(options, k, v)
+    return options
+
+def main():
+    options = parse_options()
+    server = FloodServer((options.host, options.port), options)
+    sys.stdout.write("listening on %s:%d\n" % server.server_address)
+    sys.stdout.flush()
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,27 @@ def main():
                       default = ".",
                       help =    "Command Prefix (default: '.')")
 
+    parser.add_option("-R", "--record",
+                      action =  "store",
+                      dest =    "record",
+                      type =    "string",
+                      default = None,
+                      help =    "Record the session to a log file")
+
+    parser.add_option("-r", "--replay",
+                      action =  "store",
+                      dest =    "replay",
+                      type =    "string",
+                      default = None,
+                      help =    "Replay a session log instead of connecting")
+
+    parser.add_option("-S", "--replay-speed",
+                      action =  "store",
+                      dest =    "replay_speed",
+                      type =    "float",
+                      default = 1.0,
+                      help =    "Replay speed factor, 0 for full speed (default: 1)")
+
 
     (options, args) = parser.parse_args()
 
@@ -53,9 +74,18 @@ def main():
         mud = __import__("mudblood.mud_base", globals(), locals(), [], -1).mud_base
         mud.host = args[0]
         mud.port = int(args[1])
+    elif options.replay:
+        mud = __import__("mudblood.mud_base", globals(), locals(), [], -1).mud_base
     else:
         mud = None
 
+    if mud and options.replay:
+        mud.transport = "replay"
+        mud.replay_file = options.replay
+        mud.replay_speed = options.replay_speed
+    if mud and options.record:
+        mud.record_file = options.record
+
     iface = None
 
     if options.interface == "serial":
@@ -0,0 +1,105 @@
+import codecs
+
+from telnet import CHARSET, subnegotiation
+from sessionlog import CHARSET as CHARSET_RECORD
+
+# CHARSET subnegotiation commands (RFC 2066)
+REQUEST         = 1
+ACCEPTED        = 2
+REJECTED        = 3
+TTABLE_IS       = 4
+TTABLE_REJECTED = 5
+
+class Charset:
+    """
+        The character encoding of a session. Text from the server is decoded
+        incrementally, so that multibyte sequences split across reads come
+        out right. Unicode text to the server is encoded.
+
+        The server can switch the encoding with TELNET CHARSET. We accept
+        the first of our preferred charsets that it offers.
+    """
+    def __init__(self, session, encoding="latin-1", preferred=()):
+        """
+            @param encoding     The encoding used until the server asks for
+                                another one.
+            @param preferred    Charset names to offer and accept, best first.
+        """
+        self.session = session
+        self.preferred = list(preferred)
+        self.requested = False
+        self.set_encoding(encoding)
+
+    def set_encoding(self, name):
+        """
+            Use another encoding from now on. Raises LookupError if Python
+            doesn't know it.
+        """
+        info = codecs.lookup(name)
+        self.name = name
+        self.encoding = info.name
+        self.decoder = info.incrementaldecoder("replace")
+
+        if self.session.recorder:
+            self.session.recorder.record(CHARSET_RECORD, name)
+
+    def decode(self, data):
+        return self.decoder.decode(data)
+
+    def encode(self, text):
+        if isinstance(text, unicode):
+            return text.encode(self.encoding, "replace")
+        return text
+
+    def choose(self, offered):
+        """
+            @return     The first offered name that matches one of our
+                        preferred charsets, or None.
+        """
+        known = []
+        for o in offered:
+            try:
+                known.append((codecs.lookup(o).name, o))
+            except LookupError:
+                pass
+
+        for p in self.preferred:
+            try:
+                p = codecs.lookup(p).name
+            except LookupError:
+                continue
+            for name, o in known:
+                if name == p:
+                    return o
+        return None
+
+    def enabled(self):
+        if not self.requested and self.preferred:
+            self.requested = True
+            self._send(chr(REQUEST) + ";" + ";".join(self.preferred))
+
+    def received(self, data):
+        if not data:
+            return
+        command = ord(data[0])
+
+        if command == REQUEST:
+            body = data[1:]
+            if body.startswith("[TTABLE]"):
+                body = body[9:]
+            choice = body and self.choose(body[1:].split(body[0]))
+            if choice:
+                self._send(chr(ACCEPTED) + choice)
+                self.set_encoding(choice)
+            else:
+                self._send(chr(REJECTED))
+        elif command == ACCEPTED:
+            try:
+                self.set_encoding(data[1:])
+            except LookupError:
+                pass
+        elif command == TTABLE_IS:
+            self._send(chr(TTABLE_REJECTED))
+
+    def _send(self, data):
+        self.session._write_raw(subnegotiation(CHARSET, data))
@@ -0,0 +1,81 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+from session import Event
+from eventloop import default_loop
+
+class EventCoalescer:
+    """
+        Sits between sessions and an interface callback. Events are collected
+        and delivered in batches, at most one batch per frame interval.
+        Multiple pending events of the same kind (same session, type and
+        argument) are delivered only once, since the interface reads
+        everything that has piled up in the session's streams anyway.
+
+        CONNECTED, PROMPT, ERROR and CLOSED are delivered at once, after
+        everything that is still pending.
+    """
+    URGENT = (Event.CONNECTED, Event.PROMPT, Event.ERROR, Event.CLOSED)
+
+    def __init__(self, callback, interval=0.05, loop=None):
+        """
+            @param callback     The interface callback (session, type, arg).
+            @param interval     Minimum time between two batches in seconds.
+                                0 passes every event on immediately.
+        """
+        self.callback = callback
+        self.interval = interval
+        self.loop = loop or default_loop()
+
+        self.lock = threading.Lock()
+        self.deliver_lock = threading.RLock()
+        self.pending = OrderedDict()
+        self.timer = None
+        self.last_flush = 0.0
+
+        self.received = 0
+        self.delivered = 0
+        self.batches = 0
+
+    def __call__(self, session, typ, arg=None):
+        self.received += 1
+
+        if typ in self.URGENT or not self.interval:
+            with self.deliver_lock:
+                self.flush()
+                self.delivered += 1
+                self.callback(session, typ, arg)
+            return
+
+        with self.lock:
+            self.pending[(session, typ, arg)] = None
+            if self.timer is None:
+                delay = max(0.0, self.last_flush + self.interval - time.time())
+                self.timer = self.loop.call_later(delay, self.flush)
+        self.loop.start()
+
+    def flush(self):
+        """
+            Deliver all pending events now.
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+            events = self.pending.keys()
+            self.pending = OrderedDict()
+            self.last_flush = time.time()
+            self.batches += 1
+
+        with self.deliver_lock:
+            for session, typ, arg in events:
+                self.delivered += 1
+                self.callback(session, typ, arg)
+
+    def stats(self):
+        return "%d events received, %d delivered in %d batches (interval %gms)" % (
+                self.received, self.delivered, self.batches, self.interval * 1000)
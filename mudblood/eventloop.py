@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import heapq
+import threading
+import traceback
+
+from collections import deque
+
+class Timer:
+    """
+        Handle for a callback scheduled with EventLoop.call_later().
+    """
+    def __init__(self, when, fun, args):
+        self.when = when
+        self.fun = fun
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop:
+    """
+        A select() based event loop. Any number of sessions can share a single
+        loop, which runs in its own thread. All callbacks are executed in that
+        thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.readers = {}
+        self.writers = {}
+        self.timers = []
+        self.pending = deque()
+        self.running = False
+        self.thread = None
+        self._seq = 0
+        self._wake_r, self._wake_w = os.pipe()
+        fcntl.fcntl(self._wake_w, fcntl.F_SETFL, os.O_NONBLOCK)
+
+    def in_loop(self):
+        return self.thread is threading.current_thread()
+
+    def wakeup(self):
+        """
+            Interrupt a running select() so that changes made from another
+            thread take effect immediately.
+        """
+        if self.thread and not self.in_loop():
+            try:
+                os.write(self._wake_w, "x")
+            except OSError:
+                pass
+
+    def add_reader(self, fd, fun, *args):
+        """
+            Call fun(*args) whenever fd becomes readable.
+        """
+        with self.lock:
+            self.readers[fd] = (fun, args)
+        self.wakeup()
+
+    def remove_reader(self, fd):
+        with self.lock:
+            if fd in self.readers:
+                del self.readers[fd]
+        self.wakeup()
+
+    def add_writer(self, fd, fun, *args):
+        """
+            Call fun(*args) whenever fd becomes writable, until the writer is
+            removed again.
+        """
+        with self.lock:
+            self.writers[fd] = (fun, args)
+        self.wakeup()
+
+    def remove_writer(self, fd):
+        with self.lock:
+            if fd in self.writers:
+                del self.writers[fd]
+        self.wakeup()
+
+    def call_soon(self, fun, *args):
+        """
+            Run fun(*args) in the loop thread as soon as possible. May be
+            called from any thread.
+        """
+        self.pending.append((fun, args))
+        self.wakeup()
+
+    def call_later(self, delay, fun, *args):
+        """
+            Run fun(*args) in the loop thread after delay seconds.
+
+            @return     A Timer object that can be used to cancel the call.
+        """
+        t = Timer(time.time() + delay, fun, args)
+        with self.lock:
+            self._seq += 1
+            heapq.heappush(self.timers, (t.when, self._seq, t))
+        self.wakeup()
+        return t
+
+    def _run_callback(self, fun, args):
+        try:
+            fun(*args)
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+
+    def run_once(self, timeout=None):
+        """
+            Wait for I/O or the next timer and dispatch everything that is ready.
+        """
+        with self.lock:
+            if self.timers:
+                delay = max(0, self.timers[0][0] - time.time())
+                if timeout is None or delay < timeout:
+                    timeout = delay
+            fds = self.readers.keys()
+            wfds = self.writers.keys()
+
+        if self.pending:
+            timeout = 0
+
+        try:
+            r, w, _ = select.select(fds + [self._wake_r], wfds, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            # A descriptor was closed behind our back. Drop the bad ones.
+            r, w = [], []
+            with self.lock:
+                for table in (self.readers, self.writers):
+                    for fd in table.keys():
+                        try:
+                            select.select([fd], [], [], 0)
+                        except select.error:
+                            del table[fd]
+
+        for fd in w:
+            with self.lock:
+                writer = self.writers.get(fd)
+            if writer:
+                self._run_callback(writer[0], writer[1])
+
+        for fd in r:
+            if fd == self._wake_r:
+                os.read(self._wake_r, 4096)
+                continue
+            with self.lock:
+                reader = self.readers.get(fd)
+            if reader:
+                self._run_callback(reader[0], reader[1])
+
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.timers or self.timers[0][0] > now:
+                    break
+                t = heapq.heappop(self.timers)[2]
+            if not t.cancelled:
+                self._run_callback(t.fun, t.args)
+
+        for i in range(len(self.pending)):
+            fun, args = self.pending.popleft()
+            self._run_callback(fun, args)
+
+    def run(self):
+        self.running = True
+        self.thread = threading.current_thread()
+        while self.running:
+            self.run_once()
+
+    def start(self):
+        """
+            Run the loop in a daemon thread, unless it is already running.
+        """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(None, self.run)
+            self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, wait=False):
+        """
+            Stop the loop after the current iteration.
+
+            @param wait     Wait for the loop thread to finish.
+        """
+        self.running = False
+        self.wakeup()
+        if wait and self.thread and not self.in_loop():
+            self.thread.join()
+
+_default_loop = None
+_default_lock = threading.Lock()
+
+def default_loop():
+    """
+        The loop shared by all sessions in "loop" transport mode.
+    """
+    global _default_loop
+    with _default_lock:
+        if _default_loop is None:
+            _default_loop = EventLoop()
+        return _default_loop
@@ -0,0 +1,69 @@
+class LineFramer:
+    """
+        Splits the data stream from the server into lines. A line that is
+        spread over several reads is kept until its newline arrives, so that
+        hooks only ever see complete lines.
+
+        If a decode function is given, lines are passed through it in stream
+        order, so it may be an incremental decoder.
+    """
+    def __init__(self, decode=None):
+        self.buf = bytearray()
+        self.decode = decode
+
+    def feed(self, data):
+        """
+            Add data to the buffer.
+
+            @param data     A string of data from the server.
+            @return         A list of all lines that are complete now. Every line
+                            ends with "\\n", carriage returns are removed.
+        """
+        buf = self.buf
+        buf.extend(data)
+
+        end = buf.rfind("\n")
+        if end < 0:
+            return []
+
+        text = str(buf[:end+1])
+        del buf[:end+1]
+
+        if "\r" in text:
+            text = text.replace("\r", "")
+        if self.decode:
+            lines = self.decode(text).split(u"\n")
+            lines.pop()
+            return [l + u"\n" for l in lines]
+        return text.splitlines(True)
+
+    def pending(self):
+        """
+            @return     True if there is an incomplete line in the buffer.
+        """
+        return len(self.buf) > 0
+
+    def peek(self, maxlen=256):
+        """
+            @return     The incomplete line, or None if it is longer than maxlen.
+        """
+        if len(self.buf) > maxlen:
+            return None
+        text = str(self.buf)
+        if "\r" in text:
+            text = text.replace("\r", "")
+        return text
+
+    def flush(self):
+        """
+            Remove the incomplete line (usually a prompt) from the buffer.
+
+            @return     The incomplete line without a trailing newline.
+        """
+        text = str(self.buf)
+        del self.buf[:]
+        if "\r" in text:
+            text = text.replace("\r", "")
+        if self.decode:
+            return self.decode(text)
+        return text
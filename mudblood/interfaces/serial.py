@@ -1,25 +1,35 @@
 import sys
+import locale
 import readline
 
 from mudblood.session import Session, Event
+from mudblood.coalescer import EventCoalescer
 from mudblood.colors import Colors
 from mudblood.commands import CommandChain, CommandObject
 
 VERSION = "0.1"
 
+# Encoding of the terminal
+ENCODING = sys.stdout.encoding or locale.getpreferredencoding() or "utf-8"
+
 class Interface(CommandObject):
     def __init__(self, mud):
         self.sname = ""
         self.sessions = {}
+        self.events = EventCoalescer(self.session_cb, getattr(mud, "frame_interval", 0.05))
 
         if mud:
-            self.sessions['default'] = Session(mud, self.session_cb)
+            self.sessions['default'] = Session(mud, self.events)
             self.sname = "default"
 
     def message(self, msg):
+        if isinstance(msg, unicode):
+            msg = msg.encode(ENCODING, "replace")
         print Colors.INFO + msg + Colors.INPUT
 
     def error(self, msg):
+        if isinstance(msg, unicode):
+            msg = msg.encode(ENCODING, "replace")
         print Colors.ERROR + msg + Colors.INPUT
 
     def session(self):
@@ -52,6 +62,7 @@ class Interface(CommandObject):
             except EOFError, e:
                 break
 
+            line = line.decode(ENCODING, "replace")
             words = line.split()
 
             if len(words) > 0 and words[0][0] == options.prefix:
@@ -60,7 +71,7 @@ class Interface(CommandObject):
                 try:
                     ret = self.command_chain.run_command(cmd)
                     if ret:
-                        if isinstance(ret, str):
+                        if isinstance(ret, basestring):
                             self.message(ret)
                     else:
                         self.error("Command not found.")
@@ -81,8 +92,11 @@ class Interface(CommandObject):
                 name = s
                 break
 
-        if ob == self.session() and typ == Event.STDIO:
-            sys.stdout.write(Colors.OFF + ob.out[arg].read() + Colors.INPUT)
+        if ob == self.session() and typ in (Event.STDIO, Event.PROMPT):
+            text = Colors.OFF + ob.out[arg].read() + Colors.INPUT
+            if isinstance(text, unicode):
+                text = text.encode(ENCODING, "replace")
+            sys.stdout.write(text)
             sys.stdout.flush()
         elif typ == Event.ERROR:
             self.error(ob.stderr.read())
@@ -103,8 +117,11 @@ class Interface(CommandObject):
             self.sname = newsession
             self.command_chain.chain = [self, self.session(), self.session().mapper]
             readline.set_completer(self.sessions[newsession].completer.complete)
-            for i in self.sessions[newsession].out:
-                sys.stdout.write(i.read())
+            for i in self.sessions[newsession].out.itervalues():
+                text = i.read()
+                if isinstance(text, unicode):
+                    text = text.encode(ENCODING, "replace")
+                sys.stdout.write(text)
 
     # commands ---
 
@@ -122,12 +139,19 @@ class Interface(CommandObject):
             if name in self.sessions.keys():
                 return "There is already a session named '%s'" % name
             else:
-                self.sessions[name] = Session(host, int(port), self.session_cb)
+                self.sessions[name] = Session(host, int(port), self.events)
                 self.switch_session(name)
 
                 self.sessions[name].connect()
                 return "[%s] Switched session" % name
 
+    def cmd_events(self):
+        """events
+
+           Show event delivery statistics."""
+
+        return self.events.stats()
+
     def cmd_sessions(self):
         """sessions
 
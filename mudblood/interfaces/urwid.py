@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import sys
 import os
+import locale
 
 import re
 
@@ -11,11 +12,14 @@ import traceback
 import threading
 
 from mudblood.session import Session, Event
+from mudblood.coalescer import EventCoalescer
 from mudblood.commands import CommandChain, CommandObject
 from mudblood.colors import Colors
 
 VERSION = "0.1"
 
+# Encoding of the terminal
+ENCODING = locale.getpreferredencoding() or "utf-8"
 
 master = None
 
@@ -54,6 +58,8 @@ class WindowWriter:
         return True
 
     def write(self, data, color=None):
+        if isinstance(data, unicode):
+            data = data.encode(ENCODING, "replace")
         if color:
             os.write(self.pipe, color + data + Colors.OFF)
         else:
@@ -70,7 +76,8 @@ class Interface(CommandObject):
         self.current_overlay = None
 
     def run(self):
-        self.session = Session(self.mud, self.session_callback)
+        self.events = EventCoalescer(self.session_callback, getattr(self.mud, "frame_interval", 0.05))
+        self.session = Session(self.mud, self.events)
 
         self.w_session = SessionWidget(self.session)
         self.w_status = StatusWidget()
@@ -153,7 +160,7 @@ class Interface(CommandObject):
         return outk
 
     def session_callback(self, ob, typ, arg):
-        if typ == Event.STDIO:
+        if typ == Event.STDIO or typ == Event.PROMPT:
             for o in ob.out:
                 if ob.out[o].has_data():
                     self.writer.write(ob.out[o].read())
@@ -199,7 +206,7 @@ class Interface(CommandObject):
         try:
             ret = self.command_chain.run_command(cmd)
             if ret:
-                if isinstance(ret, str):
+                if isinstance(ret, basestring):
                     self.set_status(ret)
                 else:
                     self.set_status("")
@@ -230,6 +237,9 @@ class Interface(CommandObject):
         else:
             return "No MUD def file used."
 
+    def cmd_events(self):
+        return self.events.stats()
+
     def cmd_showmap(self):
         if self.current_overlay == self.w_map:
             self.end_overlay()
@@ -342,6 +352,8 @@ class SessionWidget(urwid.BoxWidget):
         if key == 'enter':
             self.append_data(Colors.INPUT + self.input.get_edit_text() + Colors.OFF + "\n")
             t = self.input.get_edit_text()
+            if isinstance(t, str):
+                t = t.decode(ENCODING, "replace")
             self.input.set_edit_text("")
             self.history.append(t)
             self.history_pos = 0
@@ -461,7 +473,10 @@ class StatusWidget(urwid.WidgetWrap):
         if key == "enter":
             global master
 
-            words = str(self.w_main_status.get_edit_text()).split()
+            text = self.w_main_status.get_edit_text()
+            if isinstance(text, str):
+                text = text.decode(ENCODING, "replace")
+            words = text.split()
 
             if words != "":
                 master.command(words)
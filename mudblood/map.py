@@ -1,9 +1,12 @@
 import time
 import pickle
 import threading
+from collections import deque
+from fnmatch import fnmatchcase
 from operator import attrgetter
 
 from commands import CommandObject
+from pathfind import PathFinder
 
 
 class Edge:
@@ -23,20 +26,35 @@ class Edge:
         self.a, self.a_name, self.b, self.b_name = a, a_name, b, b_name
         self.split = False
         self.nowalk = False
+        self.weight = 1
 
         a.exits[a_name] = self
         b.exits[b_name] = self
+        self.changed()
+
+    def changed(self):
+        """
+            Tell the maps of both rooms that their exits changed. Must be
+            called after changing nowalk or weight.
+        """
+        for r in (self.a, self.b):
+            if r.map:
+                r.map.exits_changed(r)
 
     def remove(self):
-        del self.a.exits[self.a_name]
-        del self.b.exits[self.b_name]
+        # A later edge may have taken over one of the exits.
+        if self.a.exits.get(self.a_name) is self:
+            del self.a.exits[self.a_name]
+        if self.b.exits.get(self.b_name) is self:
+            del self.b.exits[self.b_name]
+        self.changed()
 
     def to(self, origin):
         assert origin
 
-        if self.a == origin:
+        if self.a is origin:
             return self.b
-        elif self.b == origin:
+        elif self.b is origin:
             return self.a
         else:
             raise Exception("%s is not assiciated with this edge." % str(origin))
@@ -45,16 +63,18 @@ class Edge:
         assert origin
         assert to
 
-        if self.a == origin:
+        self.changed()
+        if self.a is origin:
             del self.b.exits[self.b_name]
             self.b = to
             self.b.exits[self.b_name] = self
-        elif self.b == origin:
+        elif self.b is origin:
             del self.a.exits[self.a_name]
             self.a = to
             self.a.exits[self.a_name] = self
         else:
             raise Exception("%s is not assiciated with this edge." % str(origin))
+        self.changed()
 
     def set_name(self, origin, newname):
         """Change the name of an exit.
@@ -64,18 +84,19 @@ class Edge:
 
         assert origin
 
-        if self.a == origin:
+        if self.a is origin:
             del origin.exits[self.a_name]
             self.a_name = newname
             if newname != "":
                 origin.exits[newname] = self
-        elif self.b == origin:
+        elif self.b is origin:
             del origin.exits[self.b_name]
             self.b_name = newname
             if newname != "":
                 origin.exits[newname] = self
         else:
             raise Exception("%s is not assiciated with this edge." % str(origin))
+        self.changed()
 
     def set_opposite_name(self, origin, newname):
         self.set_name(self.to(origin), newname)
@@ -99,14 +120,15 @@ class Room:
     def __init__(self, mud, tag=""):
         self.tag = tag
         self.mud = mud
+        self.map = None
         self.roomid = -1
+        self.server_id = None
 
         self.exits = {}
         self.virtual_exits = set()
         self.x, self.y = 0, 0
         self.mark = 0
         self.comp = 0
-        self.distance = 0
 
     def __repr__(self):
         return "Room #%d, exits: %s" % (self.roomid, ",".join(["%s (%s)" % (k, type(k)) for k in self.exits.keys()]))
@@ -150,42 +172,25 @@ class Room:
         self.exits[name].remove()
 
     def dfs(self, visited):
+        """
+            @param visited  Rooms that are not to be entered.
+            @return         The set of rooms reachable from this one without
+                            passing through visited, plus visited.
+        """
         visited = set(visited)
         visited.add(self)
 
-        for _,e in self.iter_exits():
-            if e.to(self) in visited:
-                continue
-            visited |= e.to(self).dfs(visited)
+        stack = [self]
+        while stack:
+            r = stack.pop()
+            for _,e in r.iter_exits():
+                o = e.to(r)
+                if o not in visited:
+                    visited.add(o)
+                    stack.append(o)
 
         return visited
 
-    def _update_coords(self, x, y, mark, comp):
-        """
-            Set the coordinates for this room and recurse to all
-            adjacent rooms.
-
-            @param x    The x coordinate
-            @param y    The y coordinate
-            @param mark A unique value to mark already visited rooms
-            @param comp An integer defining the connected component
-        """
-        self.x = x
-        self.y = y
-        self.mark = mark
-        self.comp = comp
-
-        sx, sy = self.x, self.y
-
-        for n,e in self.exits.iteritems():
-            if e.to(self).mark == mark or e.split:
-                continue
-            try:
-                (nx, ny) = self.mud.Direction.calc(n, self.x, self.y)
-                e.to(self)._update_coords(nx, ny, mark, comp)
-            except: #self.mud.Direction.NoDirectionError:
-                pass
-
 # ---
 
 class MapNotification:
@@ -206,8 +211,22 @@ class Mapper(CommandObject):
         self.mode = "fixed"
         self.move_stack = []
         self.last_cycle = None
+        self.stats = None
+
+        # Rooms that moves in flight lead to, oldest first. The next room ID
+        # from the server belongs to the first of them rather than to
+        # current_room, which is already ahead. None if we lost track.
+        self.expected_rooms = deque()
 
     def handle_input(self, l):
+        if self.stats and self.stats.enabled:
+            start = time.time()
+            ret = self._handle_input(l)
+            self.stats.add("mapper", time.time() - start)
+            return ret
+        return self._handle_input(l)
+
+    def _handle_input(self, l):
         if l == "" or self.mode == "off":
             return
 
@@ -240,36 +259,88 @@ class Mapper(CommandObject):
                 self.map.lock.release()
                 return MapNotification.NOTHING
 
+            self.map.place_pending()
             new_room = Room(self.mud)
 
             try:
                 (x, y) = self.mud.Direction.calc(direction, self.map.current_room.x, self.map.current_room.y)
 
-                for r in self.map.rooms.itervalues():
-                    if (r.x, r.y, r.comp, r.mark) == (x, y, self.map.current_room.comp, self.map.current_room.mark):
-                        self.last_cycle = (self.map.current_room, new_room, direction)
-                        Edge(self.map.current_room, direction, r)
-                        self.map.current_room = r
-                        self.move_stack.append((self.map.current_room, direction, 1))
+                r = self.map.room_at(self.map.current_room.compid(), x, y)
+                if r:
+                    self.last_cycle = (self.map.current_room, new_room, direction)
+                    Edge(self.map.current_room, direction, r)
+                    self.map.current_room = r
+                    self.move_stack.append((self.map.current_room, direction, 1))
 
-                        self.map.lock.release()
-                        return MapNotification.NEW_CYCLE
+                    self.map.lock.release()
+                    return MapNotification.NEW_CYCLE
 
             except self.mud.Direction.NoDirectionError:
                 pass
 
             self.map.add(new_room)
-            comp = self.map.current_room.comp
+            self.map.place_next(self.map.current_room, direction, new_room)
             Edge(self.map.current_room, direction, new_room)
             self.map.current_room = new_room
             self.move_stack.append((self.map.current_room, direction, 2))
 
-            self.map.current_room._update_coords(0, 0, time.time(), comp)
-
         self.map.lock.release()
 
         return MapNotification.MODIFIED
 
+    def enter_server_room(self, sid):
+        """
+            Called when the server tells us the ID of the room we are in. A
+            known room becomes the current room, which corrects wrong guesses
+            of the mapper. A room that was just created for the last move is
+            joined with it. An unknown ID is given to the room we expected to
+            be in, unless it already has one.
+
+            If moves are in flight (see expected_rooms), the ID is for the
+            room the oldest of them leads to. When that is not where the
+            server says we are, the remaining guesses are dropped.
+
+            @param sid      The server's room ID.
+            @return         A MapNotification.
+        """
+        if sid is None or sid == "" or self.mode == "off":
+            return MapNotification.NOTHING
+        if not isinstance(sid, basestring):
+            sid = str(sid)
+
+        current = self.map.current_room
+        if self.expected_rooms:
+            room = self.expected_rooms.popleft()
+        else:
+            room = current
+        if room is not None and room.server_id == sid:
+            return MapNotification.NOTHING
+
+        known = self.map.find_server_room(sid)
+        if room is not current and (known or room is None or room.server_id is not None):
+            # Not where we expected to be, or lost track already.
+            for i in range(len(self.expected_rooms)):
+                self.expected_rooms[i] = None
+            if known:
+                self.map.current_room = known
+                return MapNotification.MODIFIED
+            return MapNotification.NOTHING
+
+        if known:
+            if current.server_id is None and self.move_stack and \
+               self.move_stack[-1][0] is current and self.move_stack[-1][2] == 2:
+                self.join(known)
+                self.move_stack[-1] = (known, self.move_stack[-1][1], 1)
+            else:
+                self.map.current_room = known
+            return MapNotification.MODIFIED
+
+        if room.server_id is None:
+            self.map.set_server_id(room, sid)
+            return MapNotification.MODIFIED
+
+        return MapNotification.NOTHING
+
     def find_room(self, room):
         """
            Address a specific room.
@@ -284,44 +355,41 @@ class Mapper(CommandObject):
 
         assert target
 
-        self.map.lock.acquire()
+        with self.map.lock:
+            return self.map.paths.find(self.map.current_room, target)
 
-        from heapq import heappush,heappop
+    def find_nearest(self, targets):
+        """
+            Nearest of several rooms, found with a single search.
 
-        self.map.current_room.shortest_path = []
-        self.map.distance = 0
-        pq = [(0, self.map.current_room)]
-        mark = time.time()
+            @param targets  A sequence of rooms, or a tag pattern with
+                            shell-style wildcards (e.g. "shop*").
+            @return         A tuple (room, path) or None if no room is
+                            reachable.
+        """
+        if isinstance(targets, basestring):
+            targets = self.map.find_rooms(targets)
 
-        while len(pq) > 0:
-            curdist, curroom = heappop(pq)
-            curroom.mark = mark
-            for name,e in curroom.iter_exits():
-                if e.nowalk:
-                    continue
-                if e.to(curroom).mark != mark or e.to(curroom).distance > curdist + 1:
-                    e.to(curroom).mark = mark
-                    e.to(curroom).shortest_path = curroom.shortest_path + [name]
-                    e.to(curroom).distance = curdist + 1
-                    heappush(pq, (curdist + 1, e.to(curroom)))
-
-        if target.mark == mark:
-            self.map.lock.release()
-            return target.shortest_path
-        else:
-            self.map.lock.release()
-            return None
+        with self.map.lock:
+            return self.map.paths.nearest(self.map.current_room, targets)
 
     def join(self, other):
         """Join current_room with other.
            The other room is kept."""
 
         with self.map.lock:
+            merged = False
             for e in self.map.current_room.exits.values():
+                if e.to(self.map.current_room).compid() != other.compid():
+                    merged = True
                 e.set_to(e.to(self.map.current_room), other)
-            del self.map.rooms[self.map.current_room.roomid]
+            self.map.remove(self.map.current_room)
             self.map.current_room = other
 
+            # Lay out again if other's component grew
+            if merged:
+                self.map.relayout([other])
+
     def undo(self):
         """
             Undo the last action.
@@ -331,13 +399,14 @@ class Mapper(CommandObject):
 
         with self.map.lock:
             r, d, t = self.move_stack.pop()
+            self.last_cycle = None
 
             self.map.current_room = self.move_stack[-1][0]
 
             if t >= 1:
                 self.map.current_room.exits[d].remove()
             if t == 2:
-                del self.map.rooms[r.roomid]
+                self.map.remove(r)
 
         return (r, d, t)
 
@@ -365,7 +434,9 @@ class Mapper(CommandObject):
 
         last_room, new_room, d = self.last_cycle
         last_room.exits[d].remove()
-        Edge(last_room, d, self.map.add(new_room))
+        self.map.add(new_room)
+        self.map.place_next(last_room, d, new_room)
+        Edge(last_room, d, new_room)
         self.map.current_room = new_room
         self.last_cycle = None
 
@@ -491,19 +562,43 @@ class Mapper(CommandObject):
         r,d = self.move_stack[-2][0], self.move_stack[-1][1]
 
         r.exits[d].split = not r.exits[d].split
-        self.map.update_coords(True)
+        self.map.relayout([r, r.exits[d].to(r)])
         return "Ok."
     
     def cmd_nowalk(self):
         r,d = self.move_stack[-2][0], self.move_stack[-1][1]
 
         r.exits[d].nowalk = not r.exits[d].nowalk
-        self.map.update_coords(True)
+        r.exits[d].changed()
         if r.exits[d].nowalk:
             return "Wayfinder will not pass the edge."
         else:
             return "Wayfinder will pass the edge."
 
+    def cmd_weight(self, *args):
+        r,d = self.move_stack[-2][0], self.move_stack[-1][1]
+
+        if not args:
+            return "The edge weighs %d." % r.exits[d].weight
+        try:
+            weight = int(args[0])
+        except ValueError:
+            return "Weight must be a number."
+        if weight < 1:
+            return "Weight must be at least 1."
+        r.exits[d].weight = weight
+        r.exits[d].changed()
+        return "The edge now weighs %d." % weight
+
+    def cmd_nearest(self, *args):
+        if not args:
+            return "Nearest to what?"
+        found = self.find_nearest(" ".join(args))
+        if found is None:
+            return "No matching room found."
+        room, path = found
+        return "Room #%d (%s), %d steps: %s" % (room.roomid, room.tag, len(path), " ".join(path))
+
     def cmd_merge(self, *args):
         """Merge this map with another map.
            Arguments: Name of other map
@@ -554,7 +649,7 @@ class Mapper(CommandObject):
 
         self.map.current_room.exits[d].remove()
         for r in v:
-            del self.map.rooms[r.roomid]
+            self.map.remove(r)
 
         return "Pruned %d rooms." % len(v)
 
@@ -564,6 +659,7 @@ class Mapper(CommandObject):
             return "Room not found."
 
         self.map.current_room.virtual_exits.add(target)
+        self.map.exits_changed(self.map.current_room)
         return "Virtual exit added."
 
     def cmd_rmvirtual(self, *args):
@@ -574,8 +670,12 @@ class Mapper(CommandObject):
             return "No virtual exit to remove."
 
         self.map.current_room.virtual_exits.remove(target)
+        self.map.exits_changed(self.map.current_room)
         return "Virtual exit removed."
 
+    def cmd_paths(self):
+        return "\n".join(self.map.paths.report())
+
     def cmd_addroom(self):
         r = Room(self.mud)
         self.map.add(r)
@@ -594,8 +694,14 @@ class Map:
         self.mud = mud
         self.name = ""
         self.rooms = {}
+        self.server_rooms = {}
+        self.coords = {}
+        self.unplaced = set()
+        self.generation = 0
+        self.paths = PathFinder(self, getattr(mud, "path_landmarks", 4))
         self.nextid = 0
         self.current_room = self.add(Room(self.mud))
+        self.layout(self.current_room)
         self.lock = threading.Lock()
 
     def __repr__(self):
@@ -608,7 +714,8 @@ class Map:
 
     def add(self, room):
         """
-            Add a room to the map.
+            Add a room to the map. It gets coordinates when it is placed,
+            or with the next place_pending().
 
             @param room     The room to add.
             @return         Just that room.
@@ -616,8 +723,158 @@ class Map:
         room.roomid = self.nextid
         self.rooms[self.nextid] = room;
         self.nextid += 1
+        room.map = self
+        room.mark = 0
+        self.unplaced.add(room)
+        self.paths.changed(room)
         return room
-    
+
+    def remove(self, room):
+        """
+            Remove a room from the map. Its exits are left alone.
+        """
+        del self.rooms[room.roomid]
+        self.unplaced.discard(room)
+        room.map = None
+        self.paths.changed(room)
+        self._unindex(room)
+
+    def exits_changed(self, room):
+        """
+            Called when exits of a room were added, removed or changed.
+        """
+        self.paths.changed(room)
+
+    def next_mark(self):
+        """
+            @return     A mark that no room has yet.
+        """
+        self.generation += 1
+        return self.generation
+
+    def place(self, room, x, y, mark, comp):
+        """
+            Give a room coordinates in the connected component (mark, comp).
+        """
+        self._unindex(room)
+        room.x, room.y, room.mark, room.comp = x, y, mark, comp
+        self.coords.setdefault((mark, comp, x, y), []).append(room)
+        self.unplaced.discard(room)
+
+    def _unindex(self, room):
+        key = (room.mark, room.comp, room.x, room.y)
+        rooms = self.coords.get(key)
+        if not rooms:
+            return
+        for i in range(len(rooms)):
+            if rooms[i] is room:
+                del rooms[i]
+                break
+        if not rooms:
+            del self.coords[key]
+
+    def place_next(self, origin, direction, room):
+        """
+            Place a new room next to origin. If direction is no compass
+            direction, the room starts a component of its own.
+        """
+        try:
+            (x, y) = self.mud.Direction.calc(direction, origin.x, origin.y)
+            self.place(room, x, y, origin.mark, origin.comp)
+        except self.mud.Direction.NoDirectionError:
+            self.place(room, 0, 0, self.next_mark(), 0)
+
+    def layout(self, room, mark=None, comp=0):
+        """
+            Give room the coordinates (0, 0) and lay out everything that
+            can be reached from it in compass directions, as connected
+            component (mark, comp). Edges that are split are not followed.
+
+            @return     The mark.
+        """
+        if mark is None:
+            mark = self.next_mark()
+        calc = self.mud.Direction.calc
+        NoDirectionError = self.mud.Direction.NoDirectionError
+
+        self.place(room, 0, 0, mark, comp)
+        stack = [(room, room.exits.iteritems())]
+        while stack:
+            r, exits = stack[-1]
+            for n,e in exits:
+                o = e.to(r)
+                if o.mark == mark or e.split:
+                    continue
+                try:
+                    (nx, ny) = calc(n, r.x, r.y)
+                except NoDirectionError:
+                    continue
+                self.place(o, nx, ny, mark, comp)
+                stack.append((o, o.exits.iteritems()))
+                break
+            else:
+                stack.pop()
+
+        return mark
+
+    def relayout(self, rooms):
+        """
+            Lay out the components of the given rooms again, e.g. after
+            edges between them changed.
+        """
+        mark = self.next_mark()
+        comp = 0
+        for r in rooms:
+            if self.rooms.get(r.roomid) is r and r.mark != mark:
+                self.layout(r, mark, comp)
+                comp += 1
+        return comp
+
+    def place_pending(self):
+        """
+            Lay out the components of all rooms that were added without
+            being placed.
+        """
+        while self.unplaced:
+            r = self.unplaced.pop()
+            if self.rooms.get(r.roomid) is r:
+                self.layout(r)
+
+    def room_at(self, compid, x, y):
+        """
+            @param compid   The (mark, comp) of a connected component.
+            @return         A room of that component at (x, y), or None.
+        """
+        found = None
+        for r in self.coords.get((compid[0], compid[1], x, y), ()):
+            if self.rooms.get(r.roomid) is not r:
+                continue
+            if (r.x, r.y) != (x, y) or r.compid() != tuple(compid):
+                continue
+            # Several rooms may share coordinates. Prefer the oldest.
+            if found is None or r.roomid < found.roomid:
+                found = r
+        return found
+
+    def set_server_id(self, room, sid):
+        """
+            Remember the server's ID for a room.
+        """
+        if room.server_id is not None:
+            self.server_rooms.pop(room.server_id, None)
+        room.server_id = sid
+        if sid is not None:
+            self.server_rooms[sid] = room
+
+    def find_server_room(self, sid):
+        """
+            @return     The room with the given server ID or None.
+        """
+        r = self.server_rooms.get(sid)
+        if r is None or self.rooms.get(r.roomid) is not r:
+            return None
+        return r
+
     def __getitem__(self, room):
         """
            Address a specific room.
@@ -627,10 +884,12 @@ class Map:
         """
         r = None
         if type(room) == str or type(room) == unicode:
+            if room == "":
+                return None
             if room[0] == "#":
                 try:
                     r = self.rooms[int(room[1:])]
-                except ValueError:
+                except (ValueError, KeyError):
                     return None
             else:
                 for ro in self.rooms.itervalues():
@@ -638,33 +897,32 @@ class Map:
                         r = ro
                         break
         elif type(room) == int:
-            r = self.rooms[room]
+            r = self.rooms.get(room)
         else:
             raise TypeError()
 
         return r
 
-    def update_coords(self, only_current=False):
-        if self.rooms == {}:
-            return 0
+    def find_rooms(self, pattern):
+        """
+            @param pattern  A tag pattern with shell-style wildcards.
+            @return         A list of rooms whose tags match.
+        """
+        return [r for r in self.rooms.itervalues() if r.tag and fnmatchcase(r.tag, pattern)]
 
-        mark = time.time()
-        comp = 0
+    def update_coords(self, only_current=False):
+        """
+            Lay out the whole map (or the current room's component) from
+            scratch.
 
-        # To render the graph, we have to assign each room a coordinate value that should
-        # reflect the topology of the game reasonably good. For this, we do a DFS on every
-        # Room we haven't visited so far (Room._update_coords()). Each DFS gives us coordinates
-        # for a single connected component of the graph.
+            @return     The number of components.
+        """
         if only_current:
-            self.current_room._update_coords(0, 0, mark, self.current_room.comp)
-        else:
-            for r in self.rooms.itervalues():
-                if r.mark != mark:
-                    r._update_coords(0, 0, mark, comp)
-                    comp += 1
-
-        return (comp, mark)
+            self.layout(self.current_room)
+            return 1
 
+        self.unplaced.clear()
+        return self.relayout(self.rooms.values())
 
     def render(self, only_current=False):
         """
@@ -676,14 +934,27 @@ class Map:
 
         self.lock.acquire()
 
-        (comp, mark) = self.update_coords(only_current)
+        self.place_pending()
+
+        comps = {}
+        order = []
+        current = self.current_room.compid()
+        for r in self.rooms.itervalues():
+            c = r.compid()
+            if only_current and c != current:
+                continue
+            if c not in comps:
+                comps[c] = []
+                order.append(c)
+            comps[c].append(r)
 
         allret = []
         bridges = []
+        curx, cury = 0, 0
 
         # Now that we have all coordinates, we can draw the map
-        for c in (only_current and [self.current_room.comp] or range(comp)):
-            comprooms = filter(lambda r: r.comp == c and r.mark == mark, self.rooms.itervalues())
+        for c in order:
+            comprooms = comps[c]
 
             minx = min([r.x for r in comprooms])
             miny = min([r.y for r in comprooms])
@@ -693,9 +964,8 @@ class Map:
             w = maxx - minx
             h = maxy - miny
 
-            for r in comprooms:
-                r.x -= minx
-                r.y -= miny
+            if c == current:
+                curx, cury = self.current_room.x - minx, self.current_room.y - miny
 
             ret = []
             for i in range((h+1) * 3 + 1):
@@ -726,7 +996,7 @@ class Map:
                     char = chr(ord("A")+bridge-1)
                 else:
                     char = "#"
-                ret[r.y * 3 + 1][r.x * 3 + 1] = char
+                ret[(r.y-miny) * 3 + 1][(r.x-minx) * 3 + 1] = char
 
 
             def vert(orig):
@@ -781,25 +1051,25 @@ class Map:
             for r in comprooms:
                 for e in r.exits:
                     if e == self.mud.Direction.SOUTH:
-                        ret[r.y*3+2][r.x*3+1] = '|'
+                        ret[(r.y-miny)*3+2][(r.x-minx)*3+1] = '|'
                     elif e == self.mud.Direction.SOUTHEAST:
-                        ret[r.y*3+2][r.x*3+2] = '\\'
+                        ret[(r.y-miny)*3+2][(r.x-minx)*3+2] = '\\'
                     elif e == self.mud.Direction.EAST:
-                        ret[r.y*3+1][r.x*3+2] = '-'
+                        ret[(r.y-miny)*3+1][(r.x-minx)*3+2] = '-'
                     elif e == self.mud.Direction.NORTHEAST:
-                        ret[r.y*3][r.x*3+2] = '/'
+                        ret[(r.y-miny)*3][(r.x-minx)*3+2] = '/'
                     elif e == self.mud.Direction.NORTH:
-                        ret[r.y*3][r.x*3+1] = '|'
+                        ret[(r.y-miny)*3][(r.x-minx)*3+1] = '|'
                     elif e == self.mud.Direction.NORTHWEST:
-                        ret[r.y*3][r.x*3] = '\\'
+                        ret[(r.y-miny)*3][(r.x-minx)*3] = '\\'
                     elif e == self.mud.Direction.WEST:
-                        ret[r.y*3+1][r.x*3] = '-'
+                        ret[(r.y-miny)*3+1][(r.x-minx)*3] = '-'
                     elif e == self.mud.Direction.SOUTHWEST:
-                        ret[r.y*3+2][r.x*3] = '/'
+                        ret[(r.y-miny)*3+2][(r.x-minx)*3] = '/'
                 e = r.get_exit(self.mud.Direction.SOUTH)
                 if e and e.to(r).compid() == r.compid():
-                    cy = r.y * 3 + 1 + 1
-                    cx = r.x * 3 + 1
+                    cy = (r.y-miny) * 3 + 1 + 1
+                    cx = (r.x-minx) * 3 + 1
                     if e.to(r).x == r.x:
                         while cy < h * 3 + 1 and chr(ret[cy][cx]) in [' ', '-', '/', '\\', '+']:
                             ret[cy][cx] = vert(chr(ret[cy][cx]))
@@ -807,7 +1077,7 @@ class Map:
                     elif e.to(r).x > r.x:
                         ret[cy][cx] = "|"
                         cx += 1
-                        while cx < e.to(r).x * 3 + 1:
+                        while cx < (e.to(r).x-minx) * 3 + 1:
                             ret[cy][cx] = "_"
                             cx += 1
                         cy += 1
@@ -815,7 +1085,7 @@ class Map:
                     elif e.to(r).x < r.x:
                         ret[cy][cx] = "|"
                         cx -= 1
-                        while cx < e.to(r).x * 3 + 1:
+                        while cx < (e.to(r).x-minx) * 3 + 1:
                             ret[cy][cx] = "_"
                             cx -= 1
                         cy += 1
@@ -823,16 +1093,16 @@ class Map:
 
                 e = r.get_exit(self.mud.Direction.EAST)
                 if e and e.to(r).y == r.y and e.to(r).compid() == r.compid():
-                    cy = r.y * 3 + 1
-                    cx = r.x * 3 + 1 + 1
+                    cy = (r.y-miny) * 3 + 1
+                    cx = (r.x-minx) * 3 + 1 + 1
                     while cx < w * 3 + 1 and chr(ret[cy][cx]) in [' ', '-', '/', '\\', '+']:
                         ret[cy][cx] = horiz(chr(ret[cy][cx]))
                         cx += 1
 
                 e = r.get_exit(self.mud.Direction.SOUTHEAST)
                 if e and e.to(r).compid() == r.compid():
-                    cy = r.y * 3 + 1 + 1
-                    cx = r.x * 3 + 1 + 1
+                    cy = (r.y-miny) * 3 + 1 + 1
+                    cx = (r.x-minx) * 3 + 1 + 1
                     if e.to(r).y-e.to(r).x == r.y-r.x:
                         while cx < w * 3 + 1 and cy < h * 3 + 1 and chr(ret[cy][cx]) in [' ', '-', '/', '\\', '+']:
                             ret[cy][cx] = diag1(chr(ret[cy][cx]))
@@ -841,10 +1111,10 @@ class Map:
                     else:
                         ret[cy][cx] = "\\"
                         cx += 1
-                        while cx < e.to(r).x * 3 + 1:
+                        while cx < (e.to(r).x-minx) * 3 + 1:
                             ret[cy][cx] = "_"
                             cx += 1
-                        while cy < e.to(r).y * 3 - 1:
+                        while cy < (e.to(r).y-miny) * 3 - 1:
                             ret[cy][cx] = "|"
                             cy += 1
                         cy += 1
@@ -852,8 +1122,8 @@ class Map:
 
                 e = r.get_exit(self.mud.Direction.SOUTHWEST)
                 if e and e.to(r).compid() == r.compid():
-                    cy = r.y * 3 + 1 + 1
-                    cx = r.x * 3 + 1 - 1
+                    cy = (r.y-miny) * 3 + 1 + 1
+                    cx = (r.x-minx) * 3 + 1 - 1
                     if e.to(r).y+e.to(r).x == (r.y+r.x):
                         while cx >= 0 and cy < h * 3 + 1 and chr(ret[cy][cx]) in [' ', '-', '/', '\\', '+']:
                             ret[cy][cx] = diag2(chr(ret[cy][cx]))
@@ -862,11 +1132,11 @@ class Map:
                     else:
                         ret[cy][cx] = "/"
                         cx -= 1
-                        while cx > e.to(r).x * 3 + 2:
+                        while cx > (e.to(r).x-minx) * 3 + 2:
                             ret[cy][cx] = "_"
                             cx -= 1
                         cy += 1
-                        while cy < e.to(r).y * 3:
+                        while cy < (e.to(r).y-miny) * 3:
                             ret[cy][cx] = "|"
                             cy += 1
                         ret[cy][cx] = "/"
@@ -876,19 +1146,27 @@ class Map:
 
         self.lock.release()
 
-        return (allret, self.current_room.x*3, self.current_room.y*3)
+        return (allret, curx*3, cury*3)
 
 class MapPickler:
     class BadFileException(Exception):
         pass
 
     def save(self, map, file):
-        file.write("#mudblood map file\n")
-        file.write("%s\n%d\n%d\n" % (map.name, map.nextid, map.current_room.roomid))
+        """
+            Names and tags may be unicode, they are written as UTF-8.
+        """
+        def write(text):
+            if isinstance(text, unicode):
+                text = text.encode("utf-8")
+            file.write(text)
+
+        write("#mudblood map file\n")
+        write("%s\n%d\n%d\n" % (map.name, map.nextid, map.current_room.roomid))
 
         for r in map.rooms.itervalues():
-            file.write("%d %s\n" % (r.roomid, r.tag))
-        file.write("\n")
+            write("%d %s\n" % (r.roomid, r.tag))
+        write("\n")
         edges = set()
         vedges = []
         for r in map.rooms.itervalues():
@@ -897,16 +1175,22 @@ class MapPickler:
             for v in r.virtual_exits:
                 vedges.append((r.roomid, v.roomid))
         for e in edges:
-            file.write("%d|%s|%d|%s|%d|%d\n" % (e.a.roomid, e.a_name, e.b.roomid, e.b_name, (e.split and 1 or 0), (e.nowalk and 1 or 0)))
-        file.write("\n")
+            write("%d|%s|%d|%s|%d|%d|%d\n" % (e.a.roomid, e.a_name, e.b.roomid, e.b_name, (e.split and 1 or 0), (e.nowalk and 1 or 0), e.weight))
+        write("\n")
         for v in vedges:
-            file.write("%d %d\n" % (v[0], v[1]))
+            write("%d %d\n" % (v[0], v[1]))
+        write("\n")
+        for r in map.rooms.itervalues():
+            if r.server_id is not None:
+                write("%d %s\n" % (r.roomid, r.server_id))
 
     def load(self, mud, file):
+        def readline():
+            return file.readline().decode("utf-8", "replace")
         def readint():
-            return int(file.readline().strip())
+            return int(readline().strip())
         def readln():
-            return file.readline().strip()
+            return readline().strip()
 
         if readln() != "#mudblood map file":
             raise BadFileException("Magic line not found.")
@@ -918,17 +1202,18 @@ class MapPickler:
             map.current_room = readint()
 
             # Rooms
-            l = file.readline()
+            l = readline()
             while l != "\n":
                 l = l.strip().split(" ")
                 room = Room(mud)
                 room.roomid = int(l[0])
                 room.tag = " ".join(l[1:])
+                room.map = map
                 map.rooms[room.roomid] = room
-                l = file.readline()
+                l = readline()
 
             # Edges
-            l = file.readline()
+            l = readline()
             while l != "" and l != "\n":
                 l = l.strip().split("|")
                 edge = Edge(map.rooms[int(l[0])], l[1], map.rooms[int(l[2])], l[3])
@@ -938,18 +1223,28 @@ class MapPickler:
                 # TODO: remove the if after migration
                 if len(l) > 5:
                     edge.nowalk = (l[5] == "1")
+                if len(l) > 6:
+                    edge.weight = int(l[6])
 
                 edge.split = (l[4] == "1")
-                l = file.readline()
+                l = readline()
 
             # Virtual Edges
-            l = file.readline()
-            while l != "":
+            l = readline()
+            while l != "" and l != "\n":
                 l = l.strip().split(" ")
                 map.rooms[int(l[0])].virtual_exits.add(map.rooms[int(l[1])])
-                l = file.readline()
+                l = readline()
+
+            # Server room IDs
+            l = readline()
+            while l != "":
+                l = l.strip().split(" ", 1)
+                map.set_server_id(map.rooms[int(l[0])], l[1])
+                l = readline()
 
             map.current_room = map.rooms[map.current_room]
+            map.update_coords()
         except:
             raise self.BadFileException("Malformed map file")
         
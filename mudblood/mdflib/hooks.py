@@ -1,6 +1,123 @@
 import re
+import time
+import bisect
+import threading
+import sre_parse
+import sre_constants as sre
+
 from mudblood.session import Hook
 
+def required_literal(regex):
+    """
+        Find a string that must be contained in every line the regular
+        expression matches.
+
+        @param regex    The regular expression as a string.
+        @return         The longest such string that could be found, or u"".
+                        Always unicode, since lines are.
+    """
+    try:
+        parsed = sre_parse.parse(regex)
+    except sre.error:
+        return u""
+    if parsed.pattern.flags & sre.SRE_FLAG_IGNORECASE:
+        return u""
+
+    runs = []
+
+    def walk(seq):
+        run = []
+        for op, av in seq:
+            if op is sre.LITERAL:
+                run.append(unichr(av))
+            elif op is sre.AT:
+                # Zero-width, the literals around it are adjacent.
+                continue
+            else:
+                runs.append(u"".join(run))
+                run = []
+                if op is sre.SUBPATTERN:
+                    walk(av[1])
+                elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[0] >= 1:
+                    walk(av[2])
+        runs.append(u"".join(run))
+
+    walk(parsed)
+    return max(runs, key=len)
+
+class LiteralFilter:
+    """
+        Prefilter for a list of regular expressions. The required literals
+        of all expressions are searched for in a single scan of the line,
+        so that only the expressions that can possibly match have to be run.
+    """
+    MAX_LITERAL = 32
+
+    def __init__(self, regexes):
+        """
+            @param regexes  A list of regular expressions (strings).
+        """
+        self.always = []
+        self.by_literal = {}
+
+        for i in range(len(regexes)):
+            lit = required_literal(regexes[i])[:self.MAX_LITERAL]
+            if not lit:
+                self.always.append(i)
+            else:
+                self.by_literal.setdefault(lit, []).append(i)
+
+        # The scanner finds the longest literal at every position. All other
+        # literals at that position are prefixes of it.
+        self.prefixes = {}
+        for lit in self.by_literal:
+            self.prefixes[lit] = [p for p in self.by_literal if lit.startswith(p)]
+
+        if self.by_literal:
+            self.scanner = re.compile("(?=(%s))" % self._trie_regex(self.by_literal.keys()))
+        else:
+            self.scanner = None
+
+    def _trie_regex(self, literals):
+        trie = {}
+        for lit in literals:
+            node = trie
+            for c in lit:
+                node = node.setdefault(c, {})
+            node[""] = None
+
+        def build(node):
+            alts = [re.escape(c) + build(node[c]) for c in sorted(node) if c != ""]
+            if not alts:
+                return ""
+            if len(alts) == 1 and "" not in node:
+                return alts[0]
+            return "(?:%s)%s" % ("|".join(alts), "" in node and "?" or "")
+
+        return build(trie)
+
+    def candidates(self, line):
+        """
+            @return     A sorted list of the indices of all expressions that
+                        might match line.
+        """
+        if self.scanner is None:
+            return self.always
+
+        found = set(self.scanner.findall(line))
+        if not found:
+            return self.always
+
+        ret = set(self.always)
+        for lit in found:
+            if isinstance(lit, str):
+                # A byte string line, its bytes match the code points
+                # of the same value.
+                lit = lit.decode("latin-1")
+            for p in self.prefixes[lit]:
+                ret.update(self.by_literal[p])
+        return sorted(ret)
+
 class StreamHook(Hook):
     def __init__(self, condition, stream):
         self.condition = condition
@@ -14,6 +131,8 @@ class StreamHook(Hook):
         return line
 
 class SuppressHook(Hook):
+    pure = True
+
     def __init__(self, regex):
         self.regex = regex
 
@@ -24,7 +143,19 @@ class SuppressHook(Hook):
         else:
             return line
 
+class SubstituteHook(Hook):
+    pure = True
+
+    def __init__(self, regex, replacement):
+        self.regex = re.compile(regex)
+        self.replacement = replacement
+
+    def process(self, session, line):
+        return self.regex.sub(self.replacement, line)
+
 class HighlightHook(Hook):
+    pure = True
+
     def __init__(self, regex, color):
         self.regex = regex
         self.color = color
@@ -37,6 +168,8 @@ class HighlightHook(Hook):
             return line
 
 class HighlightLineHook(Hook):
+    pure = True
+
     def __init__(self, regex, color):
         self.regex = regex
         self.color = color
@@ -48,42 +181,556 @@ class HighlightLineHook(Hook):
         else:
             return line
 
+class HighlightList(Hook):
+    """
+        Applies any number of highlights to a line at once. The matches of
+        all rules are collected first, overlaps are resolved by priority
+        (the earlier rule wins a tie) and the line is put together in a
+        single join.
+    """
+    pure = True
+
+    class Rule:
+        def __init__(self, regex, color, priority, whole_line):
+            self.pattern = regex
+            self.regex = re.compile(regex)
+            self.color = color
+            self.code = "\033[3%dm" % color
+            self.priority = priority
+            self.whole_line = whole_line
+
+        def __repr__(self):
+            return "%s -> %d%s (priority %d)" % (self.pattern, self.color,
+                    self.whole_line and ", whole line" or "", self.priority)
+
+    def __init__(self):
+        self.rules = []
+        self.matcher = None
+
+    def add(self, regex, color, priority=0, whole_line=False):
+        """
+            @param regex        What to highlight.
+            @param color        Color number (0-7).
+            @param priority     Overlapping matches of rules with a higher
+                                priority win.
+            @param whole_line   Color the whole line instead of the match.
+        """
+        self.rules.append(self.Rule(regex, color, priority, whole_line))
+        self.matcher = None
+        self.version += 1
+
+    def remove(self, n):
+        del self.rules[n]
+        self.matcher = None
+        self.version += 1
+
+    def process(self, session, line):
+        m = self.matcher
+        if m is None:
+            rules = list(self.rules)
+            m = self.matcher = (LiteralFilter([r.pattern for r in rules]), rules)
+
+        candidates = m[0].candidates(line)
+        if not candidates:
+            return line
+
+        if line.endswith("\n"):
+            body, end = line[:-1], "\n"
+        else:
+            body, end = line, ""
+
+        spans = []
+        linerule = None
+        for i in candidates:
+            r = m[1][i]
+            if r.whole_line:
+                if (linerule is None or r.priority > linerule.priority) and r.regex.search(body):
+                    linerule = r
+            else:
+                for match in r.regex.finditer(body):
+                    if match.end() > match.start():
+                        spans.append((-r.priority, i, match.start(), match.end(), r.code))
+
+        if not spans and linerule is None:
+            return line
+
+        # Claim the line for the spans in order of priority. starts/ends hold
+        # the spans accepted so far, sorted by position.
+        starts, ends, codes = [], [], []
+        spans.sort()
+        for _, _, s, e, code in spans:
+            k = bisect.bisect(starts, s)
+            if k > 0 and ends[k-1] > s:
+                continue
+            if k < len(starts) and starts[k] < e:
+                continue
+            starts.insert(k, s)
+            ends.insert(k, e)
+            codes.insert(k, code)
+
+        linecode = linerule and linerule.code or ""
+        reset = "\033[0m" + linecode
+
+        pieces = [linecode]
+        pos = 0
+        for k in range(len(starts)):
+            pieces.extend((body[pos:starts[k]], codes[k], body[starts[k]:ends[k]], reset))
+            pos = ends[k]
+        pieces.append(body[pos:])
+        if linecode:
+            pieces.append("\033[0m")
+        pieces.append(end)
+
+        return "".join(pieces)
+
 class FunctionHook(Hook):
-    def __init__(self, cond, fun):
+    def __init__(self, cond, fun, offload=False):
+        """
+            @param cond     Function (session, line) deciding whether to call fun.
+            @param fun      Function (session, line).
+            @param offload  Run fun on the session's worker pool instead of the
+                            input path. Calls of the same hook stay in order.
+        """
         self.cond = cond
         self.fun = fun
+        self.offload = offload
 
     def process(self, session, line):
         if self.cond(session, line):
-            self.fun(session, line)
+            if self.offload:
+                session.workers.submit(self, self.fun, session, line)
+            elif session.stats.enabled:
+                start = time.time()
+                self.fun(session, line)
+                session.stats.add("function " + getattr(self.fun, "__name__", "?"),
+                                  time.time() - start)
+            else:
+                self.fun(session, line)
 
         return line
 
+class CaptureTrigger(Hook):
+    """
+        Captures a block of lines, e.g. an inventory or a "who" listing.
+
+        The block starts with a line matching start and ends with a line
+        matching end, after count lines or when timeout seconds have passed,
+        whichever comes first. Then fun(session, lines) is called with all
+        lines of the block (without newlines). Every line is looked at once.
+    """
+    def __init__(self, start, fun, end=None, count=None, timeout=None, gag=False):
+        """
+            @param start    Regular expression for the first line of the block.
+            @param fun      Function (session, lines).
+            @param end      Regular expression for the last line of the block.
+            @param count    Maximum number of lines, including the first one.
+            @param timeout  Maximum time in seconds to wait for the block to end.
+            @param gag      Don't display the lines of the block.
+        """
+        if end is None and count is None and timeout is None:
+            raise ValueError("A capture needs an end, a count or a timeout")
+
+        self.start = re.compile(start)
+        self.end = end and re.compile(end)
+        self.fun = fun
+        self.count = count
+        self.timeout = timeout
+        self.gag = gag
+
+        self.lock = threading.Lock()
+        self.lines = None
+        self.timer = None
+
+    def process(self, session, line):
+        with self.lock:
+            if self.lines is None:
+                if not self.start.search(line):
+                    return line
+                self.lines = []
+                if self.timeout:
+                    self.timer = session.after(self.timeout, self._expire, "capture")
+
+            self.lines.append(line.rstrip("\n"))
+            if ((self.end and len(self.lines) > 1 and self.end.search(line))
+                    or (self.count and len(self.lines) >= self.count)):
+                lines = self._take()
+            else:
+                lines = None
+
+        if lines is not None:
+            self.fun(session, lines)
+
+        if self.gag:
+            return None
+        return line
+
+    def _take(self):
+        lines = self.lines
+        self.lines = None
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        return lines
+
+    def _expire(self, session):
+        with self.lock:
+            if self.lines is None:
+                return
+            lines = self._take()
+        self.fun(session, lines)
+
 class TriggerList(Hook):
     def __init__(self):
         self.t = []
+        self.matcher = None
+        self.lines = 0
 
     def add(self, trigger):
         self.t.append(trigger)
+        self.matcher = None
 
     def remove(self, n):
         del self.t[n]
+        self.matcher = None
 
     def process(self, session, line):
-        for t in self.t:
-            t.process(session, line)
+        m = self.matcher
+        if m is None:
+            triggers = list(self.t)
+            m = self.matcher = (LiteralFilter([t.trigger for t in triggers]), triggers)
+
+        self.lines += 1
+        if session.stats.enabled:
+            start = time.time()
+            candidates = m[0].candidates(line)
+            session.stats.add("trigger prefilter", time.time() - start)
+            for i in candidates:
+                start = time.time()
+                m[1][i].process(session, line)
+                session.stats.add("trigger " + m[1][i].trigger, time.time() - start)
+        else:
+            for i in m[0].candidates(line):
+                m[1][i].process(session, line)
         return line
 
+    def stats(self):
+        """
+            @return     A list of strings with hit and cost counters for
+                        every trigger.
+        """
+        ret = ["%d lines, %d regex runs" % (self.lines, sum([t.calls for t in self.t]))]
+        for k in range(len(self.t)):
+            t = self.t[k]
+            ret.append("%d: %d hits, %d runs, %.3fms - %s" % (k, t.hits, t.calls, t.time * 1000, t.trigger))
+        return ret
+
 class Trigger(Hook):
-    def __init__(self, trigger, response):
+    def __init__(self, trigger, response, offload=False):
+        """
+            @param trigger  Regular expression.
+            @param response Sent to the MUD, formatted with the match's groups.
+            @param offload  Send the response from the session's worker pool.
+        """
         self.trigger = trigger
+        self.regex = re.compile(trigger)
         self.response = response
+        self.offload = offload
+
+        self.hits = 0
+        self.calls = 0
+        self.time = 0.0
 
     def __repr__(self):
         return "%s -> %s" % (self.trigger, self.response)
 
     def process(self, session, line):
-        m = re.search(self.trigger, line)
+        start = time.time()
+        m = self.regex.search(line)
+        self.calls += 1
         if m:
-            session.stdin.writeln(self.response % m.groups())
+            self.hits += 1
+            if self.offload:
+                session.workers.submit(self, session.stdin.writeln, self.response % m.groups())
+            else:
+                session.stdin.writeln(self.response % m.groups())
+        self.time += time.time() - start
         return line
+
+class AliasList(Hook):
+    """
+        Expands aliases and speedwalks in the lines sent to the MUD.
+
+        Alias names are kept in a character trie, so that finding the alias
+        for a line takes one step per character of the line, no matter how
+        many aliases there are. Names may contain spaces, the longest name
+        that ends at a word boundary wins. The rest of the line is split
+        into arguments.
+
+        The body of an alias is a template that is compiled once: $1 to $9
+        stand for the arguments, $* for all of them and $$ for a dollar
+        sign. If the body uses none of them, the arguments are appended.
+        Several commands are separated with ';'. Every resulting command is
+        expanded again, up to MAX_DEPTH times.
+
+        A speedwalk is a line made only of directions, some of them with a
+        count, like "3n2o" or "n2wu". It needs at least one count, or the
+        prefix (by default "#"), as in "#n,n,o,o". Steps may be separated
+        with spaces or commas. They must be where one direction is the
+        beginning of another: "#nnoo" could be n, n, o, o as well as n, no,
+        o, so it is rejected. A count and a single direction, like "2no",
+        always mean that direction.
+
+        A line starting with a backslash is sent as it is, without the
+        backslash.
+
+        One line can expand to many, they are returned as a single string
+        and queued together.
+    """
+    MAX_DEPTH = 10
+    MAX_STEPS = 100
+
+    # Template pieces that aren't strings
+    ALL_ARGS = -1
+
+    class AmbiguousSpeedwalk(Exception):
+        pass
+
+    class Alias:
+        def __init__(self, name, body):
+            self.name = name
+            self.body = body
+            self.commands = [self.compile(c.strip()) for c in body.split(";")]
+
+        @classmethod
+        def compile(cls, template):
+            """
+                @return     A list of strings and argument indices
+                            (AliasList.ALL_ARGS for $*).
+            """
+            pieces = []
+            for i, part in enumerate(re.split(r"\$(\$|\*|[1-9])", template)):
+                if i % 2 == 0:
+                    if part:
+                        pieces.append(part)
+                elif part == "$":
+                    pieces.append("$")
+                elif part == "*":
+                    pieces.append(AliasList.ALL_ARGS)
+                else:
+                    pieces.append(int(part) - 1)
+            return pieces
+
+        def expand(self, args):
+            """
+                @param args     The rest of the line after the name.
+                @return         A list of commands.
+            """
+            words = args.split()
+            ret = []
+            uses_args = False
+            for pieces in self.commands:
+                out = []
+                for p in pieces:
+                    if isinstance(p, int):
+                        uses_args = True
+                        if p == AliasList.ALL_ARGS:
+                            out.append(args)
+                        elif p < len(words):
+                            out.append(words[p])
+                    else:
+                        out.append(p)
+                ret.append("".join(out))
+            if args and not uses_args:
+                ret[-1] = ret[-1] + " " + args
+            return ret
+
+        def __repr__(self):
+            return "%s -> %s" % (self.name, self.body)
+
+    def __init__(self, directions=(), prefix="#"):
+        """
+            @param directions   Direction commands that can be used in
+                                speedwalks, e.g. ["n", "s", "no", ...].
+            @param prefix       Marks a speedwalk without counts.
+        """
+        self.aliases = {}
+        self.trie = {}
+        self.prefix = prefix
+        self.set_directions(directions)
+
+        self.lines = 0
+        self.expanded = 0
+
+    def set_directions(self, directions):
+        """
+            @param directions   Direction commands that can be used in
+                                speedwalks.
+        """
+        self.directions = sorted(set([d for d in directions if d]), key=len, reverse=True)
+
+    def add(self, name, body):
+        """
+            Add an alias, or replace the one with the same name.
+        """
+        name = " ".join(name.split())
+        if not name:
+            raise ValueError("Empty alias name")
+        alias = self.Alias(name, body)
+
+        node = self.trie
+        for c in name:
+            node = node.setdefault(c, {})
+        node[None] = alias
+        self.aliases[name] = alias
+        self.version += 1
+
+    def remove(self, name):
+        """
+            Raises KeyError if there is no such alias.
+        """
+        name = " ".join(name.split())
+        del self.aliases[name]
+
+        # Remove the leaf and every node that leads to nothing else
+        path = []
+        node = self.trie
+        for c in name:
+            path.append((node, c))
+            node = node[c]
+        del node[None]
+        while path and not node:
+            parent, c = path.pop()
+            del parent[c]
+            node = parent
+        self.version += 1
+
+    def lookup(self, line):
+        """
+            @return     (alias, arguments) for the longest alias name the
+                        line starts with, or (None, None).
+        """
+        node = self.trie
+        found = (None, None)
+        n = len(line)
+        for i in xrange(n + 1):
+            if None in node and (i == n or line[i] == " "):
+                found = (node[None], line[i+1:].strip())
+            if i == n:
+                break
+            node = node.get(line[i])
+            if node is None:
+                break
+        return found
+
+    def speedwalk(self, line):
+        """
+            @return     A list of moves, or None if the line is no speedwalk.
+                        Raises AmbiguousSpeedwalk if the line can be read as
+                        more than one.
+        """
+        if not self.directions:
+            return None
+        if self.prefix and line.startswith(self.prefix):
+            line = line[len(self.prefix):]
+        elif not any([c.isdigit() for c in line]):
+            return None
+
+        steps = []
+        for part in re.split(r"[\s,]+", line):
+            if part:
+                s = self._parse_steps(part)
+                if s is None:
+                    return None
+                steps.extend(s)
+        if not steps:
+            return None
+
+        moves = []
+        for count, d in steps:
+            moves.extend([d] * min(int(count or 1), self.MAX_STEPS))
+            if len(moves) > self.MAX_STEPS:
+                return moves[:self.MAX_STEPS]
+        return moves
+
+    def _parse_steps(self, part):
+        """
+            Split part into (count, direction) tuples.
+
+            @return     The tuples, or None if part can't be split.
+        """
+        count = part.lstrip("0123456789")
+        if count in self.directions:
+            return [(part[:len(part) - len(count)], count)]
+
+        # ways[i] counts the ways to read part[:i], back[i] is the last
+        # step of one of them
+        n = len(part)
+        ways = [0] * (n + 1)
+        back = [None] * (n + 1)
+        ways[0] = 1
+        for i in xrange(n):
+            if not ways[i]:
+                continue
+            j = i
+            while j < n and part[j].isdigit():
+                j += 1
+            for d in self.directions:
+                if part.startswith(d, j):
+                    k = j + len(d)
+                    ways[k] += ways[i]
+                    back[k] = (i, part[i:j], d)
+
+        if not ways[n]:
+            return None
+        if ways[n] > 1:
+            raise self.AmbiguousSpeedwalk(part)
+
+        steps = []
+        k = n
+        while k:
+            i, count, d = back[k]
+            steps.append((count, d))
+            k = i
+        steps.reverse()
+        return steps
+
+    def expand(self, line, depth=0):
+        """
+            @return     A list of commands.
+        """
+        if line.startswith("\\"):
+            return [line[1:]]
+        if depth < self.MAX_DEPTH:
+            alias, args = self.lookup(line)
+            if alias is not None:
+                ret = []
+                for c in alias.expand(args):
+                    ret.extend(self.expand(c, depth + 1))
+                return ret
+            moves = self.speedwalk(line)
+            if moves is not None:
+                return moves
+        return [line]
+
+    def process(self, session, line):
+        self.lines += 1
+        body = line.rstrip("\r\n")
+        if not body or not (self.aliases or self.directions):
+            return line
+
+        try:
+            commands = self.expand(body.strip())
+        except self.AmbiguousSpeedwalk, e:
+            if session:
+                session._report_info("Ambiguous speedwalk '%s', separate the steps with "
+                                     "spaces or commas." % e)
+            return None
+        if commands == [body.strip()] and not body.startswith("\\"):
+            return line
+
+        self.expanded += 1
+        return "".join([c + "\n" for c in commands])
+
+    def stats(self):
+        return "%d aliases, %d of %d lines expanded" % (
+                len(self.aliases), self.expanded, self.lines)
@@ -3,6 +3,8 @@
 #
 # MUD definition base module. Must be imported by MUD definitions.
 
+import re
+
 from mdflib import hooks
 
 def pass_command(cmd):
@@ -77,6 +79,23 @@ def connect(s):
     global session
     session = s
 
+    mud = s.mud
+    mud.aliases.prefix = mud.speedwalk_prefix
+    mud.aliases.set_directions(mud.speedwalk_directions or
+                               [d[0][0] for d in mud.Direction.directions])
+
+    # connect() runs again on reload, don't subscribe twice.
+    for name, fun in (("Room.Info", _gmcp_room), ("ROOM_VNUM", _msdp_room)):
+        s.oob.unsubscribe(name, fun)
+        s.oob.subscribe(name, fun)
+
+def _gmcp_room(session, name, value):
+    if isinstance(value, dict) and "num" in value:
+        session.mapper.enter_server_room(value["num"])
+
+def _msdp_room(session, name, value):
+    session.mapper.enter_server_room(value)
+
 def cmd_toggle_map_mode():
     if session.mapper.mode == "fixed":
         session.mapper.mode = "auto"
@@ -91,7 +110,10 @@ def cmd_toggle_map_mode():
 def cmd_addtrigger(*args):
     (t, m, r) = " ".join(args).partition(" -> ")
     if m:
-        triggers.add(hooks.Trigger(t, r))
+        try:
+            triggers.add(hooks.Trigger(t, r))
+        except re.error, e:
+            return "Invalid pattern: %s" % e
         return "Added Trigger: '%s' Response: '%s'" % (t, r)
     else:
         return "Syntax Error"
@@ -104,7 +126,51 @@ def cmd_deltrigger(n):
 def cmd_triggers():
     return "\n".join(["%d: %s" % (k, str(triggers.t[k])) for k in range(len(triggers.t))])
 
+def cmd_addhighlight(color, *args):
+    try:
+        highlights.add(" ".join(args), int(color))
+    except re.error, e:
+        return "Invalid pattern: %s" % e
+    return "Added Highlight: '%s' Color: %s" % (" ".join(args), color)
+
+def cmd_delhighlight(n):
+    n = int(n)
+    highlights.remove(n)
+    return "Deleted highlight #%d" % n
+
+def cmd_highlights():
+    return "\n".join(["%d: %s" % (k, str(highlights.rules[k])) for k in range(len(highlights.rules))])
+
+def cmd_triggerstats():
+    return "\n".join(triggers.stats())
+
+def cmd_addalias(*args):
+    (name, m, body) = " ".join(args).partition(" -> ")
+    if m:
+        try:
+            aliases.add(name, body)
+        except ValueError, e:
+            return str(e)
+        return "Added Alias: '%s' Body: '%s'" % (name.strip(), body)
+    else:
+        return "Syntax Error"
+
+def cmd_delalias(*args):
+    try:
+        aliases.remove(" ".join(args))
+    except KeyError:
+        return "No such alias"
+    return "Deleted alias '%s'" % " ".join(args)
+
+def cmd_aliases():
+    return "\n".join([str(aliases.aliases[k]) for k in sorted(aliases.aliases)]
+                     + [aliases.stats()])
+
 def get_middle_status():
+    if session and "HEALTH" in session.oob.values:
+        v = session.oob.values
+        return "HP %s/%s SP %s/%s" % (v.get("HEALTH"), v.get("HEALTH_MAX", "?"),
+                                      v.get("MANA", "?"), v.get("MANA_MAX", "?"))
     return ""
 
 def get_right_status():
@@ -130,12 +196,88 @@ path = ""
 host = "localhost"
 port = 9999
 
+# How sessions talk to the server. "thread" uses two threads per session,
+# "loop" serves all sessions from a single shared event loop.
+transport = "thread"
+
+# Accept compression (MCCP v2) if the server offers it.
+mccp = True
+
+# Structured data from the server (see Session.oob). GMCP packages we ask
+# for, and MSDP variables we want reported.
+gmcp = True
+gmcp_packages = ["Core 1", "Char 1", "Room 1"]
+msdp = True
+msdp_variables = ["HEALTH", "HEALTH_MAX", "MANA", "MANA_MAX", "ROOM_VNUM"]
+
+# An incomplete line is passed on as a prompt at once if the server marks it
+# with telnet GA/EOR or if it matches prompt_pattern (a regular expression,
+# by default strings['prompt']). Otherwise, this happens when no more data
+# arrived for prompt_timeout seconds.
+prompt_pattern = None
+prompt_timeout = 0.1
+
+# Encoding of the text from and to the server. If the server supports
+# TELNET CHARSET, the first of charsets that it offers is used instead.
+encoding = "latin-1"
+charsets = ["UTF-8", "ISO-8859-1"]
+
+# Commands per second sent to the server (0 means no limit) and how many may
+# go out at once after a pause. Set a rate if the MUD has flood protection.
+# Speedwalks are queued behind typed commands, session.send(cmd,
+# CommandQueue.URGENT) skips the queue.
+send_rate = 0
+send_burst = 10
+
+# Speedwalking ("walk <room>"): how many moves are sent ahead of their
+# confirmation, a pattern matching the MUD's answer to a move that failed
+# (e.g. r"^Dort geht es nicht weiter"), how long to wait for a confirmation
+# (seconds) and how often to plan a new path after failed moves. Moves are
+# confirmed by room IDs if the server sends them, otherwise by prompts marked
+# with GA/EOR or matching prompt_pattern.
+walk_window = 3
+walk_fail_pattern = None
+walk_timeout = 5
+walk_retries = 3
+
+# Number of landmark rooms the path finder keeps distance tables for. More
+# landmarks make searches on large maps faster, but cost memory and time when
+# exits change. 0 disables them.
+path_landmarks = 4
+
+# Maximum number of bytes buffered in each of a session's streams (0 means
+# unlimited) and what to do with output when the interface can't keep up:
+# "block", "drop" or "summarize". Input to the MUD always blocks.
+stream_limit = 1024 * 1024
+stream_policy = "summarize"
+
+# Cache the results of pure input hooks (highlights, substitutions, ...)
+# for this many distinct lines. 0 disables the cache.
+hook_cache = 0
+
+# Interfaces are notified about new output at most once per frame interval
+# (in seconds). 0 delivers every event immediately.
+frame_interval = 0.05
+
+# Number of threads for hooks and triggers created with offload=True.
+worker_threads = 4
+
 strings = {
     'prompt': "\n> ",
     'command_not_found': "Hae?",
     }
 
+# Directions that can be used in speedwalks (e.g. "3n2o"). None means the
+# first name of every direction in Direction.directions, taken when the
+# session connects. A speedwalk without counts needs the prefix, which must
+# differ from the interface's command prefix ("."), as in "#n,n,o,o".
+# Separators are needed where one direction is the beginning of another.
+speedwalk_directions = None
+speedwalk_prefix = "#"
+
 triggers = hooks.TriggerList()
+highlights = hooks.HighlightList()
+aliases = hooks.AliasList((), speedwalk_prefix)
 
-input_hooks = [triggers]
-output_hooks = []
+input_hooks = [triggers, highlights]
+output_hooks = [aliases]
@@ -0,0 +1,178 @@
+import re
+import json
+import traceback
+
+from telnet import GMCP, MSDP, subnegotiation
+from sessionlog import OOB as OOB_RECORD
+
+# MSDP tokens
+MSDP_VAR         = 1
+MSDP_VAL         = 2
+MSDP_TABLE_OPEN  = 3
+MSDP_TABLE_CLOSE = 4
+MSDP_ARRAY_OPEN  = 5
+MSDP_ARRAY_CLOSE = 6
+
+_msdp_token = re.compile("[\x01-\x06]")
+_integer = re.compile(r"-?\d+$")
+
+def decode_gmcp(data):
+    """
+        @return     A tuple (package, value). value is None if the message
+                    has no data.
+    """
+    package, _, payload = data.partition(" ")
+    payload = payload.strip()
+    if payload == "":
+        return (package, None)
+    return (package, json.loads(payload))
+
+def encode_gmcp(package, value=None):
+    if value is None:
+        return package
+    return "%s %s" % (package, json.dumps(value))
+
+def decode_msdp(data, encoding=None):
+    """
+        Decode a MSDP message into a dictionary of variables. Tables become
+        dictionaries, arrays lists and values that look like integers ints.
+
+        @param encoding     If given, string values are decoded to unicode.
+    """
+    tokens = []
+    pos = 0
+    for m in _msdp_token.finditer(data):
+        if m.start() > pos:
+            tokens.append(data[pos:m.start()])
+        tokens.append(ord(m.group()))
+        pos = m.end()
+    if pos < len(data):
+        tokens.append(data[pos:])
+    tokens.reverse()
+
+    def value():
+        if tokens and tokens[-1] == MSDP_TABLE_OPEN:
+            tokens.pop()
+            return table(MSDP_TABLE_CLOSE)
+        elif tokens and tokens[-1] == MSDP_ARRAY_OPEN:
+            tokens.pop()
+            ret = []
+            while tokens and tokens[-1] == MSDP_VAL:
+                tokens.pop()
+                ret.append(value())
+            if tokens and tokens[-1] == MSDP_ARRAY_CLOSE:
+                tokens.pop()
+            return ret
+        elif tokens and isinstance(tokens[-1], str):
+            v = tokens.pop()
+            if _integer.match(v):
+                return int(v)
+            if encoding:
+                return v.decode(encoding, "replace")
+            return v
+        return ""
+
+    def table(close):
+        ret = {}
+        while tokens:
+            t = tokens.pop()
+            if t == close:
+                break
+            if t != MSDP_VAR or not tokens or not isinstance(tokens[-1], str):
+                continue
+            name = tokens.pop()
+            vals = []
+            while tokens and tokens[-1] == MSDP_VAL:
+                tokens.pop()
+                vals.append(value())
+            if len(vals) == 1:
+                ret[name] = vals[0]
+            else:
+                ret[name] = vals
+        return ret
+
+    return table(None)
+
+def encode_msdp(name, *values):
+    return chr(MSDP_VAR) + name + "".join([chr(MSDP_VAL) + str(v) for v in values])
+
+class OOB:
+    """
+        Structured out-of-band data from the server, sent via GMCP or MSDP.
+
+        Every update is published under its name, the GMCP package (e.g.
+        "Char.Vitals") or the MSDP variable (e.g. "HEALTH"), to the functions
+        subscribed to that name or to "*". They are called as
+        fun(session, name, value) from the transport's thread, in order with
+        the text: lines the server sent before the message have already been
+        processed. The latest value of every name is kept in values. MSDP
+        strings are decoded with the session's charset, GMCP is UTF-8 JSON.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.subscribers = {}
+        self.values = {}
+        self.messages = 0
+
+    def subscribe(self, name, fun):
+        """
+            @param name     GMCP package or MSDP variable, "*" for everything.
+            @param fun      Function (session, name, value).
+        """
+        self.subscribers.setdefault(name, []).append(fun)
+
+    def unsubscribe(self, name, fun):
+        funs = self.subscribers.get(name, [])
+        if fun in funs:
+            funs.remove(fun)
+            if not funs:
+                del self.subscribers[name]
+
+    def publish(self, name, value):
+        if self.session.recorder:
+            try:
+                self.session.recorder.record(OOB_RECORD, encode_gmcp(name, value))
+            except (TypeError, ValueError), e:
+                # Not representable as JSON. Better lose the record than
+                # the update.
+                pass
+        self.values[name] = value
+        for fun in self.subscribers.get(name, []) + self.subscribers.get("*", []):
+            try:
+                fun(self.session, name, value)
+            except Exception:
+                self.session._report_error(traceback.format_exc())
+
+    def send_gmcp(self, package, value=None):
+        self.session._write_raw(subnegotiation(GMCP, encode_gmcp(package, value)))
+
+    def send_msdp(self, name, *values):
+        self.session._write_raw(subnegotiation(MSDP, encode_msdp(name, *values)))
+
+    def gmcp_enabled(self):
+        mud = self.session.mud
+        self.send_gmcp("Core.Hello", {"client": "mudblood", "version": "1"})
+        self.send_gmcp("Core.Supports.Set", list(getattr(mud, "gmcp_packages", [])))
+
+    def gmcp_received(self, data):
+        self.messages += 1
+        try:
+            package, value = decode_gmcp(data)
+        except ValueError, e:
+            self.session._report_error("Bad GMCP message: %r" % data[:80])
+            return
+        self.publish(package, value)
+
+    def msdp_enabled(self):
+        variables = getattr(self.session.mud, "msdp_variables", [])
+        if variables:
+            self.send_msdp("REPORT", *variables)
+
+    def msdp_received(self, data):
+        self.messages += 1
+        for name, value in decode_msdp(data, self.session.charset.encoding).iteritems():
+            self.publish(name, value)
+
+    def stats(self):
+        return "%d messages, %d names, %d subscriptions" % (
+                self.messages, len(self.values), sum([len(f) for f in self.subscribers.itervalues()]))
@@ -0,0 +1,152 @@
+import time
+import threading
+
+from collections import deque
+
+class CommandQueue:
+    """
+        Paces the commands sent to the server, so that we don't trigger the
+        MUD's flood protection.
+
+        Commands wait in one of several lanes, lower lanes go first. A token
+        bucket allows rate commands per second and bursts of up to burst
+        commands. Everything that may go out at once is handed to the write
+        function as one batch, which the session sends in a single write.
+        URGENT commands ignore the budget (but still use it up), so that
+        e.g. an emergency flee overtakes a queued speedwalk.
+
+        Pumping happens in the thread of the session's event loop.
+    """
+    URGENT  = 0
+    NORMAL  = 1
+    BULK    = 2
+
+    lane_names = ["urgent", "normal", "bulk"]
+
+    def __init__(self, write, loop, rate=0, burst=1, stats=None):
+        """
+            @param write    Function that sends a list of lines.
+            @param rate     Commands per second, 0 for no limit.
+            @param burst    Maximum number of commands sent at once after a pause.
+            @param stats    Optional Stats object for the send latency.
+        """
+        self.write = write
+        self.loop = loop
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.stats = stats
+
+        self.lock = threading.Lock()
+        self.lanes = [deque() for n in self.lane_names]
+        self.tokens = float(self.burst)
+        self.last_refill = time.time()
+        self.timer = None
+        self.pump_pending = False
+
+        self.sent = 0
+        self.writes = 0
+        self.high_water = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def depth(self):
+        return sum([len(q) for q in self.lanes])
+
+    def put(self, lines, lane=NORMAL):
+        """
+            Queue commands. May be called from any thread.
+
+            @param lines    A list of lines, each ending with a newline.
+            @param lane     URGENT, NORMAL or BULK.
+        """
+        now = time.time()
+        with self.lock:
+            q = self.lanes[lane]
+            for l in lines:
+                q.append((l, now))
+            depth = self.depth()
+            if depth > self.high_water:
+                self.high_water = depth
+
+            if self.pump_pending:
+                return
+            self.pump_pending = True
+
+        if self.loop.in_loop():
+            self.pump()
+        else:
+            self.loop.call_soon(self.pump)
+            self.loop.start()
+
+    def clear(self, lane=None):
+        """
+            Throw away queued commands of a lane, or of all lanes.
+
+            @return     The number of commands removed.
+        """
+        with self.lock:
+            n = 0
+            for i in range(len(self.lanes)):
+                if lane is None or lane == i:
+                    n += len(self.lanes[i])
+                    self.lanes[i].clear()
+            return n
+
+    def pump(self):
+        """
+            Send everything the budget allows.
+        """
+        with self.lock:
+            self.pump_pending = False
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+            now = time.time()
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            batch = []
+            urgent = self.lanes[self.URGENT]
+            while urgent:
+                batch.append(urgent.popleft())
+                self.tokens -= 1
+            for q in self.lanes[self.URGENT+1:]:
+                while q and (not self.rate or self.tokens >= 1):
+                    batch.append(q.popleft())
+                    self.tokens -= 1
+
+            if not self.rate:
+                self.tokens = float(self.burst)
+            elif self.depth():
+                self.timer = self.loop.call_later((1 - self.tokens) / self.rate, self.pump)
+
+        if not batch:
+            return
+
+        for l, t in batch:
+            latency = now - t
+            self.latency_total += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            if self.stats and self.stats.enabled:
+                self.stats.add("send latency", latency)
+        self.sent += len(batch)
+        self.writes += 1
+
+        self.write([l for l, t in batch])
+
+    def report(self):
+        """
+            @return     A list of strings.
+        """
+        rate = self.rate and "%g/s, burst %d" % (self.rate, self.burst) or "unlimited"
+        return ["Rate: %s" % rate,
+                "Queued: %s (high water: %d)" % (
+                    ", ".join(["%s %d" % (self.lane_names[i], len(self.lanes[i]))
+                               for i in range(len(self.lanes))]), self.high_water),
+                "Sent: %d commands in %d writes, latency avg %.1fms, max %.1fms" % (
+                    self.sent, self.writes,
+                    self.sent and self.latency_total / self.sent * 1000 or 0.0,
+                    self.latency_max * 1000)]
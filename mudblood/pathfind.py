@@ -0,0 +1,633 @@
+import sys
+
+from collections import deque, OrderedDict
+from heapq import heappush, heappop, heapify
+
+INF = sys.maxint
+
+class Graph:
+    """
+        A snapshot of the walkable exits of a map. Rooms are numbered, and
+        the exits out of and into every room are kept in lists, which makes
+        searching much cheaper than following Edge objects.
+
+        The exits of a room are its own exits that aren't nowalk, and the
+        exits of the rooms it has virtual exits to, as long as no exit
+        before had the same name (see Room.get_exit). Each has the weight
+        of its Edge.
+
+        Rooms that leave the map keep their number, but lose all exits.
+    """
+    def __init__(self, map):
+        self.rooms = []
+        self.index = {}
+        self.out = []
+        self.into = []
+        self.virtual = set()
+        self.weighted = 0
+
+        for r in map.rooms.itervalues():
+            self.add_node(r)
+        for i in xrange(len(self.rooms)):
+            for name, j, w in self.exits(i):
+                self.add_edge(i, name, j, w)
+
+    def node(self, room):
+        """
+            @return     The number of a room, or None if it isn't on the map.
+        """
+        i = self.index.get(room.roomid)
+        if i is None or self.rooms[i] is not room:
+            return None
+        return i
+
+    def add_node(self, room):
+        i = len(self.rooms)
+        self.rooms.append(room)
+        self.index[room.roomid] = i
+        self.out.append([])
+        self.into.append([])
+        return i
+
+    def remove_node(self, i):
+        """
+            @return     The exits that were removed, as (i, name, j, weight)
+                        tuples.
+        """
+        removed = [(i, name, j, w) for name, j, w in self.out[i]]
+        removed.extend([(j, name, i, w) for name, j, w in self.into[i] if j != i])
+        for e in removed:
+            self.remove_edge(*e)
+        r = self.rooms[i]
+        if self.index.get(r.roomid) == i:
+            del self.index[r.roomid]
+        self.virtual.discard(i)
+        return removed
+
+    def add_edge(self, i, name, j, w):
+        self.out[i].append((name, j, w))
+        self.into[j].append((name, i, w))
+        if w != 1:
+            self.weighted += 1
+
+    def remove_edge(self, i, name, j, w):
+        self.out[i].remove((name, j, w))
+        self.into[j].remove((name, i, w))
+        if w != 1:
+            self.weighted -= 1
+
+    def exits(self, i):
+        """
+            @return     The current exits of room i, as (name, j, weight)
+                        tuples.
+        """
+        r = self.rooms[i]
+        index, rooms = self.index, self.rooms
+        ret = []
+        for name,e in r.exits.iteritems():
+            if e.nowalk:
+                continue
+            to = e.b if e.a is r else e.a
+            j = index.get(to.roomid)
+            if j is not None and rooms[j] is to:
+                ret.append((name, j, e.weight))
+
+        if r.virtual_exits:
+            self.virtual.add(i)
+            seen = set(r.exits)
+            for v in r.virtual_exits:
+                for name,e in v.exits.iteritems():
+                    if name in seen:
+                        continue
+                    seen.add(name)
+                    to = e.b if e.a is v else e.a
+                    j = index.get(to.roomid)
+                    if j is not None and rooms[j] is to:
+                        ret.append((name, j, e.weight))
+        else:
+            self.virtual.discard(i)
+        return ret
+
+class DistanceTable:
+    """
+        Distances from one room to all others (or from all others to one
+        room, if succ are the exits into rooms), kept up to date while
+        exits come and go.
+    """
+    def __init__(self, root, succ, pred, unit=False):
+        """
+            @param succ     For every room, the (name, room, weight) tuples
+                            reached in one step.
+            @param pred     The same in the other direction.
+            @param unit     True if all weights are 1, which allows a plain
+                            breadth-first search.
+        """
+        self.root = root
+        self.succ = succ
+        self.pred = pred
+
+        self.dist = dist = [INF] * len(succ)
+        dist[root] = 0
+        if not unit:
+            self._propagate([(0, root)])
+            return
+
+        front = [root]
+        d = 0
+        while front:
+            d += 1
+            nxt = []
+            for i in front:
+                for name, j, w in succ[i]:
+                    if dist[j] == INF:
+                        dist[j] = d
+                        nxt.append(j)
+            front = nxt
+
+    def _propagate(self, heap):
+        dist, succ = self.dist, self.succ
+        while heap:
+            d, x = heappop(heap)
+            if d > dist[x]:
+                continue
+            for name, y, w in succ[x]:
+                if d + w < dist[y]:
+                    dist[y] = d + w
+                    heappush(heap, (d + w, y))
+
+    def grow(self, n):
+        if len(self.dist) < n:
+            self.dist.extend([INF] * (n - len(self.dist)))
+
+    def added(self, i, j, w):
+        """
+            A step from i to j was added. Distances can only shrink.
+        """
+        dist = self.dist
+        if dist[i] == INF or dist[i] + w >= dist[j]:
+            return
+        dist[j] = dist[i] + w
+        self._propagate([(dist[j], j)])
+
+    def removed(self, steps):
+        """
+            Steps were removed, as (i, j, weight) tuples. They must all be
+            handled at once. Only the rooms whose every shortest way led
+            through one of them are computed again.
+        """
+        dist, succ, pred = self.dist, self.succ, self.pred
+        heap = [(dist[j], j) for i, j, w in steps
+                if dist[i] != INF and dist[j] == dist[i] + w and j != self.root]
+        if not heap:
+            return
+        heapify(heap)
+
+        # Find the rooms that lost all their shortest ways, nearest first
+        affected = set()
+        while heap:
+            d, x = heappop(heap)
+            if x in affected:
+                continue
+            supported = False
+            for name, p, w in pred[x]:
+                if dist[p] + w == d and p not in affected:
+                    supported = True
+                    break
+            if supported:
+                continue
+            affected.add(x)
+            for name, y, w in succ[x]:
+                if dist[y] == d + w:
+                    heappush(heap, (d + w, y))
+
+        # Compute their distances again from the rooms around them
+        heap = []
+        for x in affected:
+            best = INF
+            for name, p, w in pred[x]:
+                if p not in affected and dist[p] + w < best:
+                    best = dist[p] + w
+            dist[x] = best
+            if best != INF:
+                heappush(heap, (best, x))
+        self._propagate(heap)
+
+class Landmarks:
+    """
+        Distances from and to a few landmark rooms, spread out over the
+        map. By the triangle inequality they give a lower bound for the
+        distance between any two rooms (ALT).
+    """
+    def __init__(self, graph, count):
+        self.tables = []
+        if not graph.index or not count:
+            return
+
+        # Every landmark is the room farthest from the ones before (the
+        # first one from the room with the most exits).
+        start = max(graph.index.itervalues(), key=lambda i: len(graph.out[i]))
+        unit = not graph.weighted
+        closest = DistanceTable(start, graph.out, graph.into, unit).dist
+        chosen = set()
+        while len(self.tables) < count:
+            best, best_d = None, 0
+            for i in graph.index.itervalues():
+                d = closest[i]
+                if d != INF and d > best_d and i not in chosen:
+                    best, best_d = i, d
+            if best is None:
+                break
+            chosen.add(best)
+            fwd = DistanceTable(best, graph.out, graph.into, unit)
+            bwd = DistanceTable(best, graph.into, graph.out, unit)
+            self.tables.append((fwd, bwd))
+            closest = [min(a, b) for a, b in zip(closest, fwd.dist)]
+
+    def grow(self, n):
+        for fwd, bwd in self.tables:
+            fwd.grow(n)
+            bwd.grow(n)
+
+    def added(self, i, j, w):
+        for fwd, bwd in self.tables:
+            fwd.added(i, j, w)
+            bwd.added(j, i, w)
+
+    def removed(self, steps):
+        for fwd, bwd in self.tables:
+            fwd.removed(steps)
+            bwd.removed([(j, i, w) for i, j, w in steps])
+
+    def bound(self, a, b):
+        """
+            @return     A lower bound for the distance from a to b, INF if
+                        there certainly is no way.
+        """
+        best = 0
+        for fwd, bwd in self.tables:
+            fa, fb = fwd.dist[a], fwd.dist[b]
+            if fa != INF:
+                if fb == INF:
+                    return INF
+                if fb - fa > best:
+                    best = fb - fa
+            ba, bb = bwd.dist[a], bwd.dist[b]
+            if bb != INF:
+                if ba == INF:
+                    return INF
+                if ba - bb > best:
+                    best = ba - bb
+        return best
+
+class PathFinder:
+    """
+        Shortest paths on a Map. An exit costs as much as the weight of its
+        Edge, usually 1.
+
+        Searches work on a Graph of the map. The map reports rooms whose
+        exits changed (see Map.exits_changed), and only their exits are
+        read again before the next search.
+
+        Found paths are cached. A cached path stays valid until one of its
+        exits goes away, or until a new exit could make a cheaper path,
+        which the landmark distances rule out in most cases. The landmark
+        tables are repaired as exits come and go. They also tell right away
+        that a room can't be reached.
+
+        As long as all exits weigh 1, searches run from both ends at once, a
+        level of the smaller side at a time, and stop with the level in
+        which the two meet. (A* with the landmark distances looks at fewer
+        rooms, but is slower in Python.) With weights, searches are A* with
+        the landmark distances, or Dijkstra's without landmarks. Looking for
+        the nearest of several rooms is always Dijkstra's.
+
+        All search state is kept in local dictionaries, rooms are not
+        touched. The map's lock keeps searches and changes apart.
+    """
+    MAX_ROUTES = 1000
+
+    def __init__(self, map, landmarks=4):
+        """
+            @param landmarks    Number of landmarks, 0 for none.
+        """
+        self.map = map
+        self.landmark_count = landmarks
+
+        self.cached = None
+        self.landmarks = None
+        self.pending = set()
+        self.routes = OrderedDict()
+        self.route_index = {}
+
+        self.searches = 0
+        self.visited = 0
+        self.hits = 0
+        self.rebuilds = 0
+        self.repairs = 0
+
+    def changed(self, room):
+        """
+            Called by the map when the exits of a room changed, or the room
+            was added or removed.
+        """
+        if self.cached is not None:
+            self.pending.add(room)
+
+    def graph(self):
+        """
+            @return     A Graph that is up to date.
+        """
+        g = self.cached
+        if g is None or len(self.pending) > max(100, len(g.rooms) / 10):
+            g = self.cached = Graph(self.map)
+            self.pending.clear()
+            self.landmarks = None
+            self.routes.clear()
+            self.route_index.clear()
+            self.rebuilds += 1
+        elif self.pending:
+            self._update(g)
+        return g
+
+    def _update(self, g):
+        pending, self.pending = self.pending, set()
+        self.repairs += 1
+
+        # New rooms first, so that exits can lead to them
+        nodes = set()
+        removed = []
+        for r in pending:
+            i = g.node(r)
+            if self.map.rooms.get(r.roomid) is r:
+                if i is None:
+                    i = g.add_node(r)
+                nodes.add(i)
+            elif i is not None:
+                removed.extend(g.remove_node(i))
+        nodes |= g.virtual
+
+        added = []
+        for i in nodes:
+            old = set(g.out[i])
+            new = set(g.exits(i))
+            for name, j, w in old - new:
+                g.remove_edge(i, name, j, w)
+                removed.append((i, name, j, w))
+            for name, j, w in new - old:
+                g.add_edge(i, name, j, w)
+                added.append((i, name, j, w))
+
+        lm = self.landmarks
+        if lm:
+            lm.grow(len(g.rooms))
+            lm.removed([(i, j, w) for i, name, j, w in removed])
+            for i, name, j, w in added:
+                lm.added(i, j, w)
+
+        for i, name, j, w in removed:
+            for key in list(self.route_index.get((i, name), ())):
+                self._drop_route(key)
+
+        if added and self.routes:
+            if not lm or not lm.tables:
+                self.routes.clear()
+                self.route_index.clear()
+                return
+            bound = lm.bound
+            for key, (path, steps, cost) in self.routes.items():
+                s, t = key
+                for i, name, j, w in added:
+                    if bound(s, i) + w + bound(j, t) < cost:
+                        self._drop_route(key)
+                        break
+
+    def _drop_route(self, key):
+        path, steps, cost = self.routes.pop(key)
+        for st in steps:
+            keys = self.route_index.get(st)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.route_index[st]
+
+    def _add_route(self, key, steps, cost):
+        if key in self.routes:
+            self._drop_route(key)
+        path = [name for i, name in steps]
+        self.routes[key] = (path, steps, cost)
+        for st in steps:
+            self.route_index.setdefault(st, set()).add(key)
+        if len(self.routes) > self.MAX_ROUTES:
+            self._drop_route(next(iter(self.routes)))
+
+    def find(self, source, target):
+        """
+            @return     A list of exit names leading from source to target,
+                        [] if they are the same room and None if there is no
+                        way.
+        """
+        if source is target:
+            return []
+
+        g = self.graph()
+        s, t = g.node(source), g.node(target)
+        if s is None or t is None:
+            return None
+
+        route = self.routes.pop((s, t), None)
+        if route is not None:
+            self.routes[(s, t)] = route
+            self.hits += 1
+            return list(route[0])
+
+        if self.landmarks is None and self.landmark_count:
+            self.landmarks = Landmarks(g, self.landmark_count)
+        if self.landmarks and self.landmarks.bound(s, t) == INF:
+            return None
+
+        if g.weighted and self.landmarks and self.landmarks.tables:
+            found = self._astar(g, s, t)
+        elif g.weighted:
+            found = self._dijkstra(g, s, set([t]))
+        else:
+            found = self._bidirectional(g, s, t)
+        if found is None:
+            return None
+
+        t, steps, cost = found
+        self._add_route((s, t), steps, cost)
+        return [name for i, name in steps]
+
+    def nearest(self, source, targets):
+        """
+            Find the nearest of several rooms with a single search.
+
+            @param targets  A sequence of rooms.
+            @return         A tuple (room, list of exit names) or None if
+                            none of them can be reached.
+        """
+        g = self.graph()
+        s = g.node(source)
+        if s is None:
+            return None
+
+        nodes = set()
+        for r in targets:
+            if r is source:
+                return (source, [])
+            i = g.node(r)
+            if i is not None:
+                nodes.add(i)
+        if not nodes:
+            return None
+
+        found = self._dijkstra(g, s, nodes)
+        if found is None:
+            return None
+
+        t, steps, cost = found
+        self._add_route((s, t), steps, cost)
+        return (g.rooms[t], [name for i, name in steps])
+
+    def _astar(self, g, s, t):
+        out = g.out
+        bound = self.landmarks.bound
+        dist = {s: 0}
+        pred = {s: None}
+        heap = [(bound(s, t), 0, s)]
+        visited = 0
+        while heap:
+            f, d, i = heappop(heap)
+            if d > dist[i]:
+                continue
+            visited += 1
+            if i == t:
+                break
+            for name, j, w in out[i]:
+                if d + w < dist.get(j, INF):
+                    h = bound(j, t)
+                    if h == INF:
+                        continue
+                    dist[j] = d + w
+                    pred[j] = (i, name)
+                    heappush(heap, (d + w + h, d + w, j))
+
+        self.searches += 1
+        self.visited += visited
+        if t not in dist:
+            return None
+
+        steps = deque()
+        i = t
+        while pred[i] is not None:
+            i, name = pred[i]
+            steps.appendleft((i, name))
+        return (t, list(steps), dist[t])
+
+    def _dijkstra(self, g, s, targets):
+        out = g.out
+        dist = {s: 0}
+        pred = {s: None}
+        heap = [(0, s)]
+        visited = 0
+        found = None
+        while heap:
+            d, i = heappop(heap)
+            if d > dist[i]:
+                continue
+            visited += 1
+            if i in targets:
+                found = i
+                break
+            for name, j, w in out[i]:
+                if d + w < dist.get(j, INF):
+                    dist[j] = d + w
+                    pred[j] = (i, name)
+                    heappush(heap, (d + w, j))
+
+        self.searches += 1
+        self.visited += visited
+        if found is None:
+            return None
+
+        steps = deque()
+        i = found
+        while pred[i] is not None:
+            i, name = pred[i]
+            steps.appendleft((i, name))
+        return (found, list(steps), dist[found])
+
+    def _bidirectional(self, g, s, t):
+        out, into = g.out, g.into
+
+        # pred[i] = (room before i, exit name, steps from source),
+        # succ[i] = (room after i, exit name, steps to target)
+        pred = {s: (None, None, 0)}
+        succ = {t: (None, None, 0)}
+        front = [s]
+        back = [t]
+        front_depth = back_depth = 0
+        visited = 2
+
+        # The first meeting isn't necessarily the best one, but the best one
+        # is found in the same level.
+        best = None
+        best_length = None
+        while front and back and best is None:
+            nxt = []
+            if len(front) <= len(back):
+                front_depth += 1
+                for i in front:
+                    for name, j, w in out[i]:
+                        if j in pred:
+                            continue
+                        pred[j] = (i, name, front_depth)
+                        nxt.append(j)
+                        if j in succ and (best is None or front_depth + succ[j][2] < best_length):
+                            best, best_length = j, front_depth + succ[j][2]
+                front = nxt
+            else:
+                back_depth += 1
+                for j in back:
+                    for name, i, w in into[j]:
+                        if i in succ:
+                            continue
+                        succ[i] = (j, name, back_depth)
+                        nxt.append(i)
+                        if i in pred and (best is None or back_depth + pred[i][2] < best_length):
+                            best, best_length = i, back_depth + pred[i][2]
+                back = nxt
+            visited += len(nxt)
+
+        self.searches += 1
+        self.visited += visited
+
+        if best is None:
+            return None
+
+        steps = deque()
+        i = best
+        while i != s:
+            i, name, _ = pred[i]
+            steps.appendleft((i, name))
+        i = best
+        while i != t:
+            j, name, _ = succ[i]
+            steps.append((i, name))
+            i = j
+        return (t, list(steps), best_length)
+
+    def report(self):
+        """
+            @return     A list of strings.
+        """
+        g = self.cached
+        lm = self.landmarks
+        return ["Graph: %s, %d rebuilds, %d repairs" % (
+                    g and "%d rooms" % len(g.index) or "not built",
+                    self.rebuilds, self.repairs),
+                "Weighted exits: %d" % (g and g.weighted or 0),
+                "Landmarks: %d" % (lm and len(lm.tables) or 0),
+                "Routes cached: %d, %d hits" % (len(self.routes), self.hits),
+                "Searches: %d, %.1f rooms visited on average" % (
+                    self.searches, self.searches and float(self.visited) / self.searches or 0.0)]
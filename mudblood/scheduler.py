@@ -0,0 +1,124 @@
+import time
+import threading
+import traceback
+
+class ScheduledCall:
+    """
+        Handle for a delayed or periodic action. See Scheduler.
+    """
+    def __init__(self, scheduler, delay, interval, action, group):
+        self.scheduler = scheduler
+        self.due = time.time() + delay
+        self.interval = interval
+        self.action = action
+        self.group = group
+        self.timer = None
+        self.cancelled = False
+
+    def __repr__(self):
+        if self.interval:
+            every = ", every %gs" % self.interval
+        else:
+            every = ""
+        return "[%s] in %.1fs%s: %s" % (self.group, max(0, self.due - time.time()), every,
+                                         getattr(self.action, "__name__", self.action))
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+class Scheduler:
+    """
+        Delayed and periodic actions for a session. All timers live in the
+        heap of the session's event loop and fire in the loop thread.
+
+        An action is either a string, which is sent to the MUD, or a function
+        that is called with the session as its argument. Every timer belongs
+        to a group (default: "default"), which can be cancelled as a whole.
+    """
+    def __init__(self, session, loop):
+        self.session = session
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def after(self, delay, action, group="default"):
+        """
+            Run action once, after delay seconds.
+
+            @return     A ScheduledCall.
+        """
+        return self._add(ScheduledCall(self, delay, 0, action, group))
+
+    def every(self, interval, action, group="default"):
+        """
+            Run action every interval seconds, starting in interval seconds.
+
+            @return     A ScheduledCall.
+        """
+        if interval <= 0:
+            raise ValueError("Interval must be positive")
+        return self._add(ScheduledCall(self, interval, interval, action, group))
+
+    def _add(self, call):
+        with self.lock:
+            self.groups.setdefault(call.group, set()).add(call)
+            call.timer = self.loop.call_later(call.due - time.time(), self._fire, call)
+        self.loop.start()
+        return call
+
+    def cancel(self, call):
+        with self.lock:
+            call.cancelled = True
+            if call.timer:
+                call.timer.cancel()
+            calls = self.groups.get(call.group)
+            if calls is not None:
+                calls.discard(call)
+                if not calls:
+                    del self.groups[call.group]
+
+    def cancel_group(self, group):
+        """
+            @return     The number of cancelled timers.
+        """
+        with self.lock:
+            calls = self.groups.pop(group, set())
+        for c in calls:
+            self.cancel(c)
+        return len(calls)
+
+    def cancel_all(self):
+        n = 0
+        for g in self.groups.keys():
+            n += self.cancel_group(g)
+        return n
+
+    def pending(self):
+        """
+            @return     A list of all active ScheduledCalls, the next one first.
+        """
+        with self.lock:
+            calls = [c for g in self.groups.itervalues() for c in g]
+        return sorted(calls, key=lambda c: c.due)
+
+    def _fire(self, call):
+        if call.cancelled:
+            return
+
+        if call.interval:
+            # Schedule from the planned time, so that the period doesn't drift.
+            with self.lock:
+                if call.cancelled:
+                    return
+                call.due = max(call.due + call.interval, time.time())
+                call.timer = self.loop.call_later(call.due - time.time(), self._fire, call)
+        else:
+            self.cancel(call)
+
+        try:
+            if isinstance(call.action, basestring):
+                self.session.stdin.writeln(call.action)
+            else:
+                call.action(self.session)
+        except Exception:
+            self.session._report_error(traceback.format_exc())
@@ -1,13 +1,26 @@
 # $Id$
 
+import re
+import time
 import threading
-import telnetlib
 import socket
 import traceback
 
-from collections import deque
+from collections import deque, OrderedDict
 
 from commands import CommandObject
+from transport import create_transport
+from framer import LineFramer
+from telnet import TelnetProtocol, GMCP, MSDP, CHARSET, escape
+from charset import Charset
+from oob import OOB
+from workers import WorkerPool
+from scheduler import Scheduler
+from outqueue import CommandQueue
+from walker import Walker
+from eventloop import default_loop
+from sessionlog import LogRecorder, INPUT, OUTPUT, PROMPT
+from stats import Stats
 
 from map import Mapper, MapNotification
 
@@ -25,13 +38,44 @@ def load_mud_definition(path):
 class IOStream:
     """
         Asynchronous IO class.
+
+        Data is kept as a queue of chunks. If a limit is set, the stream
+        never holds (much) more than that many bytes. What happens when a
+        write would exceed the limit depends on the policy:
+
+            block       The writer waits until the data has been read.
+            drop        The oldest data is thrown away.
+            summarize   Like drop, but the reader gets a note about how much
+                        data was lost.
     """
-    def __init__(self):
+    BLOCK       = "block"
+    DROP        = "drop"
+    SUMMARIZE   = "summarize"
+
+    def __init__(self, limit=0, policy=BLOCK):
+        """
+            @param limit    Maximum number of queued bytes. 0 means no limit.
+            @param policy   One of BLOCK, DROP or SUMMARIZE.
+        """
+        if policy not in [self.BLOCK, self.DROP, self.SUMMARIZE]:
+            raise ValueError("Unknown stream policy: %s" % policy)
+
         self.lock = threading.Condition()
-        self.out = ""
+        self.chunks = deque()
+        self.limit = limit
+        self.policy = policy
+        self.listener = None
+        self.reader = None
+
+        # Statistics
+        self.queued = 0
+        self.high_water = 0
+        self.written = 0
+        self.dropped = 0
+        self.unreported = 0
 
     def has_data(self):
-        return self.out != ""
+        return self.queued > 0 or self.unreported > 0
 
     def read(self, blocking=False):
         """
@@ -40,14 +84,31 @@ class IOStream:
             @param blocking     If True, the method blocks when no data is available.
             @return             A string of new data.
         """
-        self.lock.acquire();
-        if self.out == "" and blocking:
+        self.lock.acquire()
+        self.reader = threading.current_thread()
+        while blocking and not self.chunks and not self.unreported:
             self.lock.wait()
-        ret = self.out;
-        self.out = ""
-        self.lock.release();
 
-        return ret;
+        if len(self.chunks) == 1:
+            ret = self.chunks[0]
+        else:
+            try:
+                ret = "".join(self.chunks)
+            except UnicodeDecodeError:
+                # Decoded text mixed with byte strings that aren't ASCII
+                ret = u"".join([isinstance(c, str) and c.decode("latin-1") or c
+                                for c in self.chunks])
+        self.chunks.clear()
+        self.queued = 0
+
+        if self.unreported:
+            ret = "[... %d bytes dropped ...]\n" % self.unreported + ret
+            self.unreported = 0
+
+        self.lock.notify_all()
+        self.lock.release()
+
+        return ret
 
     def write(self, data):
         """
@@ -55,14 +116,47 @@ class IOStream:
 
             @param data     A string of data
         """
+        if not data:
+            return
+
         self.lock.acquire()
-        self.out += data
-        self.lock.notify();
+        if self.limit and self.queued + len(data) > self.limit:
+            if self.policy == self.BLOCK:
+                # Never wait for ourselves: The thread that drains the stream
+                # may also write to it (e.g. a trigger writing to stdin).
+                while (self.chunks and self.queued + len(data) > self.limit
+                       and self.reader is not threading.current_thread()):
+                    self.lock.wait()
+            else:
+                while self.chunks and self.queued + len(data) > self.limit:
+                    n = len(self.chunks.popleft())
+                    self.queued -= n
+                    self.dropped += n
+                    if self.policy == self.SUMMARIZE:
+                        self.unreported += n
+
+        self.chunks.append(data)
+        self.queued += len(data)
+        self.written += len(data)
+        if self.queued > self.high_water:
+            self.high_water = self.queued
+        self.lock.notify_all()
         self.lock.release()
 
+        if self.listener:
+            self.listener()
+
     def writeln(self, data):
         self.write(data + "\n")
 
+    def stats(self):
+        """
+            @return     A string describing the state of the stream.
+        """
+        return "queued: %d, high water: %d, written: %d, dropped: %d, limit: %s (%s)" % (
+                self.queued, self.high_water, self.written, self.dropped,
+                self.limit or "none", self.policy)
+
 class Event:
     """
         Enum with all events that trigger the callback.
@@ -74,50 +168,199 @@ class Event:
     CLOSED      = 5
     STATUS      = 6
     MAP         = 7
+    PROMPT      = 8
+
+    @classmethod
+    def name(cls, typ):
+        for k, v in cls.__dict__.iteritems():
+            if v == typ and k.isupper():
+                return k
+        return str(typ)
 
 class Hook:
+    # A hook is pure if its result depends on nothing but the line and it
+    # has no side effects. The results of pure hooks may be cached.
+    pure = False
+
+    # Hooks that can be reconfigured (e.g. a list of rules) increment this
+    # whenever their behaviour changes.
+    version = 0
+
     def __init__(self):
         pass
 
     def process(self, session, line):
         return line
 
+class HookCache:
+    """
+        LRU cache for the input hook chain. Consecutive pure hooks are
+        grouped into segments, and the result of every segment is cached by
+        line. Impure hooks always run.
+
+        The cache is flushed whenever the chain changes, i.e. hooks are
+        added, removed, reconfigured or the definition is reloaded.
+    """
+    _miss = object()
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.signature = None
+        self.segments = []
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    def flush(self):
+        self.entries.clear()
+        self.signature = None
+        self.flushes += 1
+
+    def _changed(self, hooks):
+        signature = self.signature
+        if signature is None or len(signature) != len(hooks):
+            return True
+        for (h, version), hook in zip(signature, hooks):
+            if h is not hook or version != hook.version:
+                return True
+        return False
+
+    def _plan(self, hooks):
+        self.segments = []
+        for h in hooks:
+            if h.pure and self.segments and self.segments[-1][0]:
+                self.segments[-1][1].append(h)
+            else:
+                self.segments.append((h.pure, [h]))
+
+    def run(self, session, hooks, line, size):
+        """
+            Run line through hooks.
+
+            @param size     Maximum number of cached lines.
+            @return         The processed line, or None if it was suppressed.
+        """
+        if self._changed(hooks):
+            self.flush()
+            # The hooks themselves, not their ids: an id can be reused by a
+            # new hook once the old one is gone.
+            self.signature = [(h, h.version) for h in hooks]
+            self._plan(hooks)
+
+        entries = self.entries
+        for k in range(len(self.segments)):
+            pure, seg = self.segments[k]
+            if not pure:
+                for h in seg:
+                    line = h.process(session, line)
+                    if not line:
+                        return None
+                continue
+
+            key = (k, line)
+            ret = entries.pop(key, self._miss)
+            if ret is self._miss:
+                self.misses += 1
+                ret = line
+                for h in seg:
+                    ret = h.process(session, ret)
+                    if not ret:
+                        ret = None
+                        break
+                if len(entries) >= size:
+                    entries.popitem(False)
+            else:
+                self.hits += 1
+            entries[key] = ret
+
+            if ret is None:
+                return None
+            line = ret
+
+        return line
+
+    def stats(self):
+        total = self.hits + self.misses
+        return "%d entries, %d hits, %d misses (%.1f%% hit ratio), %d flushes" % (
+                len(self.entries), self.hits, self.misses,
+                total and 100.0 * self.hits / total or 0, self.flushes)
+
 class Session(CommandObject):
     """
         A single game session. Asynchronous I/O is handled via a callback.
     """
     NEWLINE = "\n";
 
-    def __init__(self, mud, callback=None):
+    # How long (in seconds) an incomplete line is held back, waiting for the
+    # rest of it, before it is passed on as a prompt. mud.prompt_timeout
+    # overrides it.
+    PARTIAL_TIMEOUT = 0.1
+
+    def __init__(self, mud, callback=None, transport=None):
         """
             Create a session.
 
-            @param mud      The mud definition object.
-            @param callback Callback for Async I/O
+            @param mud          The mud definition object.
+            @param callback     Callback for Async I/O
+            @param transport    "thread" or "loop". Defaults to mud.transport.
         """
-        self.input_thread = threading.Thread(None, self._input_run)
-        self.output_thread = threading.Thread(None, self._output_run)
-        self.input_thread.daemon = True
-        self.output_thread.daemon = True
         self.mud = mud
-        self.out = { 0: IOStream() }
+        self.out = { 0: self._new_stream() }
         self.stderr = self.out[0]
-        self.stdin = IOStream()
-        self.info = IOStream()
+        self.stdin = IOStream(getattr(mud, "stream_limit", 0), IOStream.BLOCK)
+        self.info = self._new_stream()
 
         self.user_status = ""
 
+        self.stats = Stats()
+
         self.mapper = Mapper(mud)
+        self.mapper.stats = self.stats
 
         self.completer = Completer()
 
+        self.telnet = TelnetProtocol(self._write_raw, getattr(mud, "mccp", True))
+        self.oob = OOB(self)
+        if getattr(mud, "gmcp", True):
+            self.telnet.register(GMCP, self.oob.gmcp_enabled, self.oob.gmcp_received)
+        if getattr(mud, "msdp", True):
+            self.telnet.register(MSDP, self.oob.msdp_enabled, self.oob.msdp_received)
+        self.recorder = None
+
+        self.charset = Charset(self, getattr(mud, "encoding", "latin-1"), getattr(mud, "charsets", []))
+        if self.charset.preferred:
+            self.telnet.register(CHARSET, self.charset.enabled, self.charset.received, True)
+
+        self.framer = LineFramer(self.charset.decode)
+        self.prompt_timeout = getattr(mud, "prompt_timeout", self.PARTIAL_TIMEOUT)
+        pattern = getattr(mud, "prompt_pattern", None)
+        if pattern is None:
+            pattern = re.escape(getattr(mud, "strings", {}).get("prompt", "").lstrip("\n"))
+        self.prompt_re = pattern and re.compile("(?:%s)\\Z" % pattern) or None
+        self.command_sent = None
+        self.at_prompt = False
+        self.hook_cache = HookCache()
+
+        self.workers = WorkerPool(getattr(mud, "worker_threads", 4), self._report_error)
+
         self.connected = False
         self.mode = 0
         self.callback = callback
 
+        if transport is None:
+            transport = getattr(mud, "transport", "thread")
+        self.transport = create_transport(transport, self)
+
+        self.scheduler = Scheduler(self, getattr(self.transport, "loop", None) or default_loop())
+        self.commands = CommandQueue(self._write_lines, self.scheduler.loop,
+                                     getattr(mud, "send_rate", 0), getattr(mud, "send_burst", 1),
+                                     self.stats)
+        self.walker = Walker(self)
+
     def connect(self):
         try:
-            self.telnet = telnetlib.Telnet(self.mud.host, self.mud.port)
+            self.transport.connect(self.mud.host, self.mud.port)
         except Exception, msg:
             self.stderr.writeln("Could not connect: %s." % msg)
             self._do_callback(Event.ERROR)
@@ -126,122 +369,456 @@ class Session(CommandObject):
         
         self.mud.connect(self)
 
+        if getattr(self.mud, "record_file", None):
+            self.start_recording(self.mud.record_file)
+
         self.connected = True
         self._do_callback(Event.CONNECTED)
 
-        self.input_thread.start()
-        self.output_thread.start()
+        self.transport.start()
 
     def close(self):
-        self.telnet.close()
+        self.walker.stop()
+        self.scheduler.cancel_all()
+        self.commands.clear()
+        self.stop_recording()
+        self.transport.close()
         self._do_callback(Event.CLOSED)
 
+    def start_recording(self, path, compress=True):
+        """
+            Record everything received from and sent to the server to a log
+            file that can be replayed with the "replay" transport.
+        """
+        self.stop_recording()
+        self.recorder = LogRecorder(path, compress)
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
+    def after(self, delay, action, group="default"):
+        """
+            Run action once after delay seconds.
+
+            @param action   A string to send to the MUD or a function that
+                            is called with the session.
+            @param group    Name of a timer group, see cancel_timers().
+            @return         A handle with a cancel() method.
+        """
+        return self.scheduler.after(delay, action, group)
+
+    def every(self, interval, action, group="default"):
+        """
+            Run action every interval seconds. See after().
+        """
+        return self.scheduler.every(interval, action, group)
+
+    def cancel_timers(self, group=None):
+        """
+            Cancel all timers of a group, or all timers if group is None.
+
+            @return     The number of cancelled timers.
+        """
+        if group is None:
+            return self.scheduler.cancel_all()
+        return self.scheduler.cancel_group(group)
+
     def _do_callback(self, typ, arg=None):
         if self.callback:
-            self.callback(self, typ, arg)
+            if self.stats.enabled:
+                start = time.time()
+                self.callback(self, typ, arg)
+                self.stats.add("callback " + Event.name(typ), time.time() - start)
+            else:
+                self.callback(self, typ, arg)
+
+    def _report_error(self, tb):
+        """
+            Report an exception from a worker or timer.
+        """
+        self.stderr.writeln(tb)
+        self._do_callback(Event.ERROR)
+
+    def _report_info(self, text):
+        self.info.writeln(text)
+        self._do_callback(Event.INFO)
+
+    def _closed(self):
+        """
+            Called by the transport when the server closed the connection.
+        """
+        self.connected = False
+        self.walker.stop()
+        self.scheduler.cancel_all()
+        self.commands.clear()
+        self.stop_recording()
+        self._do_callback(Event.CLOSED)
 
-    def _input_run(self):
+    def _receive_raw(self, data):
         """
-            Thread function that reads data from the server.
+            Called by the transport with data read from the socket. Telnet
+            commands are handled and compressed data is inflated.
         """
-        while self.connected:
-            data = self.telnet.read_some()
-            if data == "":
-                self.connected = False
-                self._do_callback(Event.CLOSED)
-                break
+        try:
+            data = self.telnet.feed(data)
+        except TelnetProtocol.CompressionError, e:
+            self.stderr.writeln("%s. Closing connection." % e)
+            self._do_callback(Event.ERROR)
+            self.connected = False
+            self.close()
+            return
 
+        for d in data:
+            if d is None:
+                # The prompt may already have been recognized by its pattern.
+                if not self.at_prompt:
+                    if self.recorder:
+                        self.recorder.record(PROMPT, "")
+                    self._prompt()
+            elif isinstance(d, tuple):
+                d[0](d[1])
+            elif d:
+                self._receive(d)
+
+    def _write_raw(self, data):
+        try:
+            self.transport.write(data)
+        except (IOError, socket.error), e:
+            pass
+
+    def _receive(self, data):
+        """
+            Called with a chunk of data from the server, after telnet
+            processing.
+        """
+        self.at_prompt = False
+        if self.recorder:
+            self.recorder.record(INPUT, data)
+
+        if self.stats.enabled:
+            start = time.time()
+            lines = self.framer.feed(data)
+            self.stats.add("framing", time.time() - start)
+        else:
+            lines = self.framer.feed(data)
+
+        for l in lines:
+            self._process_line(l)
+
+        if self.prompt_re and self.framer.pending():
+            p = self.framer.peek()
+            if p is not None and self.prompt_re.match(p):
+                self._prompt()
+                return
+
+        self._do_callback(Event.STDIO, 0)
+
+    def _flush_partial(self):
+        """
+            Called by the transport when an incomplete line has not been
+            continued for prompt_timeout seconds.
+        """
+        if not self.framer.pending():
+            return
+
+        self._prompt(False)
+
+    def _prompt(self, marked=True):
+        """
+            Pass on the incomplete line as a prompt. Called when the server
+            sent GA or EOR, when the line matches the prompt pattern and
+            after the prompt timeout.
+
+            @param marked   False if we only guessed after the timeout.
+        """
+        if self.framer.pending():
+            self._process_line(self.framer.flush())
+        self.at_prompt = True
+
+        if marked and self.walker.active:
+            self.walker.prompt()
+
+        if self.command_sent is not None:
+            self.stats.add("keystroke to prompt", time.time() - self.command_sent)
+            self.command_sent = None
+
+        self._do_callback(Event.PROMPT, 0)
+
+    def _process_line(self, l):
+        if self.stats.enabled:
+            return self._process_line_timed(l)
+
+        if self.walker.active:
+            self.walker.line(l)
+
+        self.completer.parse(l)
+        try:
+            cache_size = getattr(self.mud, "hook_cache", 0)
+            if cache_size:
+                l = self.hook_cache.run(self, self.mud.input_hooks, l, cache_size)
+            else:
+                for h in self.mud.input_hooks:
+                    l = h.process(self, l)
+                    if not l:
+                        break
+        except Exception, e:
+            self.stderr.writeln(traceback.format_exc())
+            self._do_callback(Event.ERROR)
+
+        if l:
+            self.out[0].write(l)
+
+    def _process_line_timed(self, l):
+        """
+            Same as _process_line, but collects statistics.
+        """
+        stats = self.stats
+
+        if self.walker.active:
+            start = time.time()
+            self.walker.line(l)
+            stats.add("walker", time.time() - start)
+
+        start = time.time()
+        self.completer.parse(l)
+        stats.add("completer", time.time() - start)
+
+        try:
+            cache_size = getattr(self.mud, "hook_cache", 0)
+            if cache_size:
+                start = time.time()
+                l = self.hook_cache.run(self, self.mud.input_hooks, l, cache_size)
+                stats.add("input hooks (cached)", time.time() - start)
+            else:
+                hooks = self.mud.input_hooks
+                for i in range(len(hooks)):
+                    start = time.time()
+                    l = hooks[i].process(self, l)
+                    stats.add("input hook %d: %s" % (i, hooks[i].__class__.__name__),
+                              time.time() - start)
+                    if not l:
+                        break
+        except Exception, e:
+            self.stderr.writeln(traceback.format_exc())
+            self._do_callback(Event.ERROR)
+
+        if l:
+            self.out[0].write(l)
+
+    def _send(self, data):
+        """
+            Called by the transport with data read from stdin.
+        """
+        self.send(data)
+
+    def send(self, data, lane=CommandQueue.NORMAL):
+        """
+            Run data through the output hooks and queue it for the server.
+            Everything the hooks make of data is queued as one batch.
+
+            @param data     One or more lines.
+            @param lane     CommandQueue.URGENT, NORMAL or BULK.
+        """
+        lines = []
+        for l in data.splitlines(True):
             try:
-                d = self.telnet.read_very_eager()
-                while d != "":
-                    data += d
-                    d = self.telnet.read_very_eager()
-            
-            except EOFError, e:
-                self.connected = False
-                self._do_callback(Event.CLOSED)
-                break
-            except:
-                break
-
-            data = data.replace("\r\n", self.NEWLINE)
-
-            for c in data:
-                if ord(c) > 127:
-                    self.info.writeln("Special character: %d" % ord(c))
-                    self._do_callback(Event.INFO)
-
-            lines = data.splitlines(True)
-
-            for l in lines:
-                self.completer.parse(l)
-                try:
-                    for h in self.mud.input_hooks:
-                        l = h.process(self, l)
-                        if not l:
-                            break
-                except Exception, e:
-                    self.stderr.writeln(traceback.format_exc())
-                    self._do_callback(Event.ERROR)
-
-                if l:
-                    self.out[0].write(l)
-
-            self._do_callback(Event.STDIO, 0)
-    
-    def _output_run(self):
-        """
-            Thread function that reads input from the input stream.
-        """
-        while self.connected:
-            data = self.stdin.read(True)
-            
-            for l in data.splitlines(True):
-                try:
-                    for h in self.mud.output_hooks:
-                        l = h.process(self, l)
-                        if not l:
-                            break
-                except Exception, e:
-                    self.stderr.writeln(traceback.format_exc())
-                    self._do_callback(Event.ERROR)
-
-                if l:
-                    try:
-                        self.telnet.write(str(l))
-                    except IOError, e:
-                        self.stderr.writeln("Connection closed.")
-                        self._do_callback(Event.ERROR)
-                        self.connected = False
-
-                    # Automapper
-                    ret = self.mapper.handle_input(l.strip())
-                    if ret == MapNotification.NEW_CYCLE:
-                        self.info.writeln("Mapper: Found cycle. 'map nocycle' to disagree")
-                        self._do_callback(Event.INFO)
-
-                    if ret > 0:
-                        self._do_callback(Event.MAP)
+                if self.stats.enabled:
+                    start = time.time()
+                for h in self.mud.output_hooks:
+                    l = h.process(self, l)
+                    if not l:
+                        break
+                if self.stats.enabled:
+                    self.stats.add("output hooks", time.time() - start)
+            except Exception, e:
+                self.stderr.writeln(traceback.format_exc())
+                self._do_callback(Event.ERROR)
+
+            if l:
+                # Aliases may turn one line into several
+                lines.extend(l.splitlines(True))
+
+        if lines:
+            self.commands.put(lines, lane)
+
+    def _write_lines(self, lines):
+        """
+            Called by the command queue with the lines that may be sent now.
+        """
+        if not self.connected:
+            return
+
+        if self.stats.enabled and self.command_sent is None:
+            self.command_sent = time.time()
+        encode = self.charset.encode
+        raw = [encode(l) for l in lines]
+
+        # Before writing: the answer may be read by another thread before
+        # write() returns, and the mapper must have seen the move by then.
+        for l, r in zip(lines, raw):
+            self._sent(l, r)
+
+        try:
+            self.transport.write("".join([escape(r) for r in raw]))
+        except (IOError, socket.error), e:
+            self.stderr.writeln("Connection closed.")
+            self._do_callback(Event.ERROR)
+            self.connected = False
+            self.commands.clear()
+
+    def _sent(self, l, raw):
+        """
+            Called for every line that was sent to the server.
+
+            @param l    The line as text.
+            @param raw  The line as it was encoded for the server.
+        """
+        if self.recorder:
+            self.recorder.record(OUTPUT, raw)
+
+        # Automapper
+        ret = self.mapper.handle_input(l.strip())
+        if ret == MapNotification.NEW_CYCLE:
+            self.info.writeln("Mapper: Found cycle. 'map nocycle' to disagree")
+            self._do_callback(Event.INFO)
+
+        if ret > 0:
+            self._do_callback(Event.MAP)
+
+        if self.walker.active:
+            self.walker.line_sent(l.strip())
+
+    def _new_stream(self):
+        return IOStream(getattr(self.mud, "stream_limit", 0),
+                        getattr(self.mud, "stream_policy", IOStream.BLOCK))
 
     def write_to_stream(self, stream, data):
         if not stream in self.out:
-            self.out[stream] = IOStream()
+            self.out[stream] = self._new_stream()
         self.out[stream].write(data)
         self._do_callback(Event.STDIO)
 
-    def cmd_walk(self, tag):
-        room = self.mapper.find_room(tag)
-        if not room:
-            return "Target not found."
-
-        path = self.mapper.find_shortest_path(room)
-
-        if path:
-            self.stdin.writeln("\n".join(path))
-            self.info.writeln("Path is: " + str(path))
-            self._do_callback(Event.INFO)
+    def cmd_streams(self):
+        ret = ["stdin: " + self.stdin.stats(),
+               "info: " + self.info.stats()]
+        for k in sorted(self.out.keys()):
+            ret.append("out %s: %s" % (k, self.out[k].stats()))
+        return "\n".join(ret)
+
+    def cmd_telnet(self):
+        return self.telnet.stats()
+
+    def cmd_oob(self, name=None):
+        if name is None:
+            return "%s\n%s" % (self.oob.stats(),
+                                "\n".join(["%s: %r" % (k, v) for k, v in sorted(self.oob.values.iteritems())]))
+        return "%s: %r" % (name, self.oob.values.get(name))
+
+    def cmd_record(self, path=None, compress="zlib"):
+        if path is None:
+            if not self.recorder:
+                return "Not recording."
+            return "Recording: %d records, %d bytes." % (self.recorder.records, self.recorder.bytes)
+        try:
+            self.start_recording(path, compress != "raw")
+        except IOError, e:
+            return "Could not open log: %s" % e
+        return "Recording to %s." % path
+
+    def cmd_stoprecord(self):
+        if not self.recorder:
+            return "Not recording."
+        self.stop_recording()
+        return "Ok."
+
+    def cmd_stats(self, *args):
+        """stats [on|off|reset|json [<file>]]
+
+           Show or control timing statistics."""
+
+        if not args:
+            if not self.stats.entries:
+                return "No statistics%s." % (not self.stats.enabled and " (use 'stats on')" or "")
+            return "\n".join(self.stats.report())
+        elif args[0] == "on":
+            self.stats.enabled = True
+            return "Statistics enabled."
+        elif args[0] == "off":
+            self.stats.enabled = False
+            return "Statistics disabled."
+        elif args[0] == "reset":
+            self.stats.reset()
+            return "Statistics reset."
+        elif args[0] == "json":
+            if len(args) < 2:
+                return self.stats.to_json()
+            try:
+                with open(args[1], "w") as f:
+                    f.write(self.stats.to_json())
+            except IOError, e:
+                return "Could not write statistics: %s" % e
+            return "Statistics written to %s." % args[1]
         else:
-            return "No path found."
+            return "Usage: stats [on|off|reset|json [<file>]]"
+
+    def cmd_hookcache(self, *args):
+        if args and args[0] == "flush":
+            self.hook_cache.flush()
+            return "Hook cache flushed."
+        if not getattr(self.mud, "hook_cache", 0):
+            return "Hook cache is disabled."
+        return self.hook_cache.stats()
+
+    def cmd_workers(self):
+        return self.workers.stats()
+
+    def cmd_after(self, delay, *args):
+        self.after(float(delay), " ".join(args), "user")
+        return "Ok."
+
+    def cmd_every(self, interval, *args):
+        self.every(float(interval), " ".join(args), "user")
+        return "Ok."
+
+    def cmd_timers(self):
+        calls = self.scheduler.pending()
+        if not calls:
+            return "No timers."
+        return "\n".join([repr(c) for c in calls])
+
+    def cmd_untimer(self, group="user"):
+        return "Cancelled %d timers." % self.cancel_timers(group)
+
+    def cmd_sendqueue(self, *args):
+        if args and args[0] == "clear":
+            lane = None
+            if len(args) > 1:
+                if args[1] not in CommandQueue.lane_names:
+                    return "Lanes are: %s" % ", ".join(CommandQueue.lane_names)
+                lane = CommandQueue.lane_names.index(args[1])
+            return "Removed %d commands." % self.commands.clear(lane)
+        return "\n".join(self.commands.report())
+
+    def cmd_walk(self, *args):
+        target = " ".join(args)
+        if not target:
+            return "Walk where?"
+        room = self.mapper.find_room(target)
+        if not room:
+            # Nearest room whose tag matches, e.g. "walk shop*"
+            found = self.mapper.find_nearest(target)
+            if not found:
+                return "Target not found."
+            room = found[0]
+        return self.walker.start(room)
+
+    def cmd_stopwalk(self):
+        if not self.walker.active:
+            return "Not walking."
+        self.walker.stop("Stopped.")
+        return True
 
 class Completer:
     nouns = set()
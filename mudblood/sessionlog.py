@@ -0,0 +1,128 @@
+import os
+import time
+import mmap
+import zlib
+import struct
+import threading
+
+MAGIC = "#mudblood log 1 "
+
+# Record kinds
+INPUT   = "i"   # Data received from the server
+OUTPUT  = "o"   # A line sent to the server
+PROMPT  = "p"   # The server marked the end of a prompt (GA/EOR)
+CHARSET = "c"   # The session switched to another encoding
+OOB     = "g"   # A GMCP or MSDP update, as "name json-value"
+
+_header = struct.Struct("<dcI")
+
+class LogRecorder:
+    """
+        Writes a session log: every record holds the time since the start of
+        the recording, its kind (INPUT, OUTPUT, PROMPT, CHARSET or OOB) and the data.
+        The data is always bytes: lines sent are recorded as they were encoded
+        for the server.
+    """
+    # When compressing, flush the compressor at most this often (seconds), so
+    # that an interrupted log is still readable up to that point.
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path, compress=True):
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + (compress and "zlib" or "raw") + "\n")
+        self.compressor = compress and zlib.compressobj(6) or None
+        self.start = time.time()
+        self.last_flush = self.start
+
+        self.records = 0
+        self.bytes = 0
+
+    def record(self, kind, data):
+        now = time.time()
+        rec = _header.pack(now - self.start, kind, len(data)) + data
+
+        with self.lock:
+            if self.file is None:
+                return
+            if self.compressor:
+                self.file.write(self.compressor.compress(rec))
+                if now - self.last_flush > self.FLUSH_INTERVAL:
+                    self.file.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+                    self.last_flush = now
+            else:
+                self.file.write(rec)
+            self.records += 1
+            self.bytes += len(data)
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            if self.compressor:
+                self.file.write(self.compressor.flush())
+            self.file.close()
+            self.file = None
+
+class LogReader:
+    """
+        Iterates over the records of a session log as (time, kind, data)
+        tuples. The file is memory mapped.
+    """
+    # Bytes of compressed data to decompress at once
+    WINDOW = 1 << 20
+
+    class BadLogException(Exception):
+        pass
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise self.BadLogException("Empty log: %s" % self.path)
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                end = m.find("\n")
+                header = m[:end]
+                if not header.startswith(MAGIC):
+                    raise self.BadLogException("Not a mudblood log: %s" % self.path)
+
+                if header[len(MAGIC):] == "zlib":
+                    for r in self._iter_compressed(m, end + 1):
+                        yield r
+                else:
+                    for r in self._iter_records(m, end + 1, len(m)):
+                        yield r
+            finally:
+                m.close()
+
+    def _iter_records(self, buf, pos, end):
+        """
+            Parse records from buf[pos:end]. Stops at an incomplete record.
+        """
+        hsize = _header.size
+        while pos + hsize <= end:
+            t, kind, n = _header.unpack_from(buf, pos)
+            if pos + hsize + n > end:
+                return
+            yield (t, kind, buf[pos+hsize:pos+hsize+n])
+            pos += hsize + n
+
+    def _iter_compressed(self, m, pos):
+        d = zlib.decompressobj()
+        pending = ""
+        while pos < len(m):
+            try:
+                pending += d.decompress(m[pos:pos+self.WINDOW])
+            except zlib.error:
+                # Truncated log
+                break
+            pos += self.WINDOW
+
+            consumed = 0
+            for t, kind, data in self._iter_records(pending, 0, len(pending)):
+                consumed += _header.size + len(data)
+                yield (t, kind, data)
+            pending = pending[consumed:]
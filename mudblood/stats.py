@@ -0,0 +1,45 @@
+import json
+
+class Stats:
+    """
+        Call counts, cumulative and maximum time for the hot paths of a
+        session. Instrumented code checks Stats.enabled first, so there is
+        next to no overhead while it is off.
+
+        Counters are updated without locking, so under heavy load from
+        several threads a few calls may be lost.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.entries = {}
+
+    def add(self, name, duration):
+        """
+            Count a call to name that took duration seconds.
+        """
+        e = self.entries.get(name)
+        if e is None:
+            e = self.entries.setdefault(name, [0, 0.0, 0.0])
+        e[0] += 1
+        e[1] += duration
+        if duration > e[2]:
+            e[2] = duration
+
+    def reset(self):
+        self.entries = {}
+
+    def report(self):
+        """
+            @return     A list of strings, the most expensive entry first.
+        """
+        ret = ["%-40s %9s %10s %9s %9s" % ("", "calls", "total ms", "avg us", "max ms")]
+        for name, (calls, total, longest) in sorted(self.entries.iteritems(),
+                                                    key=lambda e: e[1][1], reverse=True):
+            ret.append("%-40s %9d %10.1f %9.1f %9.2f" % (name[:40], calls, total * 1000,
+                                                         total / calls * 1e6, longest * 1000))
+        return ret
+
+    def to_json(self):
+        return json.dumps(dict([(name, {"calls": c, "total": t, "max": m})
+                                for name, (c, t, m) in self.entries.iteritems()]),
+                          indent=2, sort_keys=True)
@@ -0,0 +1,280 @@
+import zlib
+
+# Commands
+IAC     = 255
+DONT    = 254
+DO      = 253
+WONT    = 252
+WILL    = 251
+SB      = 250
+GA      = 249
+NOP     = 241
+SE      = 240
+EOR     = 239
+
+# Options
+TELOPT_EOR = 25
+CHARSET = 42
+MSDP    = 69
+MCCP2   = 86
+GMCP    = 201
+
+IAC_C = chr(IAC)
+
+# Parser states
+S_DATA, S_IAC, S_NEG, S_SB, S_SB_IAC = range(5)
+
+def escape(data):
+    """
+        Double IAC bytes in data that is sent to the server.
+    """
+    return data.replace(IAC_C, IAC_C + IAC_C)
+
+def subnegotiation(option, data):
+    """
+        @return     The bytes for IAC SB option data IAC SE.
+    """
+    return "%c%c%c%s%c%c" % (IAC, SB, option, escape(data), IAC, SE)
+
+class TelnetProtocol:
+    """
+        Incremental telnet parser. feed() takes data as it comes from the
+        socket and returns the application data, with all telnet commands
+        removed. Replies to option negotiation are handed to the write
+        function.
+
+        MCCP2 is supported: when the server starts compression, everything
+        after the start marker is inflated before parsing, until the
+        compressed stream ends. Other server options can be supported with
+        register().
+
+        GA and EOR mark the end of a prompt. feed() returns the data split at
+        these marks and at subnegotiations, so that the caller can handle
+        everything in the order the server sent it.
+    """
+    class CompressionError(Exception):
+        pass
+
+    def __init__(self, write, mccp=True):
+        """
+            @param write    Function that sends raw bytes to the server.
+            @param mccp     Accept MCCP2 if the server offers it.
+        """
+        self.write = write
+
+        # Server options we agree to, and those that are in effect
+        self.accept = set([TELOPT_EOR])
+        if mccp:
+            self.accept.add(MCCP2)
+        self.remote = set()
+        # Our own options that the server may enable, and those in effect
+        self.local_accept = set()
+        self.local = set()
+        self.handlers = {}
+
+        self.state = S_DATA
+        self.command = 0
+        self.sb = []
+
+        self.decompressor = None
+
+        self.bytes_received = 0
+        self.bytes_compressed = 0
+        self.bytes_inflated = 0
+        self.bytes_data = 0
+        self.prompt_marks = 0
+
+    def register(self, option, enabled, received, local=False):
+        """
+            Accept a server option.
+
+            @param enabled      Function called when the option is turned on.
+            @param received     Function called with the payload of every
+                                subnegotiation for the option.
+            @param local        Also agree when the server asks us to enable
+                                the option (DO).
+        """
+        self.accept.add(option)
+        if local:
+            self.local_accept.add(option)
+        self.handlers[option] = (enabled, received)
+
+    def compressing(self):
+        return self.decompressor is not None
+
+    def feed(self, data):
+        """
+            @return     The application data contained in data, as a list of
+                        strings. Between two strings there is either None
+                        for a GA or EOR, or a tuple (fun, payload) for a
+                        subnegotiation: the caller calls fun(payload) at that
+                        point. Usually this is a list with one element.
+        """
+        self.bytes_received += len(data)
+        out = []
+
+        while data:
+            if self.decompressor:
+                try:
+                    plain = self.decompressor.decompress(data)
+                except zlib.error, e:
+                    self.decompressor = None
+                    raise self.CompressionError("Corrupt compressed stream: %s" % e)
+                # Data after the end of the compressed stream is plain telnet.
+                rest = self.decompressor.unused_data
+                if rest or self._stream_ended():
+                    self.decompressor = None
+                self.bytes_compressed += len(data) - len(rest)
+                self.bytes_inflated += len(plain)
+                data = rest
+            else:
+                plain = data
+                data = ""
+
+            n = self._parse(plain, out)
+            if n < len(plain):
+                # Compression started in the middle of plain.
+                data = plain[n:] + data
+
+        ret = []
+        start = 0
+        for i in range(len(out)):
+            if not isinstance(out[i], str):
+                text = "".join(out[start:i])
+                self.bytes_data += len(text)
+                ret.append(text)
+                ret.append(out[i])
+                start = i + 1
+        text = "".join(out[start:])
+        self.bytes_data += len(text)
+        ret.append(text)
+        return ret
+
+    def _stream_ended(self):
+        """
+            zlib in Python 2 has no end of stream flag. If the stream has
+            ended, a copy of the decompressor leaves another byte unused.
+        """
+        try:
+            probe = self.decompressor.copy()
+            probe.decompress("\0")
+        except zlib.error:
+            return False
+        return probe.unused_data != ""
+
+    def _parse(self, buf, out):
+        """
+            Parse buf and append application data to out.
+
+            @return     The number of bytes consumed. Parsing stops early
+                        when compression starts.
+        """
+        i = 0
+        n = len(buf)
+        while i < n:
+            st = self.state
+            if st == S_DATA:
+                j = buf.find(IAC_C, i)
+                if j < 0:
+                    out.append(buf[i:])
+                    return n
+                if j > i:
+                    out.append(buf[i:j])
+                self.state = S_IAC
+                i = j + 1
+            elif st == S_IAC:
+                c = ord(buf[i])
+                i += 1
+                if c == IAC:
+                    out.append(IAC_C)
+                    self.state = S_DATA
+                elif c in (DO, DONT, WILL, WONT):
+                    self.command = c
+                    self.state = S_NEG
+                elif c == SB:
+                    self.sb = []
+                    self.state = S_SB
+                elif c == GA or c == EOR:
+                    out.append(None)
+                    self.prompt_marks += 1
+                    self.state = S_DATA
+                else:
+                    self.state = S_DATA
+            elif st == S_NEG:
+                self.state = S_DATA
+                self._negotiate(self.command, ord(buf[i]))
+                i += 1
+            elif st == S_SB:
+                j = buf.find(IAC_C, i)
+                if j < 0:
+                    self.sb.append(buf[i:])
+                    return n
+                self.sb.append(buf[i:j])
+                self.state = S_SB_IAC
+                i = j + 1
+            elif st == S_SB_IAC:
+                c = ord(buf[i])
+                i += 1
+                if c == IAC:
+                    self.sb.append(IAC_C)
+                    self.state = S_SB
+                else:
+                    # SE, or a broken sequence that we treat as its end
+                    self.state = S_DATA
+                    if self._subnegotiation("".join(self.sb), out):
+                        return i
+        return n
+
+    def _negotiate(self, command, option):
+        if command == WILL:
+            if option in self.accept:
+                if option not in self.remote:
+                    self.remote.add(option)
+                    self.write(IAC_C + chr(DO) + chr(option))
+                    if option in self.handlers:
+                        self.handlers[option][0]()
+            else:
+                self.write(IAC_C + chr(DONT) + chr(option))
+        elif command == WONT:
+            if option in self.remote:
+                self.remote.discard(option)
+                self.write(IAC_C + chr(DONT) + chr(option))
+        elif command == DO:
+            if option in self.local_accept:
+                if option not in self.local:
+                    self.local.add(option)
+                    self.write(IAC_C + chr(WILL) + chr(option))
+                    self.handlers[option][0]()
+            else:
+                self.write(IAC_C + chr(WONT) + chr(option))
+        elif command == DONT:
+            if option in self.local:
+                self.local.discard(option)
+                self.write(IAC_C + chr(WONT) + chr(option))
+
+    def _subnegotiation(self, data, out):
+        """
+            Append the handler call for a subnegotiation to out.
+
+            @return     True if compression starts after this subnegotiation.
+        """
+        if not data:
+            return False
+        option = ord(data[0])
+        if option == MCCP2 and option in self.remote:
+            self.decompressor = zlib.decompressobj()
+            return True
+        if option in self.handlers and (option in self.remote or option in self.local):
+            out.append((self.handlers[option][1], data[1:]))
+        return False
+
+    def stats(self):
+        s = "%d bytes received" % self.bytes_received
+        if self.bytes_compressed:
+            s += ", %d compressed bytes inflated to %d (%.1fx)" % (
+                    self.bytes_compressed, self.bytes_inflated,
+                    float(self.bytes_inflated) / self.bytes_compressed)
+        s += ", %d bytes of text, %d prompt marks" % (self.bytes_data, self.prompt_marks)
+        if self.compressing():
+            s += ". MCCP2 active."
+        return s
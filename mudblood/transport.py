@@ -0,0 +1,289 @@
+import time
+import errno
+import socket
+import select
+import threading
+
+from eventloop import EventLoop, default_loop
+from sessionlog import LogReader, INPUT, OUTPUT, PROMPT, CHARSET, OOB
+from oob import decode_gmcp
+
+class SocketTransport:
+    """
+        Base class for transports that talk to a server over TCP. Data read
+        from the socket is handed to the session as is; telnet processing
+        happens in the session.
+    """
+    # Maximum number of bytes read from the socket at once
+    READ_SIZE = 65536
+
+    def __init__(self, session):
+        self.session = session
+        self.sock = None
+        self.write_lock = threading.Lock()
+
+    def connect(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        # Commands are tiny and should go out at once.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, data):
+        with self.write_lock:
+            self.sock.sendall(data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+    def read(self):
+        """
+            @return     The data read from the socket, "" if it was closed,
+                        None if a non-blocking socket had nothing to read.
+        """
+        try:
+            return self.sock.recv(self.READ_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return None
+            return ""
+
+    def _stdin_written(self):
+        """
+            Listener of the session's stdin, for subclasses with a loop.
+        """
+        self.loop.call_soon(self._drain_stdin)
+
+    def _drain_stdin(self):
+        if not self.session.connected:
+            return
+        data = self.session.stdin.read()
+        if data != "":
+            self.session._send(data)
+
+class ThreadTransport(SocketTransport):
+    """
+        Talks to the server with two threads per session: one blocks on the
+        socket, the other one runs an event loop of its own for the session's
+        stdin, its command queue and its timers. Writes block only that
+        thread, so a slow server doesn't hold up other sessions.
+    """
+    def __init__(self, session):
+        SocketTransport.__init__(self, session)
+        self.loop = EventLoop()
+
+        self.input_thread = threading.Thread(None, self._input_run)
+        self.input_thread.daemon = True
+
+    def start(self):
+        self.session.stdin.listener = self._stdin_written
+        self.input_thread.start()
+        self.loop.start()
+        if self.session.stdin.has_data():
+            self.loop.call_soon(self._drain_stdin)
+
+    def close(self):
+        self.session.stdin.listener = None
+        self.loop.stop()
+        SocketTransport.close(self)
+
+    def _input_run(self):
+        """
+            Thread function that reads data from the server.
+        """
+        while self.session.connected:
+            if self.session.framer.pending():
+                try:
+                    r, _, _ = select.select([self.sock], [], [], self.session.prompt_timeout)
+                except (select.error, socket.error), e:
+                    r = [self.sock]
+                if not r:
+                    self.session._flush_partial()
+
+            data = self.read()
+            if data == "":
+                self.session._flush_partial()
+                self.session._closed()
+                self.loop.stop()
+                break
+
+            self.session._receive_raw(data)
+
+class LoopTransport(SocketTransport):
+    """
+        Talks to the server from an event loop that is shared by all sessions.
+        No threads are created per session.
+
+        The socket is non-blocking, so a server that stops reading can't stall
+        the loop: whatever it doesn't take at once is buffered and sent when
+        the socket becomes writable again.
+    """
+    def __init__(self, session, loop=None):
+        SocketTransport.__init__(self, session)
+        self.loop = loop or default_loop()
+        self.fd = None
+        self.partial_timer = None
+        self.write_buffer = ""
+
+    def connect(self, host, port):
+        SocketTransport.connect(self, host, port)
+        self.sock.setblocking(0)
+        self.fd = self.sock.fileno()
+
+    def write(self, data):
+        """
+            May be called from any thread.
+        """
+        with self.write_lock:
+            if self.write_buffer:
+                self.write_buffer += data
+                return
+            sent = self._send_some(data)
+            if sent < len(data):
+                self.write_buffer = data[sent:]
+                self.loop.add_writer(self.fd, self._writable)
+
+    def _send_some(self, data):
+        """
+            @return     The number of bytes the socket took.
+        """
+        try:
+            return self.sock.send(data)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise
+
+    def _writable(self):
+        with self.write_lock:
+            try:
+                sent = self._send_some(self.write_buffer)
+            except socket.error, e:
+                # The reader will notice that the connection is gone.
+                sent = len(self.write_buffer)
+            self.write_buffer = self.write_buffer[sent:]
+            if not self.write_buffer:
+                self.loop.remove_writer(self.fd)
+
+    def start(self):
+        self.session.stdin.listener = self._stdin_written
+        self.loop.add_reader(self.fd, self._readable)
+        self.loop.start()
+        if self.session.stdin.has_data():
+            self.loop.call_soon(self._drain_stdin)
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        self.session.stdin.listener = None
+        SocketTransport.close(self)
+
+    def _readable(self):
+        data = self.read()
+        if data is None:
+            return
+
+        if self.partial_timer:
+            self.partial_timer.cancel()
+            self.partial_timer = None
+
+        if data == "":
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+            self.session._flush_partial()
+            self.session._closed()
+            return
+
+        self.session._receive_raw(data)
+
+        if self.session.framer.pending():
+            self.partial_timer = self.loop.call_later(self.session.prompt_timeout,
+                                                      self.session._flush_partial)
+
+class ReplayTransport:
+    """
+        Feeds a recorded session log (see sessionlog.LogRecorder) through the
+        session instead of talking to a server. Received data goes through
+        the input hooks, recorded commands through the automapper and
+        GMCP/MSDP updates to the OOB subscribers.
+
+        The log is read from mud.replay_file. mud.replay_speed scales the
+        original timing; 0 replays as fast as possible.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.reader = None
+        self.speed = 1.0
+
+        self.input_thread = threading.Thread(None, self._input_run)
+        self.output_thread = threading.Thread(None, self._output_run)
+        self.input_thread.daemon = True
+        self.output_thread.daemon = True
+
+    def connect(self, host, port):
+        mud = self.session.mud
+        self.reader = LogReader(mud.replay_file)
+        self.speed = getattr(mud, "replay_speed", 1.0)
+
+    def start(self):
+        self.input_thread.start()
+        self.output_thread.start()
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        self.session.connected = False
+
+    def _input_run(self):
+        session = self.session
+        start = time.time()
+        last = 0.0
+
+        for t, kind, data in self.reader:
+            if not session.connected:
+                return
+
+            # Flush prompts just like the live transports would have.
+            if t - last > session.prompt_timeout:
+                session._flush_partial()
+            last = t
+
+            if self.speed > 0:
+                delay = start + t / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if kind == INPUT:
+                session._receive(data)
+            elif kind == OUTPUT:
+                session._sent(data.decode(session.charset.encoding, "replace"), data)
+            elif kind == PROMPT:
+                session._prompt()
+            elif kind == CHARSET:
+                session.charset.set_encoding(data)
+            elif kind == OOB:
+                session.oob.publish(*decode_gmcp(data))
+
+        session._flush_partial()
+        session._closed()
+
+    def _output_run(self):
+        while self.session.connected:
+            data = self.session.stdin.read(True)
+            self.session._send(data)
+
+transports = {
+        "thread": ThreadTransport,
+        "loop":   LoopTransport,
+        "replay": ReplayTransport,
+        }
+
+def create_transport(name, session):
+    try:
+        cls = transports[name]
+    except KeyError:
+        raise ValueError("Unknown transport: %s" % name)
+    return cls(session)
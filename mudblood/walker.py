@@ -0,0 +1,236 @@
+import re
+import time
+import threading
+
+from collections import deque
+
+from outqueue import CommandQueue
+
+class Walker:
+    """
+        Walks to a room along the shortest path without flooding the server.
+
+        Up to window moves are in flight at once. Once it has been sent,
+        each one is confirmed by the next prompt marked by the server (GA,
+        EOR or the prompt pattern) or, if the server sends room IDs (GMCP
+        Room.Info or MSDP ROOM_VNUM), by the next room update. A line
+        matching the failure pattern marks the oldest move in flight as
+        failed, as does arriving in an unexpected room. Then the walker waits
+        for the other moves in flight, puts the mapper back to the room we
+        really are in and plans a new path from there.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.RLock()
+        self.active = False
+
+        self.target = None
+        self.path = deque()
+        self.inflight = deque()
+        self.sent = deque()
+        self.pos = None
+        self.failed = False
+        self.fail_seen = False
+        self.use_rooms = False
+
+        self.start_time = 0
+        self.steps = 0
+        self.failures = 0
+        self.replans = 0
+
+    def start(self, target):
+        """
+            Start walking to target.
+
+            @return     A message for the user.
+        """
+        mud = self.session.mud
+        mapper = self.session.mapper
+
+        self.stop()
+        path = mapper.find_shortest_path(target)
+        if path is None:
+            return "No path found."
+        if not path:
+            return "You are already there."
+
+        with self.lock:
+            self.window = max(1, getattr(mud, "walk_window", 3))
+            pattern = getattr(mud, "walk_fail_pattern", None)
+            self.fail_re = pattern and re.compile(pattern) or None
+            self.timeout = getattr(mud, "walk_timeout", 5)
+            self.retries = getattr(mud, "walk_retries", 3)
+
+            oob = self.session.oob
+            self.use_rooms = "Room.Info" in oob.values or "ROOM_VNUM" in oob.values
+            if self.use_rooms:
+                oob.subscribe("Room.Info", self._room)
+                oob.subscribe("ROOM_VNUM", self._room)
+
+            self.target = target
+            self.path = deque(path)
+            self.inflight.clear()
+            self.sent.clear()
+            self.pos = mapper.map.current_room
+            self.failed = False
+            self.fail_seen = False
+            self.start_time = time.time()
+            self.steps = 0
+            self.failures = 0
+            self.replans = 0
+            self.active = True
+
+            self._advance()
+        return "Walking %d steps." % len(path)
+
+    def stop(self, message=None):
+        """
+            Stop walking. Moves that were already sent are not taken back:
+            the server still makes them, so they stay applied to the map.
+        """
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+            self.path.clear()
+            self.inflight.clear()
+            self.sent.clear()
+            self.session.commands.clear(CommandQueue.BULK)
+            self.session.cancel_timers("walker")
+            if self.use_rooms:
+                self.session.oob.unsubscribe("Room.Info", self._room)
+                self.session.oob.unsubscribe("ROOM_VNUM", self._room)
+
+        if message:
+            self.session._report_info("Walk: %s %s" % (message, self.report()))
+
+    def line_sent(self, l):
+        """
+            Called by the session for every line sent while walking, after
+            the mapper has seen it.
+        """
+        with self.lock:
+            if len(self.sent) >= len(self.inflight) or l != self.inflight[len(self.sent)]:
+                return
+            d = self.inflight[len(self.sent)]
+            room = self.sent and self.sent[-1] or self.pos
+            e = room and room.get_exit(d)
+            room = e and e.to(room)
+            self.sent.append(room)
+            if self.use_rooms:
+                self.session.mapper.expected_rooms.append(room)
+
+    def line(self, l):
+        """
+            Called by the session for every line while walking.
+        """
+        if self.fail_re and self.fail_re.search(l):
+            with self.lock:
+                if self.use_rooms:
+                    self._resolve(False)
+                elif self.sent:
+                    self.fail_seen = True
+
+    def prompt(self):
+        """
+            Called by the session for every prompt marked by the server
+            while walking.
+        """
+        if self.use_rooms:
+            return
+        with self.lock:
+            ok = not self.fail_seen
+            self.fail_seen = False
+            self._resolve(ok)
+
+    def _room(self, session, name, value):
+        with self.lock:
+            if not self.active or not self.sent:
+                return
+            if isinstance(value, dict):
+                value = value.get("num")
+            if value is None or value == "":
+                return
+            if not isinstance(value, basestring):
+                value = str(value)
+            self._resolve(True, session.mapper.map.find_server_room(value))
+
+    def _resolve(self, ok, room=None):
+        """
+            The oldest move that was sent succeeded or failed.
+
+            @param room     The room the server says we are in now, if known.
+        """
+        if not self.active or not self.sent:
+            return
+        d = self.inflight.popleft()
+        self.sent.popleft()
+
+        if ok:
+            self.steps += 1
+            e = self.pos.get_exit(d)
+            expected = e and e.to(self.pos)
+            if room is not None:
+                if room is not expected:
+                    self.failed = True
+                self.pos = room
+            elif expected:
+                self.pos = expected
+        else:
+            self.failures += 1
+            self.failed = True
+            if self.use_rooms:
+                # No room update will come for this move, and the mapper's
+                # guesses for the moves behind it are wrong now.
+                expected_rooms = self.session.mapper.expected_rooms
+                if expected_rooms:
+                    expected_rooms.popleft()
+                for i in range(len(expected_rooms)):
+                    expected_rooms[i] = None
+
+        self.session.cancel_timers("walker")
+        self._advance()
+
+    def _advance(self):
+        if self.failed:
+            if self.inflight:
+                return
+            self.failed = False
+            # Every move we sent has been answered, so this is where we are.
+            self.session.mapper.map.current_room = self.pos
+            if self.pos is self.target:
+                self.path.clear()
+            else:
+                if self.replans >= self.retries:
+                    self.stop("Giving up after %d re-plans." % self.replans)
+                    return
+                self.replans += 1
+                path = self.session.mapper.find_shortest_path(self.target)
+                if not path:
+                    self.stop("No path from here.")
+                    return
+                self.path = deque(path)
+
+        if not self.path and not self.inflight:
+            self.stop("Arrived.")
+            return
+
+        send = []
+        while self.path and len(self.inflight) < self.window:
+            d = self.path.popleft()
+            self.inflight.append(d)
+            send.append(d)
+        if send:
+            self.session.send("\n".join(send) + "\n", CommandQueue.BULK)
+
+        if self.inflight:
+            self.session.after(self.timeout, self._timeout, "walker")
+
+    def _timeout(self, session):
+        self.stop("No confirmation for %gs, stopped." % self.timeout)
+
+    def report(self):
+        elapsed = time.time() - self.start_time
+        return "%d steps in %.1fs (%.1f steps/s), %d failed, %d re-plans" % (
+                self.steps, elapsed, elapsed and self.steps / elapsed or 0.0,
+                self.failures, self.replans)
@@ -0,0 +1,115 @@
+import time
+import threading
+import traceback
+
+from collections import deque
+
+class WorkerPool:
+    """
+        A bounded pool of worker threads for slow hook actions.
+
+        Every job is submitted with a key (usually the hook object). Jobs with
+        the same key run one after another in the order they were submitted,
+        jobs with different keys may run in parallel.
+    """
+    def __init__(self, size=4, error_callback=None):
+        """
+            @param size             Maximum number of worker threads.
+            @param error_callback   Called with a traceback string when a job
+                                    raises an exception.
+        """
+        self.size = size
+        self.error_callback = error_callback
+
+        self.lock = threading.Condition()
+        self.queues = {}
+        self.ready = deque()
+        self.threads = []
+        self.idle = 0
+
+        # Statistics
+        self.queued = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.run_time = 0.0
+        self.max_run = 0.0
+
+    def submit(self, key, fun, *args):
+        """
+            Run fun(*args) on a worker thread.
+        """
+        with self.lock:
+            if key in self.queues:
+                self.queues[key].append((time.time(), fun, args))
+            else:
+                self.queues[key] = deque([(time.time(), fun, args)])
+                self.ready.append(key)
+
+            self.submitted += 1
+            self.queued += 1
+            if self.queued > self.max_queued:
+                self.max_queued = self.queued
+
+            if self.idle == 0 and len(self.threads) < self.size:
+                t = threading.Thread(None, self._run)
+                t.daemon = True
+                self.threads.append(t)
+                t.start()
+
+            self.lock.notify()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.ready:
+                    self.idle += 1
+                    self.lock.wait()
+                    self.idle -= 1
+
+                # The key stays in self.queues while its job runs, but not in
+                # self.ready, so no other worker picks up the next job.
+                key = self.ready.popleft()
+                submitted, fun, args = self.queues[key].popleft()
+                self.queued -= 1
+
+            start = time.time()
+            failed = False
+            try:
+                fun(*args)
+            except Exception:
+                failed = True
+                if self.error_callback:
+                    self.error_callback(traceback.format_exc())
+            end = time.time()
+
+            with self.lock:
+                if self.queues[key]:
+                    self.ready.append(key)
+                    self.lock.notify()
+                else:
+                    del self.queues[key]
+
+                self.completed += 1
+                if failed:
+                    self.failed += 1
+                self.wait_time += start - submitted
+                self.max_wait = max(self.max_wait, start - submitted)
+                self.run_time += end - start
+                self.max_run = max(self.max_run, end - start)
+
+    def stats(self):
+        """
+            @return     A string with queue depth and latency figures.
+        """
+        with self.lock:
+            n = self.completed or 1
+            return ("threads: %d/%d, queued: %d (max %d), submitted: %d, completed: %d, failed: %d\n"
+                    "wait: avg %.1fms, max %.1fms; run: avg %.1fms, max %.1fms") % (
+                    len(self.threads), self.size, self.queued, self.max_queued,
+                    self.submitted, self.completed, self.failed,
+                    self.wait_time / n * 1000, self.max_wait * 1000,
+                    self.run_time / n * 1000, self.max_run * 1000)